@@ -25,7 +25,7 @@ def attach_to_register(cli):
                   type=click.STRING,
                   required=True,
                   callback=utils.optional_choice,
-                  envvar=project.config.get('possible_locations') or [],
+                  envvar=utils.ConfigOptions('possible_locations'),
                   help='The location of the recording, i.e. "room1".'
                   )
     @click.option('--action-id',
@@ -50,7 +50,7 @@ def attach_to_register(cli):
                   multiple=True,
                   type=click.STRING,
                   callback=utils.optional_choice,
-                  envvar=project.config.get('possible_tags') or [],
+                  envvar=utils.ConfigOptions('possible_tags'),
                   help='Add tags to action.',
                   )
     @click.option('--get-inp',
@@ -77,10 +77,15 @@ def attach_to_register(cli):
                   is_flag=True,
                   help='Overwrite modules or not.',
                   )
+    @click.option('--n-jobs',
+                  type=click.INT,
+                  default=1,
+                  help='Number of processes converting tracking, LFP, spikes and inputs at the same time.',
+                  )
     def _register_axona_recording(
         action_id, axona_filename, depth, user, overwrite, templates,
         entity_id, location, message, tag, get_inp, no_cut, cluster_group,
-        set_zero_cluster_to_noise, register_depth):
+        set_zero_cluster_to_noise, register_depth, n_jobs):
         axona.register_axona_recording(
             project=project,
             action_id=action_id,
@@ -98,7 +103,8 @@ def attach_to_register(cli):
             cluster_group=cluster_group,
             set_zero_cluster_to_noise=set_zero_cluster_to_noise,
             register_depth=register_depth,
-            correct_depth_answer=None)
+            correct_depth_answer=None,
+            n_jobs=n_jobs)
 
 def attach_to_process(cli):
     @cli.command('axona', short_help='Spikesort with klustakwik.')
@@ -0,0 +1,64 @@
+from expipe_plugin_cinpla.imports import *
+from expipe_plugin_cinpla.scripts import bulk, action_index
+from . import utils
+
+
+def attach_to_register(cli):
+    @cli.command('bulk',
+                 short_help='Register all recordings in a directory tree.')
+    @click.argument('root', type=click.Path(exists=True))
+    @click.option('-s', '--system',
+                  multiple=True,
+                  type=click.Choice(list(bulk.REGISTER_FUNCTIONS)),
+                  help='Acquisition systems to look for, all by default.',
+                  )
+    @click.option('-u', '--user',
+                  type=click.STRING,
+                  help='The experimenter performing the recordings.',
+                  )
+    @click.option('-l', '--location',
+                  type=click.STRING,
+                  callback=utils.optional_choice,
+                  envvar=utils.ConfigOptions('possible_locations'),
+                  help='The location of the recordings, i.e. "room-1-ibv".'
+                  )
+    @click.option('-t', '--tag',
+                  multiple=True,
+                  type=click.STRING,
+                  callback=utils.optional_choice,
+                  envvar=utils.ConfigOptions('possible_tags'),
+                  help='Add tags to the actions.',
+                  )
+    @click.option('--templates',
+                  multiple=True,
+                  type=click.STRING,
+                  help='Which templates to add',
+                  )
+    @click.option('--register-depth',
+                  is_flag=True,
+                  help='Register depth from the adjustments without asking.',
+                  )
+    @click.option('--max-workers',
+                  type=click.INT,
+                  default=2,
+                  help='Maximum number of recordings registered at the same time.',
+                  )
+    @click.option('--io-limit',
+                  type=click.INT,
+                  default=1,
+                  help='Maximum number of recordings read from the same disk at the same time.',
+                  )
+    @click.option('--dry-run',
+                  is_flag=True,
+                  help='Only show the planned action ids.',
+                  )
+    def _register_bulk(root, system, user, location, tag, templates, register_depth, max_workers,
+                       io_limit, dry_run):
+        sessions = bulk.find_sessions(root, systems=list(system) or None)
+        registered = action_index.get_index(project).datetimes()
+        sessions = bulk.plan_sessions(sessions, registered=registered)
+        if not dry_run:
+            bulk.register_sessions(
+                project, sessions, user=user, location=location, tag=tag, templates=templates,
+                register_depth=register_depth, max_workers=max_workers, io_limit=io_limit)
+        bulk.print_report(sessions)
@@ -1,16 +1,22 @@
 from expipe_plugin_cinpla.imports import *
-from expipe_plugin_cinpla.scripts import curation
-import spikesorters as ss
 from . import utils
 
 
+@lazy_import
+def curation():
+    # heavy dependencies, imported when the command runs
+    from expipe_plugin_cinpla.scripts import curation
+    return curation
+
+
 def attach_to_process(cli):
     @cli.command('phy2exdir',
                  short_help='Save curation output to exdir.')
     @click.argument('action-id', type=click.STRING)
     @click.option('--sorter',
                   default='kilosort2',
-                  type=click.Choice([s.sorter_name for s in ss.sorter_full_list]),
+                  type=click.STRING,
+                  callback=utils.validate_sorter,
                   help='Spike sorter software to be used.',
                   )
     @click.option('--check-exists',
@@ -25,7 +25,7 @@ def attach_to_cli(cli):
     @click.option('--cell_line',
                   type=click.STRING,
                   callback=utils.optional_choice,
-                  envvar=project.config.get('possible_cell_lines') or [],
+                  envvar=utils.ConfigOptions('possible_cell_lines'),
                   help='Add cell line to entity.',
                   )
     @click.option('--developmental-stage',
@@ -78,7 +78,7 @@ def attach_to_cli(cli):
                   multiple=True,
                   type=click.STRING,
                   callback=utils.optional_choice,
-                  envvar=project.config.get('possible_tags') or [],
+                  envvar=utils.ConfigOptions('possible_tags'),
                   help='Add tags to entity.',
                   )
     @click.option('--overwrite',
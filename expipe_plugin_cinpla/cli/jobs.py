@@ -0,0 +1,107 @@
+from expipe_plugin_cinpla.imports import *
+from expipe_plugin_cinpla.scripts import jobs
+
+
+def attach_to_cli(cli):
+    @cli.group(short_help='Queue and run processing jobs.')
+    @click.help_option('-h', '--help')
+    @click.pass_context
+    def queue(ctx):
+        pass
+
+    @queue.command('add', short_help='Add actions to the processing queue.')
+    @click.argument('kind', type=click.Choice(list(jobs.PROCESSORS)))
+    @click.argument('action-ids', type=click.STRING, nargs=-1)
+    @click.option('--sorter',
+                  multiple=True,
+                  type=click.STRING,
+                  help='Spike sorter software to be used.',
+                  )
+    @click.option('--probe-path',
+                  type=click.STRING,
+                  help='Path to probefile, assumed to be in expipe config directory by default.',
+                  )
+    @click.option('--no-sorting',
+                  is_flag=True,
+                  help='if True spikesorting is not performed.',
+                  )
+    @click.option('--no-lfp',
+                  is_flag=True,
+                  help='if True LFP are not extracted.',
+                  )
+    @click.option('--no-mua',
+                  is_flag=True,
+                  help='if True MUA are not extracted.',
+                  )
+    @click.option('--params',
+                  type=click.STRING,
+                  default=None,
+                  help='Path to yml file with other processing arguments.',
+                  )
+    @click.option('--ram',
+                  type=click.FLOAT,
+                  default=4,
+                  help='Memory estimate of each job in GB.',
+                  )
+    def add(kind, action_ids, sorter, probe_path, no_sorting, no_lfp, no_mua, params, ram):
+        kwargs = {}
+        if params is not None:
+            with open(params, 'r') as f:
+                kwargs.update(yaml.safe_load(f) or {})
+        kwargs.update({'sorter': list(sorter) or ['klusta'], 'probe_path': probe_path,
+                       'spikesort': not no_sorting, 'compute_lfp': not no_lfp,
+                       'compute_mua': not no_mua})
+        queue = jobs.get_queue(project)
+        for action_id in action_ids:
+            job_id = queue.add(kind, action_id, params=kwargs, ram_gb=ram)
+            print('Job', job_id, action_id, queue.get(job_id)['status'])
+
+    @queue.command('run', short_help='Run the queued jobs.')
+    @click.option('--max-workers',
+                  type=click.INT,
+                  default=2,
+                  help='Maximum number of jobs running at the same time.',
+                  )
+    @click.option('--max-sorts',
+                  type=click.INT,
+                  default=1,
+                  help='Maximum number of jobs with spike sorting running at the same time.',
+                  )
+    @click.option('--ram-budget',
+                  type=click.FLOAT,
+                  default=None,
+                  help='Maximum memory in GB of the running jobs.',
+                  )
+    def run(max_workers, max_sorts, ram_budget):
+        queue = jobs.get_queue(project)
+        jobs.run_queue(queue, project_path=queue.path.parent, max_workers=max_workers,
+                       max_sorts=max_sorts, ram_budget_gb=ram_budget)
+
+    @queue.command('status', short_help='Show the processing jobs.')
+    @click.option('--status',
+                  type=click.Choice(['pending', 'running', 'done', 'failed']),
+                  default=None,
+                  help='Only show jobs with this status.',
+                  )
+    @click.option('--errors',
+                  is_flag=True,
+                  help='Show the error of failed jobs.',
+                  )
+    def status(status, errors):
+        queue = jobs.get_queue(project)
+        for job in queue.jobs(status=status):
+            elapsed = ''
+            if job['started'] is not None and job['finished'] is not None:
+                elapsed = '{:.0f} s'.format(job['finished'] - job['started'])
+            print('{:>4}  {:<10} {:<25} {:<8} {}'.format(
+                job['id'], job['kind'], job['action_id'], job['status'], elapsed))
+            if errors and job['error']:
+                print(job['error'])
+
+    @queue.command('retry', short_help='Set failed jobs to pending.')
+    def retry():
+        jobs.get_queue(project).reset('failed')
+
+    @queue.command('clean', short_help='Remove done jobs from the queue.')
+    def clean():
+        jobs.get_queue(project).remove('done')
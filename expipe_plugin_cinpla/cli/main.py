@@ -10,6 +10,8 @@ from . import surgery
 from . import psychopy as PS
 from . import misc
 from . import curation
+from . import jobs
+from . import bulk
 
 
 class CinplaPlugin(IPlugin):
@@ -27,6 +29,7 @@ class CinplaPlugin(IPlugin):
             pass
 
         misc.attach_to_cli(cli)
+        jobs.attach_to_cli(cli)
         adjust.attach_to_cli(cli)
         surgery.attach_to_cli(register)
         entity.attach_to_cli(register)
@@ -36,5 +39,6 @@ class CinplaPlugin(IPlugin):
         IN.attach_to_register(register)
         IN.attach_to_process(process)
         AX.attach_to_register(register)
+        bulk.attach_to_register(register)
         AX.attach_to_process(process)
         curation.attach_to_process(process)
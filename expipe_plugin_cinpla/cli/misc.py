@@ -1,6 +1,7 @@
 from expipe_plugin_cinpla.imports import *
 from expipe_plugin_cinpla.scripts.utils import (
     register_templates, query_yes_no)
+from expipe_plugin_cinpla.scripts import cache, sorters, action_index
 from . import utils
 
 def attach_to_cli(cli):
@@ -10,7 +11,7 @@ def attach_to_cli(cli):
                     multiple=True,
                     type=click.STRING,
                     callback=utils.optional_choice,
-                    envvar=project.config.get('possible_tags') or [],
+                    envvar=utils.ConfigOptions('possible_tags'),
                     help='Add tags to action.',
                     )
     @click.option('--message', '-m',
@@ -63,3 +64,82 @@ def attach_to_cli(cli):
         current_servers.append(new_server)
         config['servers'] = current_servers
         expipe.config._dump_config_by_name(path, config)
+
+    @cli.command('cache', short_help='Inspect and prune the preprocessing cache.')
+    @click.option('--prune',
+                  is_flag=True,
+                  help='Remove the least recently used entries above the size limit.',
+                  )
+    @click.option('--max-size',
+                  type=click.FLOAT,
+                  default=None,
+                  help='Size limit in GB used with "--prune", default from the "cache_size_gb" config.',
+                  )
+    @click.option('--clear',
+                  is_flag=True,
+                  help='Remove all entries.',
+                  )
+    def preprocessing_cache(prune, max_size, clear):
+        """List, prune or clear cached filtered data."""
+        preprocessing_cache = cache.get_cache(project)
+        if preprocessing_cache is None:
+            print('Filtered data is not cached, set "cache_folder" (and "cache_size_gb") in the project config.')
+            return
+        if clear:
+            preprocessing_cache.clear()
+        elif prune:
+            for entry in preprocessing_cache.prune(max_size_gb=max_size):
+                print('Removed', entry['key'], entry['description'])
+        entries = preprocessing_cache.entries()
+        print('Cache folder:', preprocessing_cache.folder)
+        for entry in entries:
+            last_access = datetime.datetime.fromtimestamp(entry['last_access'])
+            print('{}  {:8.2f} GB  {:%Y-%m-%d %H:%M}  {}'.format(
+                entry['key'][:12], entry['size'] / 1e9, last_access, entry['description']))
+        print('{} entries, {:.2f} GB of {:.2f} GB'.format(
+            len(entries), sum(e['size'] for e in entries) / 1e9, preprocessing_cache.max_size_gb))
+
+    @cli.command('sorters', short_help='List the spike sorters in the sorter registry.')
+    @click.option('--refresh',
+                  is_flag=True,
+                  help='Import spikesorters and update the registry, e.g. after installing a sorter.',
+                  )
+    def list_sorters(refresh):
+        """List spike sorters, their installed status and default params."""
+        if refresh:
+            sorter_list = sorters.refresh_sorters()
+        else:
+            sorter_list = sorters.get_sorters()
+        print('Sorter registry:', sorters.DEFAULT_REGISTRY_FILE)
+        for sorter in sorter_list:
+            print('{:20} {:14} {} params'.format(
+                sorter['name'], 'installed' if sorter['installed'] else 'not installed',
+                len(sorter['default_params'])))
+
+    @cli.command('actions', short_help='List actions from the action index.')
+    @click.option('--type',
+                  'action_type',
+                  type=click.STRING,
+                  help='Only actions of this type.',
+                  )
+    @click.option('--entity-id',
+                  type=click.STRING,
+                  help='Only actions with this entity.',
+                  )
+    @click.option('-t', '--tag',
+                  type=click.STRING,
+                  help='Only actions with this tag.',
+                  )
+    @click.option('--since',
+                  type=click.DateTime(),
+                  help='Only actions recorded at or after this date.',
+                  )
+    @click.option('--until',
+                  type=click.DateTime(),
+                  help='Only actions recorded before this date.',
+                  )
+    def list_actions(action_type, entity_id, tag, since, until):
+        """List action ids, the index is updated with changed actions first."""
+        index = action_index.get_index(project)
+        for action_id in index.ids(type=action_type, entity=entity_id, tag=tag, start=since, stop=until):
+            print(action_id)
@@ -1,13 +1,13 @@
 from expipe_plugin_cinpla.imports import *
-from expipe_plugin_cinpla.scripts import openephys
-import spikesorters as ss
 from . import utils
-from distutils.version import StrictVersion
 
-if StrictVersion(yaml.__version__) >= StrictVersion('5.0.0'):
-    use_loader = True
-else:
-    use_loader = False
+
+@lazy_import
+def openephys():
+    # heavy dependencies, imported when the command runs
+    from expipe_plugin_cinpla.scripts import openephys
+    return openephys
+
 
 
 def attach_to_register(cli):
@@ -29,7 +29,7 @@ def attach_to_register(cli):
     @click.option('-l', '--location',
                   type=click.STRING,
                   callback=utils.optional_choice,
-                  envvar=project.config.get('possible_locations') or [],
+                  envvar=utils.ConfigOptions('possible_locations'),
                   help='The location of the recording, i.e. "room-1-ibv".'
                   )
     @click.option('--session',
@@ -53,7 +53,7 @@ def attach_to_register(cli):
                   multiple=True,
                   type=click.STRING,
                   callback=utils.optional_choice,
-                  envvar=project.config.get('possible_tags') or [],
+                  envvar=utils.ConfigOptions('possible_tags'),
                   help='Add tags to action.',
                   )
     @click.option('--overwrite',
@@ -69,8 +69,15 @@ def attach_to_register(cli):
                   type=click.STRING,
                   help='Which templates to add',
                   )
+    @click.option('--raw-transfer',
+                  type=click.Choice(['auto', 'reflink', 'hardlink', 'rename', 'copy']),
+                  default='auto',
+                  help=('How raw data is placed in the acquisition folder, "auto" tries reflink and copy. '
+                        '"hardlink" shares the data with the raw data instead of copying it.'),
+                  )
     def _register_openephys_recording(action_id, openephys_path, depth, overwrite, templates,
-                                      entity_id, user, session, location, message, tag, register_depth):
+                                      entity_id, user, session, location, message, tag, register_depth,
+                                      raw_transfer):
         openephys.register_openephys_recording(project=project,
                                                action_id=action_id,
                                                openephys_path=openephys_path,
@@ -85,7 +92,8 @@ def attach_to_register(cli):
                                                tag=tag,
                                                delete_raw_data=None,
                                                correct_depth_answer=None,
-                                               register_depth=register_depth)
+                                               register_depth=register_depth,
+                                               raw_transfer=raw_transfer)
 
 
 def attach_to_process(cli):
@@ -97,9 +105,11 @@ def attach_to_process(cli):
                   help='Path to probefile, assumed to be in expipe config directory by default.',
                   )
     @click.option('--sorter',
-                  default='klusta',
-                  type=click.Choice([s.sorter_name for s in ss.sorter_full_list]),
-                  help='Spike sorter software to be used.',
+                  default=['klusta'],
+                  multiple=True,
+                  type=click.STRING,
+                  callback=utils.validate_sorter,
+                  help='Spike sorter software to be used, repeat to run several sorters in parallel.',
                   )
     @click.option('--acquisition',
                   default=None,
@@ -123,6 +133,36 @@ def attach_to_process(cli):
                   is_flag=True,
                   help='if True groups are not sorted in parallel.',
                   )
+    @click.option('--n-jobs',
+                  type=click.INT,
+                  default=1,
+                  help='Number of processes used for filtering.',
+                  )
+    @click.option('--no-cache',
+                  is_flag=True,
+                  help='Do not cache the filtered data in the "cache_folder" of the project config.',
+                  )
+    @click.option('--threads-per-sorter',
+                  multiple=True,
+                  callback=utils.validate_threads_per_sorter,
+                  help=('Number of threads for each sorter when running several sorters, ' +
+                        'or <sorter>=<threads> repeated for each sorter.'),
+                  )
+    @click.option('--transfer-channels',
+                  type=click.INT,
+                  default=4,
+                  help='Number of files transferred at the same time to and from the server.',
+                  )
+    @click.option('--compression',
+                  type=click.Choice(['zstd', 'lz4', 'gzip']),
+                  default=None,
+                  help='Stream the data compressed to and from the server instead of syncing files.',
+                  )
+    @click.option('--compression-level',
+                  type=click.INT,
+                  default=3,
+                  help='Compression level used with --compression.',
+                  )
     @click.option('--sort-by',
                   type=click.STRING,
                   default=None,
@@ -186,7 +226,8 @@ def attach_to_process(cli):
                   )
     def _process_openephys(action_id, probe_path, sorter, no_sorting, no_mua, no_lfp, ms_before_wf, ms_after_wf,
                            spike_params, server, acquisition, exdir_path, bad_channels, ref, split_channels, no_par,
-                           sort_by, bad_threshold, min_fr, min_isi):
+                           n_jobs, no_cache, threads_per_sorter, transfer_channels, compression,
+                           compression_level, sort_by, bad_threshold, min_fr, min_isi):
         if 'auto' in bad_channels:
             bad_channels = ['auto']
         else:
@@ -207,7 +248,7 @@ def attach_to_process(cli):
             spike_params = pathlib.Path(spike_params)
             if spike_params.is_file():
                 with spike_params.open() as f:
-                    if use_loader:
+                    if hasattr(yaml, 'FullLoader'):
                         params = yaml.load(f, Loader=yaml.FullLoader)
                     else:
                         params = yaml.load(f)
@@ -225,10 +266,12 @@ def attach_to_process(cli):
             split_channels = ast.literal_eval(split_channels)
             assert isinstance(split_channels, list), 'With custom reference the list of channels has to be provided ' \
                                                      'with the --split-channels argument'
-        openephys.process_openephys(project=project, action_id=action_id, probe_path=probe_path, sorter=sorter,
+        openephys.process_openephys(project=project, action_id=action_id, probe_path=probe_path, sorter=list(sorter),
                                     spikesort=spikesort, compute_lfp=compute_lfp, compute_mua=compute_mua,
                                     spikesorter_params=params, server=server, acquisition_folder=acquisition,
                                     exdir_file_path=exdir_path, bad_channels=bad_channels, ref=ref, split=split_channels,
                                     ms_before_wf=ms_before_wf, ms_after_wf=ms_after_wf, parallel=parallel,
-                                    sort_by=sort_by, bad_threshold=bad_threshold, firing_rate_threshold=min_fr,
-                                    isi_viol_threshold=min_isi)
+                                    n_jobs=n_jobs, use_cache=not no_cache, threads_per_sorter=threads_per_sorter,
+                                    transfer_channels=transfer_channels, compression=compression,
+                                    compression_level=compression_level, sort_by=sort_by, bad_threshold=bad_threshold,
+                                    firing_rate_threshold=min_fr, isi_viol_threshold=min_isi)
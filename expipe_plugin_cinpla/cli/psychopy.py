@@ -1,8 +1,14 @@
 from expipe_plugin_cinpla.imports import *
-from expipe_plugin_cinpla.scripts import psychopy
 from . import utils
 
 
+@lazy_import
+def psychopy():
+    # heavy dependencies, imported when the command runs
+    from expipe_plugin_cinpla.scripts import psychopy
+    return psychopy
+
+
 def attach_to_process(cli):
     @cli.command('psychopy',
                  short_help='Process open ephys recordings.')
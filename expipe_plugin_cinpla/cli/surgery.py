@@ -16,7 +16,7 @@ def attach_to_cli(cli):
                   multiple=True,
                   type=click.STRING,
                   callback=utils.optional_choice,
-                  envvar=project.config.get('possible_tags') or [],
+                  envvar=utils.ConfigOptions('possible_tags'),
                   help='Add tags to action.',
                   )
     @click.option('--procedure',
@@ -57,7 +57,7 @@ def attach_to_cli(cli):
     @click.option('-l', '--location',
                   type=click.STRING,
                   callback=utils.optional_choice,
-                  envvar=project.config.get('possible_locations') or [],
+                  envvar=utils.ConfigOptions('possible_locations'),
                   help='The location of the recording, i.e. "room-1-ibv".'
                   )
     @click.option('--templates',
@@ -95,7 +95,7 @@ def attach_to_cli(cli):
     @click.option('-l', '--location',
                   type=click.STRING,
                   callback=utils.optional_choice,
-                  envvar=project.config.get('possible_locations') or [],
+                  envvar=utils.ConfigOptions('possible_locations'),
                   help='The location of the recording, i.e. "room-1-ibv".'
                   )
     @click.option('--overwrite',
@@ -1,4 +1,50 @@
 from expipe_plugin_cinpla.imports import *
+from collections.abc import Sequence
+
+
+class ConfigOptions(Sequence):
+    '''
+    Options listed under key in the project config, read when first used
+    so the project is not loaded while building the CLI.
+    '''
+    def __init__(self, key):
+        self.key = key
+
+    def _options(self):
+        return project.config.get(self.key) or []
+
+    def __getitem__(self, index):
+        return self._options()[index]
+
+    def __len__(self):
+        return len(self._options())
+
+
+def validate_sorter(ctx, param, value):
+    from expipe_plugin_cinpla.scripts import sorters
+    sorter_names = sorters.sorter_names()
+    for sorter in [value] if isinstance(value, str) else value:
+        if sorter not in sorter_names:
+            raise click.BadParameter(
+                '"{}" is not one of {}.'.format(sorter, ', '.join(sorter_names)))
+    return value
+
+
+def validate_threads_per_sorter(ctx, param, value):
+    # "<threads>" for all sorters or repeated "<sorter>=<threads>"
+    if not value:
+        return None
+    try:
+        if len(value) == 1 and '=' not in value[0]:
+            return int(value[0])
+        out = {}
+        for item in value:
+            sorter, n_threads = item.split('=')
+            out[sorter] = int(n_threads)
+        return out
+    except ValueError:
+        raise click.BadParameter('Threads per sorter need to be a number or ' +
+                                 'given per sorter as <sorter>=<threads>, e.g. klusta=4.')
 
 
 def deep_update(d, other):
@@ -81,8 +127,7 @@ def validate_adjustment(ctx, param, position):
 
 
 def optional_choice(ctx, param, value):
-    options = param.envvar
-    assert isinstance(options, list)
+    options = list(param.envvar)
     if value is None:
         if param.required:
             raise ValueError('Missing option "{}"'.format(param.opts))
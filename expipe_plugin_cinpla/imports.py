@@ -12,13 +12,15 @@ def pathlib():
     return pathlib
 
 
-local_root, _ = expipe.config._load_local_config(pathlib.Path.cwd())
-if local_root is not None:
-    project = expipe.get_project(path=local_root)
-else:
+@lazy_import
+def project():
+    # resolved when first used, not when the CLI is built
+    local_root, _ = expipe.config._load_local_config(pathlib.Path.cwd())
+    if local_root is not None:
+        return expipe.get_project(path=local_root)
     class P:
         config = {}
-    project = P
+    return P
 
 
 @lazy_import
@@ -0,0 +1,230 @@
+from expipe_plugin_cinpla.imports import *
+from . import utils
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import sqlite3
+import threading
+
+DEFAULT_INDEX_FOLDER = Path.home() / '.cache' / 'expipe' / 'action_index'
+SCHEMA_VERSION = 1
+DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS actions (
+    id TEXT PRIMARY KEY, mtime_ns INTEGER, type TEXT, datetime TEXT,
+    location TEXT, users TEXT, data TEXT);
+CREATE TABLE IF NOT EXISTS entities (id TEXT, entity TEXT);
+CREATE TABLE IF NOT EXISTS tags (id TEXT, tag TEXT);
+CREATE INDEX IF NOT EXISTS actions_type ON actions (type);
+CREATE INDEX IF NOT EXISTS actions_datetime ON actions (datetime);
+CREATE INDEX IF NOT EXISTS entities_entity ON entities (entity, id);
+CREATE INDEX IF NOT EXISTS tags_tag ON tags (tag, id);
+CREATE INDEX IF NOT EXISTS entities_id ON entities (id);
+CREATE INDEX IF NOT EXISTS tags_id ON tags (id);
+'''
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [value]
+    return [str(v) for v in value]
+
+
+def _format_datetime(value):
+    if value is None:
+        return None
+    if isinstance(value, datetime.datetime):
+        return value.strftime(DATETIME_FORMAT)
+    return str(value)
+
+
+def _read_attributes(path):
+    with Path(path).open('r', encoding='utf-8') as f:
+        return yaml.load(f, Loader=yaml.SafeLoader) or {}
+
+
+class ActionIndex:
+    '''
+    SQLite index of the action attributes (type, entities, tags, datetime,
+    location, users and data paths) of a filesystem project. An action is
+    only read again when the modification time of its attributes.yaml
+    changes, so listing and filtering does not load every action.
+
+    Parameters
+    ----------
+    actions_path : path
+        The "actions" folder of the project.
+    index_file : path
+        The SQLite file, preferably on a local disk.
+    n_threads : int
+        Number of threads reading changed actions.
+    '''
+    def __init__(self, actions_path, index_file, n_threads=8):
+        self.actions_path = Path(actions_path)
+        self.index_file = Path(index_file)
+        self.n_threads = n_threads
+        self.index_file.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(self.index_file), check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            if self._db.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+                for table in ['actions', 'entities', 'tags']:
+                    self._db.execute('DROP TABLE IF EXISTS {}'.format(table))
+                self._db.execute('PRAGMA user_version = {}'.format(SCHEMA_VERSION))
+            self._db.executescript(SCHEMA)
+
+    def _scan(self):
+        mtimes = {}
+        if not self.actions_path.is_dir():
+            return mtimes
+        for entry in os.scandir(str(self.actions_path)):
+            if not entry.is_dir():
+                continue
+            try:
+                stat = os.stat(os.path.join(entry.path, 'attributes.yaml'))
+            except FileNotFoundError:
+                continue
+            mtimes[entry.name] = stat.st_mtime_ns
+        return mtimes
+
+    def _read(self, action_id):
+        attributes = _read_attributes(self.actions_path / action_id / 'attributes.yaml')
+        return action_id, attributes
+
+    def refresh(self):
+        '''
+        Read the actions that were added or changed since the last refresh
+        and remove deleted actions.
+
+        Returns
+        -------
+        changed : list
+            Ids of added or changed actions.
+        removed : list
+            Ids of removed actions.
+        '''
+        mtimes = self._scan()
+        with self._lock:
+            indexed = dict(self._db.execute('SELECT id, mtime_ns FROM actions'))
+        changed = [a for a, mtime in mtimes.items() if indexed.get(a) != mtime]
+        removed = [a for a in indexed if a not in mtimes]
+        if not changed and not removed:
+            return [], []
+        with ThreadPoolExecutor(max_workers=self.n_threads) as executor:
+            results = list(executor.map(self._read, changed))
+        with self._lock, self._db:
+            for action_id in changed + removed:
+                for table in ['actions', 'entities', 'tags']:
+                    self._db.execute('DELETE FROM {} WHERE id = ?'.format(table), (action_id,))
+            for action_id, attributes in results:
+                self._db.execute(
+                    'INSERT INTO actions VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (action_id, mtimes[action_id], attributes.get('type'),
+                     _format_datetime(attributes.get('datetime')), attributes.get('location'),
+                     json.dumps(_as_list(attributes.get('users'))),
+                     json.dumps(dict(attributes.get('data') or {}), default=str)))
+                self._db.executemany(
+                    'INSERT INTO entities VALUES (?, ?)',
+                    [(action_id, e) for e in _as_list(attributes.get('entities'))])
+                self._db.executemany(
+                    'INSERT INTO tags VALUES (?, ?)',
+                    [(action_id, t) for t in _as_list(attributes.get('tags'))])
+        return changed, removed
+
+    def ids(self, type=None, entity=None, tag=None, start=None, stop=None):
+        '''
+        Sorted action ids, optionally filtered by type, entity, tag and a
+        datetime range [start, stop).
+        '''
+        query = 'SELECT id FROM actions WHERE 1'
+        args = []
+        if type is not None:
+            query += ' AND type = ?'
+            args.append(type)
+        if entity is not None:
+            query += ' AND id IN (SELECT id FROM entities WHERE entity = ?)'
+            args.append(entity)
+        if tag is not None:
+            query += ' AND id IN (SELECT id FROM tags WHERE tag = ?)'
+            args.append(tag)
+        if start is not None:
+            query += ' AND datetime >= ?'
+            args.append(_format_datetime(start))
+        if stop is not None:
+            query += ' AND datetime < ?'
+            args.append(_format_datetime(stop))
+        with self._lock:
+            return [row[0] for row in self._db.execute(query + ' ORDER BY id', args)]
+
+    def datetimes(self):
+        '''
+        Datetime by action id, None for actions without a datetime.
+        '''
+        with self._lock:
+            rows = self._db.execute('SELECT id, datetime FROM actions').fetchall()
+        return {action_id: None if value is None else datetime.datetime.strptime(value, DATETIME_FORMAT)
+                for action_id, value in rows}
+
+    def get(self, action_id):
+        '''
+        Indexed attributes of an action, raises KeyError if it is not
+        indexed.
+        '''
+        with self._lock:
+            row = self._db.execute(
+                'SELECT type, datetime, location, users, data FROM actions WHERE id = ?',
+                (action_id,)).fetchone()
+            if row is None:
+                raise KeyError('Action "{}" is not indexed'.format(action_id))
+            entities = [r[0] for r in self._db.execute(
+                'SELECT entity FROM entities WHERE id = ? ORDER BY rowid', (action_id,))]
+            tags = [r[0] for r in self._db.execute(
+                'SELECT tag FROM tags WHERE id = ? ORDER BY rowid', (action_id,))]
+        action_type, action_datetime, location, users, data = row
+        if action_datetime is not None:
+            action_datetime = datetime.datetime.strptime(action_datetime, DATETIME_FORMAT)
+        return {
+            'id': action_id,
+            'type': action_type,
+            'datetime': action_datetime,
+            'location': location,
+            'users': json.loads(users),
+            'entities': entities,
+            'tags': tags,
+            'data': json.loads(data),
+        }
+
+    def values(self, column):
+        '''
+        Distinct values of "type", "location", "entity" or "tag".
+        '''
+        tables = {'type': 'actions', 'location': 'actions', 'entity': 'entities', 'tag': 'tags'}
+        query = 'SELECT DISTINCT {0} FROM {1} WHERE {0} IS NOT NULL ORDER BY {0}'.format(
+            column, tables[column])
+        with self._lock:
+            return [row[0] for row in self._db.execute(query)]
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM actions').fetchone()[0]
+
+    def close(self):
+        self._db.close()
+
+
+def get_index(project, refresh=True):
+    '''
+    Action index of the project, stored under "action_index_folder" from
+    the project config.
+    '''
+    config = getattr(project, 'config', None) or {}
+    folder = Path(config.get('action_index_folder') or DEFAULT_INDEX_FOLDER)
+    project_path = utils.project_path(project).absolute()
+    key = hashlib.sha1(str(project_path).encode('utf-8')).hexdigest()[:16]
+    index = ActionIndex(project_path / 'actions', folder / (key + '.sqlite'))
+    if refresh:
+        index.refresh()
+    return index
@@ -0,0 +1,232 @@
+from expipe_plugin_cinpla.imports import *
+from pathlib import Path
+
+DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+DATETIME_KEY_FORMAT = '%Y%m%dT%H%M%S'
+LIST_ATTRIBUTES = ['users', 'tags', 'entities']
+
+
+def _assert_str_list(value):
+    if not isinstance(value, list):
+        raise TypeError('Expected "list", got "' + str(type(value)) + '"')
+    if not all(isinstance(v, str) for v in value):
+        raise TypeError('Expected contents to be "str" got ' +
+                        str([type(v) for v in value]))
+
+
+def _unique(values):
+    return list(dict.fromkeys(values))
+
+
+class ActionUpdate:
+    '''
+    Collects changes to the attributes, modules and messages of an action
+    and writes them in one go on flush, instead of one backend write per
+    assignment. On a filesystem project the attributes are read once and
+    written once, atomically, and modules and messages are written without
+    reading them back.
+
+    Used as a context manager the changes are flushed when the block exits
+    and discarded if it raises.
+
+    Parameters
+    ----------
+    action : expipe.Action
+    '''
+    def __init__(self, action):
+        self.action = action
+        self._attributes = {}
+        self._extended = collections.defaultdict(list)
+        self._modules = {}
+        self._deleted_modules = set()
+        self._messages = {}
+        self._module_names = None
+        self._message_keys = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+        else:
+            self.discard()
+
+    def _set(self, name, value):
+        self._attributes[name] = value
+        self._extended.pop(name, None)
+
+    def _get(self, name):
+        if name in self._attributes:
+            value = self._attributes[name]
+        else:
+            value = self.action._backend.attributes.get(name)
+        if name in LIST_ATTRIBUTES:
+            value = _unique(list(value or []) + self._extended[name])
+        return value
+
+    @property
+    def datetime(self):
+        value = self._get('datetime')
+        return None if value is None else dt.datetime.strptime(value, DATETIME_FORMAT)
+
+    @datetime.setter
+    def datetime(self, value):
+        if not isinstance(value, dt.datetime):
+            raise TypeError('Expected "datetime" got "' + str(type(value)) + '".')
+        self._set('datetime', value.strftime(DATETIME_FORMAT))
+
+    @property
+    def type(self):
+        return self._get('type')
+
+    @type.setter
+    def type(self, value):
+        if not isinstance(value, str):
+            raise TypeError('Expected "str" got "' + str(type(value)) + '"')
+        self._set('type', value)
+
+    @property
+    def location(self):
+        return self._get('location')
+
+    @location.setter
+    def location(self, value):
+        if not isinstance(value, str):
+            raise TypeError('Expected "str" got "' + str(type(value)) + '"')
+        self._set('location', value)
+
+    @property
+    def users(self):
+        return self._get('users')
+
+    @users.setter
+    def users(self, value):
+        _assert_str_list(value)
+        self._set('users', _unique(value))
+
+    @property
+    def tags(self):
+        return self._get('tags')
+
+    @tags.setter
+    def tags(self, value):
+        _assert_str_list(value)
+        self._set('tags', _unique(value))
+
+    @property
+    def entities(self):
+        return self._get('entities')
+
+    @entities.setter
+    def entities(self, value):
+        _assert_str_list(value)
+        self._set('entities', _unique(value))
+
+    def extend(self, name, values):
+        '''
+        Add values to the "users", "tags" or "entities" of the action.
+        '''
+        if name not in LIST_ATTRIBUTES:
+            raise ValueError('Can only extend {}'.format(LIST_ATTRIBUTES))
+        values = list(values)
+        _assert_str_list(values)
+        if name in self._attributes:
+            self._attributes[name] = _unique(self._attributes[name] + values)
+        else:
+            self._extended[name].extend(values)
+
+    def module_names(self):
+        '''
+        Names of the existing modules and the modules to be created.
+        '''
+        if self._module_names is None:
+            self._module_names = set(self.action.modules)
+        return (self._module_names - self._deleted_modules) | set(self._modules)
+
+    def create_module(self, name=None, template=None, contents=None):
+        '''
+        Same as Action.create_module, the module is written on flush.
+        '''
+        if template is not None:
+            assert contents is None
+            _name, contents = self.action._load_template(template)
+            name = name or _name
+        if not isinstance(contents, (dict, list, np.ndarray)):
+            raise TypeError('Contents expected "dict" or "list" got "' +
+                            str(type(contents)) + '".')
+        if name in self.module_names():
+            raise KeyError('Module ' + name + ' already exists in ' + self.action.id + '.')
+        self._modules[name] = contents
+
+    def delete_module(self, name):
+        if name not in self.module_names():
+            raise KeyError('Module ' + name + ' does not exist in ' + self.action.id + '.')
+        if name in self._modules:
+            del self._modules[name]
+        if name in self._module_names:
+            self._deleted_modules.add(name)
+
+    def create_message(self, text, user=None, datetime=None):
+        '''
+        Same as Action.create_message, the message is written on flush.
+        '''
+        datetime = datetime or dt.datetime.now()
+        user = user or expipe.settings.get('username')
+        self.action._assert_message_dtype(text=text, user=user, datetime=datetime)
+        key = datetime.strftime(DATETIME_KEY_FORMAT)
+        if self._message_keys is None:
+            self._message_keys = set(self.action.messages)
+        if key in self._message_keys or key in self._messages:
+            raise KeyError("Message with the same datetime already exists '{}'".format(key))
+        self._messages[key] = {
+            'text': text,
+            'user': user,
+            'datetime': datetime.strftime(DATETIME_FORMAT),
+        }
+
+    def _write_attributes(self):
+        backend = self.action._backend.attributes
+        attributes = backend.get() or {}
+        attributes.update(self._attributes)
+        for name, values in self._extended.items():
+            attributes[name] = _unique(list(attributes.get(name) or []) + values)
+        path = getattr(backend, 'path', None)
+        if path is None:
+            for name in set(self._attributes) | set(self._extended):
+                backend.set(name, attributes[name])
+            return
+        from expipe.backends.filesystem import yaml_dump
+        path = Path(path)
+        tmp_path = path.with_suffix('.tmp.yaml')
+        yaml_dump(tmp_path, attributes)
+        os.replace(str(tmp_path), str(path))
+
+    def flush(self):
+        '''
+        Write the collected changes.
+        '''
+        if self._attributes or self._extended:
+            self._write_attributes()
+        backend = self.action._backend
+        for name in self._deleted_modules:
+            backend.modules.delete(name)
+        for name, contents in self._modules.items():
+            backend.modules[name] = contents
+        for key, message in self._messages.items():
+            backend.messages[key] = message
+        if self._module_names is not None:
+            self._module_names = self.module_names()
+        if self._message_keys is not None:
+            self._message_keys.update(self._messages)
+        self.discard()
+
+    def discard(self):
+        '''
+        Forget the changes that are not flushed.
+        '''
+        self._attributes.clear()
+        self._extended.clear()
+        self._modules.clear()
+        self._deleted_modules = set()
+        self._messages.clear()
@@ -1,5 +1,6 @@
 from expipe_plugin_cinpla.imports import *
 from . import utils
+from .action_update import ActionUpdate
 from datetime import datetime as dt
 
 
@@ -114,11 +115,12 @@ def register_adjustment(project, entity_id, date, adjustment, user,
     adjustment_template['adjustment'] = adjustment_dict
     adjustment_template['experimenter'] = user
     adjustment_template['date'] = datestring
-    action.create_module(name=name, contents=adjustment_template)
-
-    action.type = 'Adjustment'
-    action.entities = [entity_id]
-    action.users.append(user)
+    with ActionUpdate(action) as update:
+        update.create_module(name=name, contents=adjustment_template)
+        update.type = 'Adjustment'
+        update.entities = [entity_id]
+        update.extend('users', [user])
+    utils.invalidate_adjustment_timeline(project, entity_id)
 
 
 def register_annotation(
@@ -130,27 +132,28 @@ def register_annotation(
     if user is None:
         print('Missing option "user".')
         return
-    print('Registering user', user)
-    action.users = [user]
-    if date:
-        print('Registering date ', date)
-        action.datetime = date
-    if action_type:
-        print('Registering type', action_type)
-        action.type = action_type
-    utils.register_templates(action, templates, overwrite=True)
-    if tag:
-        print('Registering tags', tag)
-        action.tags.extend(list(tag))
-    if entity_id:
-        print('Registering entity id', entity_id)
-        action.entities = [entity_id]
-    if location:
-        print('Registering location', location)
-        action.location = location
-    if message:
-        print('Registering message', message)
-        action.create_message(text=message, user=user, datetime=datetime.datetime.now())
+    with ActionUpdate(action) as update:
+        print('Registering user', user)
+        update.users = [user]
+        if date:
+            print('Registering date ', date)
+            update.datetime = date
+        if action_type:
+            print('Registering type', action_type)
+            update.type = action_type
+        utils.register_templates(update, templates, overwrite=True)
+        if tag:
+            print('Registering tags', tag)
+            update.extend('tags', tag)
+        if entity_id:
+            print('Registering entity id', entity_id)
+            update.entities = [entity_id]
+        if location:
+            print('Registering location', location)
+            update.location = location
+        if message:
+            print('Registering message', message)
+            update.create_message(text=message, user=user, datetime=datetime.datetime.now())
     if depth:
         correct_depth = utils.register_depth(
             project=project, action=action, depth=depth,
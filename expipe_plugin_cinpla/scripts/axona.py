@@ -1,11 +1,13 @@
 from expipe_plugin_cinpla.imports import *
 from . import utils
+from .action_update import ActionUpdate
+import time
 
 
 def register_axona_recording(
     project, action_id, axona_filename, depth, user, overwrite, templates,
     entity_id, location, message, tag, get_inp, no_cut, cluster_group,
-    set_zero_cluster_to_noise, register_depth, correct_depth_answer=None):
+    set_zero_cluster_to_noise, register_depth, correct_depth_answer=None, n_jobs=1, adjustment=None):
     user = user or project.config.get('username')
     if user is None:
         print('Missing option "user".')
@@ -39,41 +41,162 @@ def register_axona_recording(
         else:
             print(str(e) + '. Use "overwrite"')
             return
-    utils.register_templates(action, templates)
-    action.datetime = axona_file._start_datetime
-    action.tags = list(tag) + ['axona']
-    print('Registering action id ' + action_id)
-    print('Registering entity id ' + entity_id)
-    action.entities = [entity_id]
-    print('Registering user ' + user)
-    action.users = [user]
-    print('Registering location ' + location)
-    action.location = location
-    action.type = 'Recording'
-    if message:
-        action.create_message(text=message, user=user, datetime=datetime.datetime.now())
+    with ActionUpdate(action) as update:
+        utils.register_templates(update, templates)
+        update.datetime = axona_file._start_datetime
+        update.tags = list(tag) + ['axona']
+        print('Registering action id ' + action_id)
+        print('Registering entity id ' + entity_id)
+        update.entities = [entity_id]
+        print('Registering user ' + user)
+        update.users = [user]
+        print('Registering location ' + location)
+        update.location = location
+        update.type = 'Recording'
+        if message:
+            update.create_message(text=message, user=user, datetime=datetime.datetime.now())
     if register_depth:
         correct_depth = utils.register_depth(
             project=project, action=action, depth=depth,
-            answer=correct_depth_answer)
+            answer=correct_depth_answer, adjustment=adjustment)
         if not correct_depth:
             print('Aborting registration!')
             project.delete_action(action_id)
             return
     exdir_path = utils._make_data_path(action, overwrite)
     axona.convert(axona_file, exdir_path)
-    axona.generate_tracking(exdir_path, axona_file)
-    axona.generate_analog_signals(exdir_path, axona_file)
-    axona.generate_spike_trains(exdir_path, axona_file)
-    if not no_cut:
-        axona.generate_units(exdir_path, axona_file,
-                             cluster_group=cluster_group,
-                             set_noise=set_zero_cluster_to_noise)
-        axona.generate_clusters(exdir_path, axona_file)
-    if get_inp:
-        axona.generate_inp(exdir_path, axona_file)
+    chains = conversion_chains(
+        no_cut=no_cut, get_inp=get_inp, cluster_group=cluster_group,
+        set_zero_cluster_to_noise=set_zero_cluster_to_noise)
+    if n_jobs > 1:
+        run_chains_parallel(exdir_path, axona_filename, axona_file, chains, n_jobs)
     else:
+        for chain in chains:
+            _run_chain(exdir_path, axona_file, chain)
+    if not get_inp:
         print('WARNING: Not registering Axona ".inp".')
     time_string = exdir.File(exdir_path).attrs['session_start_time']
     dtime = datetime.datetime.strptime(time_string, '%Y-%m-%dT%H:%M:%S')
     action.datetime = dtime
+
+
+def conversion_chains(no_cut=False, get_inp=False, cluster_group=None, set_zero_cluster_to_noise=False):
+    '''
+    Conversion stages after axona.convert, as chains of (stage, kwargs).
+    Each chain reads its own Axona files and writes its own exdir groups,
+    stages within a chain share channel groups and run in order.
+    '''
+    ephys = [('generate_spike_trains', {})]
+    if not no_cut:
+        ephys += [('generate_units', {'cluster_group': cluster_group, 'set_noise': set_zero_cluster_to_noise}),
+                  ('generate_clusters', {})]
+    chains = [[('generate_tracking', {})], [('generate_analog_signals', {})], ephys]
+    if get_inp:
+        chains.append([('generate_inp', {})])
+    return chains
+
+
+def _run_chain(exdir_path, axona_file, chain):
+    for stage, kwargs in chain:
+        t_start = time.time()
+        getattr(axona, stage)(exdir_path, axona_file, **kwargs)
+        print('{} done in {:.1f} s'.format(stage, time.time() - t_start))
+
+
+def _copy_skeleton(exdir_path, copy_path):
+    '''
+    Copy the file and groups of an exdir file without their datasets and raw
+    data. Returns the attributes of the copied objects by relative path.
+    '''
+    exdir_path, copy_path = pathlib.Path(exdir_path), pathlib.Path(copy_path)
+    exdir_file = exdir.File(str(exdir_path))
+    attributes = {}
+    for dirpath, dirnames, filenames in os.walk(str(exdir_path)):
+        folder = pathlib.Path(dirpath)
+        meta_file = folder / 'exdir.yaml'
+        if not meta_file.is_file():
+            dirnames[:] = []
+            continue
+        with meta_file.open() as f:
+            if yaml.safe_load(f)['exdir']['type'] not in ['file', 'group']:
+                dirnames[:] = []
+                continue
+        relative = folder.relative_to(exdir_path)
+        (copy_path / relative).mkdir(parents=True)
+        for filename in ['exdir.yaml', 'attributes.yaml']:
+            if (folder / filename).is_file():
+                shutil.copy2(str(folder / filename), str(copy_path / relative / filename))
+        attributes[relative.as_posix()] = _exdir_object(exdir_file, relative).attrs.to_dict()
+    return attributes
+
+
+def _exdir_object(exdir_file, relative):
+    relative = pathlib.PurePosixPath(relative)
+    return exdir_file if relative == pathlib.PurePosixPath('.') else exdir_file[relative.as_posix()]
+
+
+def _merge_copy(copy_path, exdir_path, attributes):
+    '''
+    Move the objects created in a copy made by _copy_skeleton into the exdir
+    file and write the attributes changed in the copy. attributes are the
+    attributes returned by _copy_skeleton.
+    '''
+    exdir_path, copy_path = pathlib.Path(exdir_path), pathlib.Path(copy_path)
+    exdir_file = exdir.File(str(exdir_path))
+    copy_file = exdir.File(str(copy_path))
+    for dirpath, dirnames, filenames in os.walk(str(copy_path)):
+        relative = pathlib.Path(dirpath).relative_to(copy_path)
+        target = exdir_path / relative
+        for name in list(dirnames) + [f for f in filenames if f not in ['exdir.yaml', 'attributes.yaml']]:
+            if not (target / name).exists():
+                os.rename(str(pathlib.Path(dirpath) / name), str(target / name))
+                if name in dirnames:
+                    dirnames.remove(name)
+        if 'exdir.yaml' not in filenames:
+            continue
+        original = attributes.get(relative.as_posix(), {})
+        changed = {key: value for key, value in _exdir_object(copy_file, relative).attrs.to_dict().items()
+                   if key not in original or original[key] != value}
+        if changed:
+            target_attrs = _exdir_object(exdir_file, relative).attrs
+            for key, value in changed.items():
+                target_attrs[key] = value
+
+
+def _run_chain_process(exdir_path, axona_filename, chain):
+    # each process parses the Axona files of its own chain
+    _run_chain(exdir_path, pyxona.File(str(axona_filename)), chain)
+
+
+def run_chains_parallel(exdir_path, axona_filename, axona_file, chains, n_jobs):
+    '''
+    Run the conversion chains in a process pool. Each chain writes to its
+    own copy of the exdir groups and attributes, see _copy_skeleton. When
+    all chains are done the groups they created are moved into the exdir
+    file and the attributes they changed are written by this process, so
+    no two processes write the same file.
+    '''
+    import multiprocessing
+    import tempfile
+    from concurrent.futures import ProcessPoolExecutor
+    exdir_path = pathlib.Path(exdir_path)
+    exdir_file = exdir.File(str(exdir_path), plugins=exdir.plugins.quantities)
+    ephys = exdir_file.require_group('processing').require_group('electrophysiology')
+    for channel_group in axona_file.channel_groups:
+        ephys.require_group('channel_group_{}'.format(channel_group.channel_group_id))
+    # next to the exdir file so the created groups are moved, not copied
+    work_folder = pathlib.Path(tempfile.mkdtemp(prefix='.' + exdir_path.name + '.', dir=str(exdir_path.parent)))
+    try:
+        copy_paths = [work_folder / 'chain_{}.exdir'.format(i) for i in range(len(chains))]
+        for copy_path in copy_paths:
+            attributes = _copy_skeleton(exdir_path, copy_path)
+        with ProcessPoolExecutor(max_workers=min(n_jobs, len(chains)),
+                                 mp_context=multiprocessing.get_context('spawn')) as executor:
+            futures = [executor.submit(_run_chain_process, str(copy_path), str(axona_filename), chain)
+                       for copy_path, chain in zip(copy_paths, chains)]
+            for future in futures:
+                future.result()
+        for copy_path in copy_paths:
+            _merge_copy(copy_path, exdir_path, attributes)
+    finally:
+        shutil.rmtree(str(work_folder))
@@ -0,0 +1,271 @@
+from expipe_plugin_cinpla.imports import *
+from . import utils
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+import re
+import time
+import traceback
+
+REGISTER_FUNCTIONS = {
+    'openephys': ('expipe_plugin_cinpla.scripts.openephys', 'register_openephys_recording'),
+    'intan': ('expipe_plugin_cinpla.scripts.intan', 'register_intan_recording'),
+    'axona': ('expipe_plugin_cinpla.scripts.axona', 'register_axona_recording'),
+}
+INTAN_SUFFIXES = ['.rhd', '.rhs']
+# Intan files are named <name>_yymmdd_HHMMSS by the acquisition software
+INTAN_DATETIME = re.compile(r'_(\d{6}_\d{6})$')
+
+
+def find_sessions(root, systems=None):
+    '''
+    Recordings in the directory tree: Open Ephys folders (with a
+    settings.xml), Intan .rhd/.rhs files and Axona .set files.
+
+    Returns
+    -------
+    sessions : list
+        Dicts with the keys "system" and "path", sorted by path.
+    '''
+    systems = systems or list(REGISTER_FUNCTIONS)
+    sessions = []
+    for dirpath, dirnames, filenames in os.walk(str(root)):
+        if 'settings.xml' in filenames:
+            if 'openephys' in systems:
+                sessions.append({'system': 'openephys', 'path': Path(dirpath)})
+            dirnames[:] = []
+            continue
+        for filename in filenames:
+            suffix = os.path.splitext(filename)[1]
+            if suffix in INTAN_SUFFIXES and 'intan' in systems:
+                sessions.append({'system': 'intan', 'path': Path(dirpath) / filename})
+            elif suffix == '.set' and 'axona' in systems:
+                sessions.append({'system': 'axona', 'path': Path(dirpath) / filename})
+    return sorted(sessions, key=lambda s: str(s['path']))
+
+
+def _session_info(session):
+    '''
+    Entity, start time and session number as the register functions
+    derive them, session is None for Intan files.
+    '''
+    path = session['path']
+    if session['system'] == 'openephys':
+        openephys_file = pyopenephys.File(str(path))
+        return path.stem.split('_')[0], openephys_file.experiments[0].datetime, path.stem.split('_')[-1]
+    if session['system'] == 'intan':
+        match = INTAN_DATETIME.search(path.stem)
+        if match is not None:
+            start = datetime.datetime.strptime(match.group(1), '%y%m%d_%H%M%S')
+        else:
+            from .intan_reader import IntanFile
+            start = IntanFile(path).datetime
+        return path.stem.split('_')[0], start, None
+    if session['system'] == 'axona':
+        return path.parent.stem, pyxona.File(str(path))._start_datetime, path.stem[-2:]
+    raise ValueError('Unknown system "{}"'.format(session['system']))
+
+
+def _registered_sessions(registered):
+    '''
+    Session numbers and start times of the registered actions by entity
+    and day, from action ids entity_id-ddmmyy-session.
+    '''
+    days = collections.defaultdict(dict)
+    for action_id, start in registered.items():
+        parts = action_id.rsplit('-', 2)
+        if len(parts) != 3 or not parts[2].isdigit():
+            continue
+        try:
+            day = datetime.datetime.strptime(parts[1], '%d%m%y').date()
+        except ValueError:
+            continue
+        days[(parts[0], day)][action_id] = (int(parts[2]), start)
+    return days
+
+
+def plan_sessions(sessions, registered=(), n_threads=8):
+    '''
+    Give each session an action id, entity_id-ddmmyy-session. Intan files
+    have no session number, an Intan session with the same entity and
+    start time as a registered action gets its id, new Intan sessions are
+    numbered by start time after the highest registered session of the
+    entity and day. Registered action ids are never renumbered when
+    earlier files are added later. Sessions with a registered action id
+    are marked "skipped" and sessions whose metadata cannot be read are
+    marked "failed".
+
+    Parameters
+    ----------
+    registered : dict or list
+        Start time by registered action id, or only the ids. Without start
+        times registered Intan sessions can not be recognized.
+    '''
+    def read_info(session):
+        try:
+            return _session_info(session), None
+        except Exception as e:
+            return None, '{}: {}'.format(type(e).__name__, e)
+
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        infos = list(executor.map(read_info, sessions))
+    planned = []
+    for session, (info, error) in zip(sessions, infos):
+        session = dict(session, action_id=None, status='planned', error=error, seconds=None)
+        if info is None:
+            session['status'] = 'failed'
+        else:
+            session['entity_id'], session['start'], session['session'] = info
+        planned.append(session)
+    if not isinstance(registered, dict):
+        registered = dict.fromkeys(registered)
+    days = _registered_sessions(registered)
+    intan = [s for s in planned if s['system'] == 'intan' and s['status'] == 'planned']
+    for session in sorted(intan, key=lambda s: s['start']):
+        day = days[(session['entity_id'], session['start'].date())]
+        same_start = [number for number, start in day.values() if start == session['start']]
+        if same_start:
+            session['session'] = str(min(same_start))
+            continue
+        number = max([n for n, _ in day.values()], default=0) + 1
+        session['session'] = str(number)
+        action_id = '{}-{:%d%m%y}-{}'.format(session['entity_id'], session['start'], number)
+        day[action_id] = (number, session['start'])
+    for session in planned:
+        if session['status'] != 'planned':
+            continue
+        if not session['session'].isdigit():
+            session['status'] = 'failed'
+            session['error'] = 'No session number in "{}"'.format(session['path'].name)
+            continue
+        session['action_id'] = '{}-{:%d%m%y}-{}'.format(
+            session['entity_id'], session['start'], session['session'])
+        if session['action_id'] in registered:
+            session['status'] = 'skipped'
+    return planned
+
+
+def _register_session(project_path, register_function, system, path, action_id, entity_id, session, kwargs):
+    import importlib
+    t_start = time.time()
+    try:
+        module_name, function_name = register_function
+        register = getattr(importlib.import_module(module_name), function_name)
+        project = expipe.get_project(path=project_path)
+        kwargs = dict(kwargs, project=project, action_id=action_id, entity_id=entity_id)
+        if system == 'openephys':
+            register(openephys_path=path, session=session, delete_raw_data=False, **kwargs)
+        elif system == 'intan':
+            register(intan_path=path, session=session, delete_raw_data=False, **kwargs)
+        else:
+            register(axona_filename=path, get_inp=False, no_cut=False, cluster_group={},
+                     set_zero_cluster_to_noise=False, **kwargs)
+        if action_id not in project.actions:
+            return None, time.time() - t_start
+    except Exception:
+        return traceback.format_exc(), time.time() - t_start
+    return 'ok', time.time() - t_start
+
+
+def _device(path):
+    try:
+        return os.stat(str(path)).st_dev
+    except OSError:
+        return None
+
+
+def register_sessions(project, sessions, user=None, location=None, tag=(), templates=(),
+                      register_depth=False, max_workers=2, io_limit=1):
+    '''
+    Register the planned sessions, each in its own process.
+
+    Parameters
+    ----------
+    sessions : list
+        Sessions from plan_sessions, only "planned" sessions are registered.
+    max_workers : int
+        Maximum number of registrations running at the same time.
+    io_limit : int
+        Maximum number of registrations reading from the same disk at the
+        same time.
+
+    Returns
+    -------
+    sessions : list
+        The sessions with status "registered" or "failed", the error and
+        the duration in seconds.
+    '''
+    import multiprocessing
+    kwargs = {
+        'user': user or project.config.get('username'),
+        'location': location or project.config.get('location'),
+        'tag': list(tag), 'templates': list(templates), 'depth': (),
+        'overwrite': False, 'message': None, 'register_depth': register_depth,
+        'correct_depth_answer': True if register_depth else None,
+    }
+    project_path = str(utils.project_path(project))
+    io_limit = max(1, io_limit)
+    pending = [s for s in sessions if s['status'] == 'planned']
+    adjustments = {}
+    if register_depth:
+        # depths of all sessions from the cached adjustment timelines
+        adjustments = utils.get_depths_from_adjustment(
+            project, [s['action_id'] for s in pending],
+            planned={s['action_id']: (s['entity_id'], s['start']) for s in pending})
+        for session in list(pending):
+            if adjustments[session['action_id']][0] is None:
+                session['status'] = 'failed'
+                session['error'] = 'Cannot find current depth from adjustments of ' + session['entity_id']
+                pending.remove(session)
+    running = {}
+    with ProcessPoolExecutor(max_workers=max_workers,
+                             mp_context=multiprocessing.get_context('spawn')) as executor:
+        while pending or running:
+            devices = collections.Counter(device for _, device in running.values())
+            for session in list(pending):
+                if len(running) >= max_workers:
+                    break
+                device = _device(session['path'])
+                if devices[device] >= io_limit:
+                    continue
+                future = executor.submit(
+                    _register_session, project_path, REGISTER_FUNCTIONS[session['system']],
+                    session['system'], str(session['path']),
+                    session['action_id'], session['entity_id'], session['session'],
+                    dict(kwargs, adjustment=adjustments.get(session['action_id'])))
+                running[future] = (session, device)
+                devices[device] += 1
+                pending.remove(session)
+                print('Registering', session['action_id'], 'from', session['path'])
+            done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in done:
+                session, _ = running.pop(future)
+                try:
+                    result, session['seconds'] = future.result()
+                except Exception:
+                    result = traceback.format_exc()
+                if result == 'ok':
+                    session['status'] = 'registered'
+                else:
+                    session['status'] = 'failed'
+                    session['error'] = result or 'The action was not created, see the log above'
+                print(session['status'].capitalize(), session['action_id'])
+    return sessions
+
+
+def print_report(sessions):
+    '''
+    Summary of a bulk registration with the duration of each session and
+    the failures.
+    '''
+    print('{:30} {:10} {:11} {:>9}  {}'.format('Action', 'System', 'Status', 'Seconds', 'Path'))
+    for session in sessions:
+        seconds = '' if session['seconds'] is None else '{:.1f}'.format(session['seconds'])
+        print('{:30} {:10} {:11} {:>9}  {}'.format(
+            session['action_id'] or '-', session['system'], session['status'], seconds, session['path']))
+    for session in sessions:
+        if session['status'] == 'failed':
+            print('\nFailed {} ({}):\n{}'.format(session['action_id'] or '-', session['path'], session['error']))
+    counts = collections.Counter(s['status'] for s in sessions)
+    total = sum(s['seconds'] or 0 for s in sessions)
+    print('\n' + ', '.join('{} {}'.format(n, status) for status, n in sorted(counts.items())) +
+          ', {:.1f} s registering'.format(total))
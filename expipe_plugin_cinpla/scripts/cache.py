@@ -0,0 +1,224 @@
+from expipe_plugin_cinpla.imports import *
+from pathlib import Path
+import hashlib
+import time
+
+DEFAULT_CACHE_SIZE_GB = 100
+ENTRY_FILE = 'entry.json'
+# increase when the preprocessing or the notch detection changes the cached signals
+CACHE_VERSION = 2
+
+
+def _file_identity(path):
+    path = Path(path)
+    if path.is_dir():
+        files = sorted(p for p in path.rglob('*') if p.is_file())
+    else:
+        files = [path]
+    identity = []
+    for f in files:
+        stat = f.stat()
+        identity.append([str(f.absolute()), stat.st_size, stat.st_mtime])
+    return identity
+
+
+def _file_hash(path):
+    if path is None:
+        return None
+    sha = hashlib.sha1()
+    with Path(path).open('rb') as f:
+        for block in iter(lambda: f.read(2 ** 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def make_key(raw_path, probe_path, version=CACHE_VERSION, **params):
+    '''
+    Hash of the identity (path, size, modification time) of the raw data,
+    the content of the probe file, the preprocessing parameters and the
+    version of the preprocessing.
+    '''
+    content = {
+        'version': version,
+        'raw': _file_identity(raw_path),
+        'probe': _file_hash(probe_path),
+        'params': params,
+    }
+    dump = json.dumps(content, sort_keys=True, default=str)
+    return hashlib.sha1(dump.encode('utf-8')).hexdigest()
+
+
+def get_cache(project=None):
+    '''
+    Preprocessing cache configured by "cache_folder" and "cache_size_gb"
+    in the project config, None if no "cache_folder" is configured.
+    '''
+    config = getattr(project, 'config', None) or {}
+    folder = config.get('cache_folder')
+    if folder is None:
+        return None
+    size_gb = config.get('cache_size_gb') or DEFAULT_CACHE_SIZE_GB
+    return PreprocessingCache(folder, max_size_gb=size_gb)
+
+
+class PreprocessingCache:
+    '''
+    Persistent cache of preprocessed signals. Each entry is a folder named
+    by its key, holding the cached files and an entry.json with their
+    description. The least recently used entries are removed when the
+    cache grows beyond max_size_gb.
+    '''
+    def __init__(self, folder, max_size_gb=DEFAULT_CACHE_SIZE_GB):
+        self.folder = Path(folder)
+        self.max_size_gb = max_size_gb
+
+    def _entry_folder(self, key):
+        return self.folder / key
+
+    def _tmp_path(self, path):
+        # hidden and unique per process, so concurrent writers do not collide
+        return path.with_name('.{}.{}.tmp'.format(path.name, os.getpid()))
+
+    def _read_entry(self, key):
+        entry_file = self._entry_folder(key) / ENTRY_FILE
+        if not entry_file.is_file():
+            return None
+        with entry_file.open('r') as f:
+            entry = json.load(f)
+        entry['key'] = key
+        return entry
+
+    def _write_entry(self, key, entry):
+        entry = {k: v for k, v in entry.items() if k != 'key'}
+        entry_file = self._entry_folder(key) / ENTRY_FILE
+        tmp_file = self._tmp_path(entry_file)
+        with tmp_file.open('w') as f:
+            json.dump(entry, f, indent=2, default=str)
+        os.replace(str(tmp_file), str(entry_file))
+
+    def get(self, key):
+        '''
+        Returns the folder and the description of a cached entry, or
+        (None, None) if it is not in the cache.
+        '''
+        entry = self._read_entry(key)
+        if entry is None:
+            return None, None
+        folder = self._entry_folder(key)
+        if not all((folder / f).is_file() for f in entry['files']):
+            self.remove(key)
+            return None, None
+        entry['last_access'] = time.time()
+        self._write_entry(key, entry)
+        return folder, entry
+
+    def put(self, key, files, description=None, **info):
+        '''
+        Move files into the cache and return the folder of the entry. The
+        entry is written to a temporary folder which is renamed into place,
+        so readers never see a partially written entry.
+        '''
+        if not self.folder.exists():
+            print('Caching filtered data in {} (at most {} GB)'.format(self.folder, self.max_size_gb))
+        folder = self._entry_folder(key)
+        tmp_folder = self._tmp_path(folder)
+        if tmp_folder.exists():
+            shutil.rmtree(str(tmp_folder))
+        tmp_folder.mkdir(parents=True)
+        size = 0
+        for f in files:
+            f = Path(f)
+            size += f.stat().st_size
+            shutil.move(str(f), str(tmp_folder / f.name))
+        now = time.time()
+        entry = {'files': [Path(f).name for f in files], 'size': size,
+                 'description': description, 'created': now, 'last_access': now}
+        entry.update(info)
+        with (tmp_folder / ENTRY_FILE).open('w') as f:
+            json.dump(entry, f, indent=2, default=str)
+        try:
+            os.rename(str(tmp_folder), str(folder))
+        except OSError:
+            # replace an existing entry, renaming it away first since a
+            # folder can not be renamed onto a non-empty folder
+            old_folder = self._tmp_path(folder).with_suffix('.old')
+            os.rename(str(folder), str(old_folder))
+            os.rename(str(tmp_folder), str(folder))
+            shutil.rmtree(str(old_folder))
+        self.prune(keep=[key])
+        return folder
+
+    def remove(self, key):
+        folder = self._entry_folder(key)
+        if folder.exists():
+            shutil.rmtree(str(folder))
+
+    def entries(self):
+        '''
+        Cached entries sorted from the most to the least recently used.
+        '''
+        if not self.folder.is_dir():
+            return []
+        entries = [self._read_entry(p.name) for p in self.folder.iterdir()
+                   if p.is_dir() and not p.name.startswith('.')]
+        entries = [e for e in entries if e is not None]
+        return sorted(entries, key=lambda e: e['last_access'], reverse=True)
+
+    def size(self):
+        return sum(e['size'] for e in self.entries())
+
+    def prune(self, max_size_gb=None, keep=None):
+        '''
+        Remove the least recently used entries until the cache is smaller
+        than max_size_gb. Returns the removed entries.
+        '''
+        max_size_gb = self.max_size_gb if max_size_gb is None else max_size_gb
+        keep = keep or []
+        entries = self.entries()
+        size = sum(e['size'] for e in entries)
+        removed = []
+        for entry in reversed(entries):
+            if size <= max_size_gb * 1e9:
+                break
+            if entry['key'] in keep:
+                continue
+            self.remove(entry['key'])
+            size -= entry['size']
+            removed.append(entry)
+        return removed
+
+    def clear(self):
+        for entry in self.entries():
+            self.remove(entry['key'])
+
+
+def load_filtered(preprocessing_cache, key, preprocessor):
+    '''
+    Load the cached filtered recording of a FusedPreprocessor and restore
+    its active channels and notch frequencies. Returns None if it is not
+    in the cache.
+    '''
+    folder, entry = preprocessing_cache.get(key)
+    if entry is None or 'freq_notch' not in entry:
+        return None
+    preprocessor.active_channels = entry['active_channels']
+    preprocessor.set_notch(entry['freq_notch'], q_notch=entry['q_notch'])
+    outputs = {'filt': (folder / 'filt.dat', entry['sampling_frequency'], entry['channel_ids'],
+                        entry['num_frames'], np.dtype(entry['dtype']))}
+    return preprocessor.load_outputs(outputs)['filt']
+
+
+def store_filtered(preprocessing_cache, key, preprocessor, tmp_folder, description=None):
+    '''
+    Move filt.dat written by a FusedPreprocessor to the cache and return
+    the recording loaded from the cache.
+    '''
+    path, fs, channel_ids, num_frames, dtype = preprocessor.outputs(
+        tmp_folder, spikesort=True, compute_lfp=False, compute_mua=False)['filt']
+    preprocessing_cache.put(
+        key, [path], description=description, sampling_frequency=fs,
+        channel_ids=np.array(channel_ids).tolist(), num_frames=num_frames, dtype=str(dtype),
+        active_channels=np.array(preprocessor.active_channels).tolist(),
+        freq_notch=None if preprocessor.freq_notch is None else np.atleast_1d(preprocessor.freq_notch).tolist(),
+        q_notch=preprocessor.q_notch)
+    return load_filtered(preprocessing_cache, key, preprocessor)
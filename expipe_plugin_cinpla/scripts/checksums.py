@@ -0,0 +1,169 @@
+from expipe_plugin_cinpla.imports import *
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import zlib
+
+BLOCK_SIZE = 16 * 2 ** 20
+
+
+def _xxh3_64(data):
+    import xxhash
+    return xxhash.xxh3_64_intdigest(data)
+
+
+HASH_FUNCTIONS = {
+    'xxh3_64': _xxh3_64,
+    'crc32': zlib.crc32,
+}
+
+
+def default_algorithm():
+    '''
+    xxh3_64 if xxhash is installed, otherwise crc32 from zlib. Both are
+    fast non-cryptographic hashes releasing the GIL on large blocks.
+    '''
+    try:
+        import xxhash
+    except ImportError:
+        return 'crc32'
+    return 'xxh3_64' if hasattr(xxhash, 'xxh3_64_intdigest') else 'crc32'
+
+
+def _files(path):
+    path = Path(path)
+    if path.is_file():
+        return {path.name: path}
+    if not path.is_dir():
+        return {}
+    return {p.relative_to(path).as_posix(): p for p in sorted(path.rglob('*')) if p.is_file()}
+
+
+def _hash_block(hash_function, fd, offset, size):
+    return hash_function(os.pread(fd, size, offset))
+
+
+def compute_manifest(path, previous=None, algorithm=None, block_size=BLOCK_SIZE, n_threads=8):
+    '''
+    Checksums of the files in a folder (or of a single file). Files are
+    split in blocks hashed in a thread pool, the checksum of a file is the
+    hash of its block hashes.
+
+    Parameters
+    ----------
+    path : path
+        Folder or file.
+    previous : dict
+        Manifest of the same path, files with the same size and
+        modification time are not read again.
+    algorithm : str
+        "xxh3_64" or "crc32", default from default_algorithm.
+
+    Returns
+    -------
+    manifest : dict
+        "algorithm", "block_size" and "files", the size, modification time
+        and checksum of each file by relative path.
+    '''
+    algorithm = algorithm or default_algorithm()
+    hash_function = HASH_FUNCTIONS[algorithm]
+    files = {}
+    if previous and previous.get('algorithm') == algorithm and previous.get('block_size') == block_size:
+        reusable = previous['files']
+    else:
+        reusable = {}
+    blocks = []
+    fds = []
+    try:
+        for name, file_path in _files(path).items():
+            stat = file_path.stat()
+            entry = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'hash': None}
+            old = reusable.get(name)
+            if old is not None and old['size'] == entry['size'] and old['mtime_ns'] == entry['mtime_ns']:
+                entry['hash'] = old['hash']
+            else:
+                fds.append(os.open(str(file_path), os.O_RDONLY))
+                blocks.append((name, [(fds[-1], offset, min(block_size, stat.st_size - offset))
+                                      for offset in range(0, stat.st_size, block_size)]))
+            files[name] = entry
+        with ThreadPoolExecutor(max_workers=n_threads) as executor:
+            futures = [(name, [executor.submit(_hash_block, hash_function, *block) for block in file_blocks])
+                       for name, file_blocks in blocks]
+            for name, file_futures in futures:
+                digest = b''.join(f.result().to_bytes(8, 'little') for f in file_futures)
+                files[name]['hash'] = '{:016x}'.format(hash_function(digest))
+    finally:
+        for fd in fds:
+            os.close(fd)
+    return {'algorithm': algorithm, 'block_size': block_size, 'files': files}
+
+
+def compare_manifests(source, dest):
+    '''
+    Relative paths of the files in the source manifest that are missing or
+    differ in the dest manifest.
+    '''
+    if source['algorithm'] != dest['algorithm'] or source['block_size'] != dest['block_size']:
+        raise ValueError('Manifests use different checksums ({}, {})'.format(
+            source['algorithm'], dest['algorithm']))
+    return sorted(name for name, entry in source['files'].items()
+                  if name not in dest['files'] or
+                  (dest['files'][name]['size'], dest['files'][name]['hash']) != (entry['size'], entry['hash']))
+
+
+def _read_attribute(acquisition, name):
+    if name not in acquisition.attrs:
+        return None
+    value = acquisition.attrs[name]
+    return value.to_dict() if hasattr(value, 'to_dict') else dict(value)
+
+
+def read_manifest(acquisition):
+    '''
+    Manifest stored in the attributes of the exdir acquisition group, None
+    if there is none.
+    '''
+    return _read_attribute(acquisition, 'manifest')
+
+
+def read_transfer_manifest(acquisition, destination):
+    '''
+    Manifest of the last verified transfer of the raw data to destination,
+    see transfer.sync.
+    '''
+    transfers = _read_attribute(acquisition, 'transfers') or {}
+    return dict(transfers.get(destination) or {})
+
+
+def store_transfer_manifest(acquisition, destination, manifest):
+    transfers = _read_attribute(acquisition, 'transfers') or {}
+    transfers[destination] = manifest
+    acquisition.attrs['transfers'] = transfers
+
+
+def update_manifest(acquisition, n_threads=8):
+    '''
+    Checksum the raw data of the exdir acquisition group and store the
+    manifest in its attributes.
+    '''
+    folder = Path(acquisition.directory) / acquisition.attrs['session']
+    manifest = compute_manifest(folder, previous=read_manifest(acquisition), n_threads=n_threads)
+    acquisition.attrs['manifest'] = manifest
+    return manifest
+
+
+def verify_copy(source, manifest, n_threads=8):
+    '''
+    Checksum the source raw data and compare with the manifest of the
+    acquisition group, prints the files that differ.
+
+    Returns
+    -------
+    verified : bool
+        True if all source files are in the acquisition folder.
+    '''
+    source_manifest = compute_manifest(
+        source, algorithm=manifest['algorithm'], block_size=manifest['block_size'], n_threads=n_threads)
+    mismatches = compare_manifests(source_manifest, manifest)
+    for name in mismatches:
+        print('Raw data file differs from the acquisition copy:', name)
+    return not mismatches
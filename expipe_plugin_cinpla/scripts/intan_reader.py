@@ -0,0 +1,276 @@
+from expipe_plugin_cinpla.imports import *
+from pathlib import Path
+import hashlib
+import warnings
+
+DEFAULT_CACHE_FOLDER = Path.home() / '.cache' / 'expipe' / 'intan'
+CACHE_VERSION = 1
+# bytes of raw data mapped at a time
+CHUNK_BYTES = 64 * 2 ** 20
+DIGITAL_FIELDS = {'DIGITAL-IN': 'digital_in', 'DIGITAL-OUT': 'digital_out'}
+
+
+def _builtin(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, dict):
+        return {k: _builtin(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_builtin(v) for v in value]
+    return value
+
+
+def _read_header(path):
+    from pyintan.intan import read_rhd, read_rhs
+    if path.suffix == '.rhs':
+        global_info, channels, data_dtype, header_size, block_size = read_rhs(str(path))
+    elif path.suffix == '.rhd':
+        global_info, channels, data_dtype, header_size, block_size = read_rhd(str(path))
+    else:
+        raise ValueError("Only '.rhd' and '.rhs' files are supported")
+    return _builtin({
+        'global_info': global_info,
+        'channels': channels,
+        'data_dtype': data_dtype,
+        'header_size': header_size,
+        'block_size': block_size,
+    })
+
+
+def _edges(previous, values):
+    '''
+    Rising and falling edges of single digital lines as pyintan finds them,
+    a rising edge is a sample with one bit set after a zero sample and a
+    falling edge is a sample with one bit set before a zero sample.
+    previous is the last sample of the previous chunk, -1 for the first.
+    '''
+    before = np.concatenate([[previous], values[:-1]]).astype('int32')
+    values = values.astype('int32')
+
+    def single_bit(v):
+        return (v > 0) & ((v & (v - 1)) == 0)
+    rising = np.flatnonzero((before == 0) & single_bit(values))
+    falling = np.flatnonzero((values == 0) & single_bit(before)) - 1
+    return (rising, np.log2(values[rising]).astype('int64'),
+            falling, np.log2(before[falling + 1]).astype('int64'))
+
+
+class IntanFile:
+    '''
+    Intan .rhd/.rhs file read in blocks through a memory map, peak memory
+    does not depend on the file length. The header, timestamps and digital
+    events are parsed in one pass and cached, so opening the file again is
+    instant. Provides the attributes of pyintan.File used for registration
+    and processing. Other attributes, e.g. analog_signals or stimulation,
+    are not provided since pyintan loads the whole file to read them.
+
+    Parameters
+    ----------
+    filename : str or Path
+        Path to the Intan file.
+    cache_folder : path
+        Folder with the parsed metadata, default ~/.cache/expipe/intan.
+    chunk_bytes : int
+        Bytes of raw data parsed at a time.
+    '''
+    def __init__(self, filename, cache_folder=None, chunk_bytes=CHUNK_BYTES):
+        self.path = Path(filename).absolute()
+        self.absolute_filename = str(self.path)
+        self.fname = self.path.name
+        self.absolute_foldername = str(self.path.parent)
+        self.acquisition_system = 'Intan Recording Stimulation GUI'
+        self.chunk_bytes = chunk_bytes
+        self.cache_folder = Path(cache_folder or DEFAULT_CACHE_FOLDER)
+        self.from_cache = False
+        try:
+            under_date = self.fname[:-4].split('_')[-2:]
+            self._start_datetime = datetime.datetime.strptime(under_date[0] + under_date[1], '%y%m%d%H%M%S')
+        except Exception:
+            warnings.warn('Could not parse date from {}'.format(self.fname))
+            self._start_datetime = datetime.datetime.now()
+        self._load()
+
+    @property
+    def cache_path(self):
+        key = hashlib.sha1(self.absolute_filename.encode('utf-8')).hexdigest()[:16]
+        return self.cache_folder / (key + '.npz')
+
+    def _identity(self):
+        stat_result = self.path.stat()
+        return np.array([CACHE_VERSION, stat_result.st_size, stat_result.st_mtime_ns], dtype='int64')
+
+    def _load(self):
+        identity = self._identity()
+        try:
+            with np.load(str(self.cache_path)) as cached:
+                if np.array_equal(cached['identity'], identity):
+                    self._set_metadata(json.loads(str(cached['header'])),
+                                       {k: cached[k] for k in cached.files if '_channel_' in k})
+                    self.from_cache = True
+                    return
+        except (OSError, KeyError, ValueError):
+            pass
+        header = _read_header(self.path)
+        self._set_header(header)
+        events = self._parse()
+        self._set_metadata(dict(header, n_blocks=self.n_blocks, first_timestamp=self.first_timestamp), events)
+        try:
+            self.cache_folder.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.cache_path.with_suffix('.tmp.npz')
+            np.savez(str(tmp_path), identity=identity, header=np.array(json.dumps(self._metadata)), **events)
+            os.replace(str(tmp_path), str(self.cache_path))
+        except OSError:
+            print('Could not cache Intan metadata in', self.cache_path)
+
+    def _set_header(self, header):
+        self._global_info = header['global_info']
+        self._ordered_channels = header['channels']
+        self._block_size = header['block_size']
+        self._header_size = header['header_size']
+        self._dtype = np.dtype([tuple(field) for field in header['data_dtype']])
+        self.n_blocks = (self.path.stat().st_size - self._header_size) // self._dtype.itemsize
+
+    def _set_metadata(self, metadata, events):
+        self._metadata = metadata
+        self._set_header(metadata)
+        self.first_timestamp = metadata['first_timestamp']
+        self._events = events
+
+    def _blocks_per_chunk(self):
+        return max(1, self.chunk_bytes // self._dtype.itemsize)
+
+    def iter_blocks(self, start=0, stop=None):
+        '''
+        Yield (first block, memory map of the blocks) of at most
+        chunk_bytes each, the memory map is released after each chunk.
+        '''
+        stop = self.n_blocks if stop is None else min(stop, self.n_blocks)
+        step = self._blocks_per_chunk()
+        for first in range(start, stop, step):
+            blocks = np.memmap(self.absolute_filename, dtype=self._dtype, mode='r',
+                               offset=self._header_size + first * self._dtype.itemsize,
+                               shape=(min(step, stop - first),))
+            yield first, blocks
+            del blocks
+
+    def _parse(self):
+        '''
+        Check the timestamps and find the digital events in one pass.
+        '''
+        fields = [f for f in DIGITAL_FIELDS if f in self._dtype.names]
+        edges = {f: collections.defaultdict(lambda: ([], [])) for f in fields}
+        previous = {f: -1 for f in fields}
+        last_timestamp = None
+        self.first_timestamp = 0
+        for first, blocks in self.iter_blocks():
+            timestamps = np.array(blocks['timestamp']).reshape(-1).astype('int64')
+            if last_timestamp is None:
+                self.first_timestamp = int(timestamps[0])
+            elif timestamps[0] != last_timestamp + 1:
+                raise ValueError('Timestamps have gaps in ' + self.absolute_filename)
+            if np.any(np.diff(timestamps) != 1):
+                raise ValueError('Timestamps have gaps in ' + self.absolute_filename)
+            last_timestamp = timestamps[-1]
+            offset = first * self._block_size
+            for field in fields:
+                values = np.array(blocks[field]).reshape(-1)
+                rising, rising_channels, falling, falling_channels = _edges(previous[field], values)
+                for index, channels, state in [(rising, rising_channels, 1), (falling, falling_channels, -1)]:
+                    for channel in np.unique(channels):
+                        samples = index[channels == channel] + offset
+                        edges[field][channel][0].append(samples)
+                        edges[field][channel][1].append(np.full(len(samples), state, dtype='int8'))
+                previous[field] = values[-1]
+        events = {}
+        for field, channels in edges.items():
+            for channel, (samples, states) in channels.items():
+                samples, states = np.concatenate(samples), np.concatenate(states)
+                # rising edges first, as pyintan
+                order = np.argsort(-states, kind='stable')
+                name = '{}_channel_{}'.format(DIGITAL_FIELDS[field], int(channel))
+                events[name + '_samples'] = samples[order]
+                events[name + '_states'] = states[order]
+        return events
+
+    @property
+    def datetime(self):
+        return self._start_datetime
+
+    @property
+    def sample_rate(self):
+        return self._global_info['sampling_rate'] * pq.Hz
+
+    @property
+    def n_samples(self):
+        return self.n_blocks * self._block_size
+
+    @property
+    def start_time(self):
+        return self.first_timestamp / self.sample_rate
+
+    @property
+    def duration(self):
+        return (self.n_samples - 1) / self.sample_rate
+
+    def _digital_events(self, kind, event_class):
+        prefix = kind + '_channel_'
+        channels = sorted(int(k[len(prefix):-len('_samples')]) for k in self._events
+                          if k.startswith(prefix) and k.endswith('_samples'))
+        result = []
+        for channel in channels:
+            samples = self._events['{}{}_samples'.format(prefix, channel)]
+            result.append(event_class(
+                channels=channel * np.ones(len(samples)),
+                channel_states=self._events['{}{}_states'.format(prefix, channel)].astype('int64'),
+                times=(self.first_timestamp + samples) / self.sample_rate))
+        return result
+
+    @property
+    def digital_in_events(self):
+        return self._digital_events('digital_in', pyintan.core.DigitalIn)
+
+    @property
+    def digital_out_events(self):
+        return self._digital_events('digital_out', pyintan.core.DigitalOut)
+
+    def rising_edges(self, channel):
+        '''
+        Sorted sample indices of the rising edges on a digital input
+        channel, None if the channel has no events. The indices count from
+        the first sample in the file, not from timestamp 0, so they index
+        the recording directly. The digital event times include
+        first_timestamp.
+        '''
+        name = 'digital_in_channel_{}'.format(int(channel))
+        if name + '_samples' not in self._events:
+            return None
+        samples = self._events[name + '_samples']
+        return np.sort(samples[self._events[name + '_states'] == 1]).astype('int64')
+
+    @property
+    def channel_names(self):
+        '''
+        Names of the channels sampled at every sample, e.g. amplifier and
+        analog channels.
+        '''
+        return [ch['native_channel_name'] for ch in self._ordered_channels
+                if self._dtype[ch['native_channel_name']].shape == (self._block_size,)]
+
+    def iter_chunks(self, channel_names=None, scaled=True):
+        '''
+        Yield (first sample, signals) for the raw data, chunk by chunk.
+        Signals have shape (samples, channels), in the channel units if
+        scaled and as stored otherwise.
+        '''
+        channel_names = channel_names or self.channel_names
+        info = {ch['native_channel_name']: ch for ch in self._ordered_channels}
+        for first, blocks in self.iter_blocks():
+            signals = np.empty((len(blocks) * self._block_size, len(channel_names)),
+                               dtype='float32' if scaled else 'uint16')
+            for i, name in enumerate(channel_names):
+                values = blocks[name].reshape(-1)
+                if scaled:
+                    signals[:, i] = values * info[name]['gain'] + info[name]['offset']
+                else:
+                    signals[:, i] = values
+            yield first * self._block_size, signals
@@ -0,0 +1,189 @@
+from expipe_plugin_cinpla.imports import *
+from . import utils
+from pathlib import Path
+import contextlib
+import sqlite3
+import time
+import traceback
+
+JOB_FILE = 'processing_jobs.sqlite'
+PROCESSORS = {
+    'openephys': ('expipe_plugin_cinpla.scripts.openephys', 'process_openephys'),
+    'intan': ('expipe_plugin_cinpla.scripts.intan', 'process_intan'),
+}
+
+
+def get_queue(project):
+    '''
+    Job queue stored in the project folder, raises ValueError when the
+    project is not stored on the filesystem.
+    '''
+    return JobQueue(utils.project_path(project) / JOB_FILE)
+
+
+class JobQueue:
+    '''
+    Processing jobs persisted in a SQLite file. A job is one action id
+    processed with the function registered in PROCESSORS under its kind,
+    with the given keyword arguments. Status is one of 'pending',
+    'running', 'done' or 'failed'.
+    '''
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT, action_id TEXT, params TEXT, '
+                'spikesort INTEGER, ram_gb REAL, status TEXT, attempts INTEGER DEFAULT 0, '
+                'error TEXT, created REAL, started REAL, finished REAL)')
+
+    @contextlib.contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(str(self.path), timeout=60)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def add(self, kind, action_id, params=None, ram_gb=4):
+        '''
+        Add a job unless the same job is already pending, running or done,
+        failed jobs are set to pending again. Returns the job id.
+        '''
+        if kind not in PROCESSORS:
+            raise ValueError('Unknown job kind "{}", use one of {}'.format(kind, list(PROCESSORS)))
+        params = params or {}
+        params_dump = json.dumps(params, sort_keys=True)
+        spikesort = int(params.get('spikesort', True))
+        with self._connect() as conn:
+            row = conn.execute(
+                'SELECT id, status FROM jobs WHERE kind=? AND action_id=? AND params=?',
+                (kind, action_id, params_dump)).fetchone()
+            if row is not None:
+                if row['status'] == 'failed':
+                    conn.execute("UPDATE jobs SET status='pending', error=NULL WHERE id=?", (row['id'],))
+                return row['id']
+            cursor = conn.execute(
+                'INSERT INTO jobs (kind, action_id, params, spikesort, ram_gb, status, created) '
+                "VALUES (?, ?, ?, ?, ?, 'pending', ?)",
+                (kind, action_id, params_dump, spikesort, ram_gb, time.time()))
+            return cursor.lastrowid
+
+    def get(self, job_id):
+        with self._connect() as conn:
+            row = conn.execute('SELECT * FROM jobs WHERE id=?', (job_id,)).fetchone()
+        return None if row is None else self._to_dict(row)
+
+    def jobs(self, status=None):
+        with self._connect() as conn:
+            if status is None:
+                rows = conn.execute('SELECT * FROM jobs ORDER BY id').fetchall()
+            else:
+                rows = conn.execute('SELECT * FROM jobs WHERE status=? ORDER BY id', (status,)).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def _to_dict(self, row):
+        job = dict(row)
+        job['params'] = json.loads(job['params'])
+        return job
+
+    def set_status(self, job_id, status, error=None):
+        with self._connect() as conn:
+            if status == 'running':
+                conn.execute(
+                    'UPDATE jobs SET status=?, error=NULL, started=?, finished=NULL, attempts=attempts + 1 '
+                    'WHERE id=?', (status, time.time(), job_id))
+            else:
+                conn.execute('UPDATE jobs SET status=?, error=?, finished=? WHERE id=?',
+                             (status, error, time.time(), job_id))
+
+    def reset(self, status='running'):
+        '''
+        Set jobs with the given status back to pending, e.g. jobs left
+        running when the scheduler was stopped.
+        '''
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET status='pending' WHERE status=?", (status,))
+
+    def remove(self, status='done'):
+        with self._connect() as conn:
+            conn.execute('DELETE FROM jobs WHERE status=?', (status,))
+
+
+def _run_job(queue_path, job_id, project_path):
+    import importlib
+    queue = JobQueue(queue_path)
+    job = queue.get(job_id)
+    try:
+        module_name, function_name = PROCESSORS[job['kind']]
+        process = getattr(importlib.import_module(module_name), function_name)
+        project = expipe.get_project(path=project_path)
+        process(project=project, action_id=job['action_id'], **job['params'])
+    except BaseException:
+        queue.set_status(job_id, 'failed', error=traceback.format_exc())
+        raise SystemExit(1)
+    queue.set_status(job_id, 'done')
+
+
+def _fits(job, running, max_sorts, ram_budget_gb):
+    if len(running) == 0:
+        return True
+    if job['spikesort'] and sum(j['spikesort'] for _, j in running.values()) >= max_sorts:
+        return False
+    if ram_budget_gb is not None and sum(j['ram_gb'] for _, j in running.values()) + job['ram_gb'] > ram_budget_gb:
+        return False
+    return True
+
+
+def run_queue(queue, project_path, max_workers=2, max_sorts=1, ram_budget_gb=None, poll_interval=1):
+    '''
+    Run the pending jobs, each in its own process. Jobs left running by a
+    previous scheduler are started again, done jobs are skipped.
+
+    Parameters
+    ----------
+    max_workers : int
+        Maximum number of jobs running at the same time.
+    max_sorts : int
+        Maximum number of jobs with spike sorting running at the same time.
+    ram_budget_gb : float
+        Maximum sum of the memory estimate (ram_gb) of the running jobs.
+    '''
+    import multiprocessing
+    context = multiprocessing.get_context('spawn')
+    queue.reset('running')
+    running = {}
+    try:
+        while True:
+            for job_id, (proc, job) in list(running.items()):
+                if proc.is_alive():
+                    continue
+                proc.join()
+                del running[job_id]
+                if queue.get(job_id)['status'] == 'running':
+                    queue.set_status(job_id, 'failed', error='Exit code {}'.format(proc.exitcode))
+                print('Job', job_id, job['kind'], job['action_id'], queue.get(job_id)['status'])
+            pending = queue.jobs(status='pending')
+            if len(pending) == 0 and len(running) == 0:
+                break
+            for job in pending:
+                if len(running) >= max_workers:
+                    break
+                if not _fits(job, running, max_sorts, ram_budget_gb):
+                    continue
+                queue.set_status(job['id'], 'running')
+                proc = context.Process(target=_run_job, args=(str(queue.path), job['id'], str(project_path)))
+                proc.start()
+                running[job['id']] = (proc, job)
+                print('Started job', job['id'], job['kind'], job['action_id'])
+            time.sleep(poll_interval)
+    except KeyboardInterrupt:
+        print('Stopping, unfinished jobs will be resumed on the next run')
+        for proc, job in running.values():
+            proc.terminate()
+            proc.join()
+        queue.reset('running')
+        raise
@@ -0,0 +1,712 @@
+from expipe_plugin_cinpla.imports import *
+from pathlib import Path
+import time
+
+# spiketoolkit filters work on a fixed grid of chunks, each padded with
+# zeros outside the recording, we use the same grid to get identical results
+FILTER_CHUNK_SIZE = 30000
+FILTER_PADDING = 3000
+# frames (after resampling) added on each side of a block before resampling
+RESAMPLE_PADDING = 1000
+
+
+def _filter_dtype(dtype):
+    dtype = np.dtype(dtype)
+    if dtype.kind == 'u':
+        return np.dtype('int' + str(dtype.itemsize * 8)), - 2 ** (dtype.itemsize * 8 - 1)
+    return dtype, 0
+
+
+def get_reference_groups(channel_ids, reference, split):
+    '''
+    Translate the "ref" and "split" options of process_openephys and
+    process_intan to a reference method and channel groups.
+
+    Returns
+    -------
+    reference : str or None
+        'median', 'average' or None
+    groups : list or None
+    '''
+    if reference is None or reference.lower() == 'none':
+        return None, None
+    if reference.lower() == 'cmr':
+        method = 'median'
+    elif reference.lower() == 'car':
+        method = 'average'
+    else:
+        raise Exception("'reference' can be either 'cmr' or 'car'")
+    channel_ids = list(channel_ids)
+    if split == 'all':
+        groups = None
+    elif split == 'half':
+        groups = [channel_ids[:int(len(channel_ids) / 2)],
+                  channel_ids[int(len(channel_ids) / 2):]]
+    elif isinstance(split, list):
+        groups = split
+    else:
+        raise Exception("'split' must be a list of lists")
+    return method, groups
+
+
+class _BufferedSource:
+    '''
+    Serves raw traces from a buffer which is filled once per block.
+    Frames outside the recording are zeros, as in spiketoolkit.
+    '''
+    def __init__(self, recording, channel_ids):
+        self.recording = recording
+        self.channel_ids = list(channel_ids)
+        self.num_frames = recording.get_num_frames()
+        self.dtype, self._offset = _filter_dtype(recording.get_dtype())
+        self._start = 0
+        self._buffer = np.zeros((len(self.channel_ids), 0))
+
+    def load(self, start, stop):
+        self._start = start
+        self._buffer = np.zeros((len(self.channel_ids), stop - start))
+        i1, i2 = max(start, 0), min(stop, self.num_frames)
+        if i2 > i1:
+            traces = self.recording.get_traces(
+                channel_ids=self.channel_ids, start_frame=i1, end_frame=i2)
+            if self._offset != 0:
+                traces = (traces.astype('int64') + self._offset).astype(self.dtype)
+            self._buffer[:, i1 - start:i2 - start] = traces
+
+    def get(self, start, stop):
+        i1, i2 = start - self._start, stop - self._start
+        if i1 < 0 or i2 > self._buffer.shape[1]:
+            raise ValueError('Requested frames outside of the loaded block')
+        return self._buffer[:, i1:i2]
+
+
+class _GridFilter:
+    '''
+    Applies a filter function on the chunk grid used by spiketoolkit,
+    filtered chunks are kept until the engine moves past them.
+    '''
+    def __init__(self, source, do_filter, dtype, chunk_size=FILTER_CHUNK_SIZE,
+                 padding=FILTER_PADDING):
+        self.source = source
+        self.num_frames = source.num_frames
+        self.dtype = dtype
+        self._do_filter = do_filter
+        self._chunk_size = chunk_size
+        self._padding = padding
+        self._chunks = {}
+
+    def _filtered_chunk(self, ich):
+        if ich not in self._chunks:
+            i1 = ich * self._chunk_size - self._padding
+            i2 = (ich + 1) * self._chunk_size + self._padding
+            padded = self._do_filter(np.array(self.source.get(i1, i2), dtype=float))
+            self._chunks[ich] = padded[:, self._padding:-self._padding].astype(self.dtype)
+        return self._chunks[ich]
+
+    def get(self, start, stop):
+        out = np.zeros((len(self.source.channel_ids), stop - start))
+        i1, i2 = max(start, 0), min(stop, self.num_frames)
+        if i2 <= i1:
+            return out
+        for ich in range(i1 // self._chunk_size, (i2 - 1) // self._chunk_size + 1):
+            c1 = max(i1, ich * self._chunk_size)
+            c2 = min(i2, (ich + 1) * self._chunk_size)
+            chunk = self._filtered_chunk(ich)
+            out[:, c1 - start:c2 - start] = chunk[:, c1 - ich * self._chunk_size:c2 - ich * self._chunk_size]
+        return out
+
+    def release(self, before):
+        for ich in [k for k in self._chunks if (k + 1) * self._chunk_size < before]:
+            del self._chunks[ich]
+
+    @property
+    def channel_ids(self):
+        return self.source.channel_ids
+
+
+def butter_bandpass(fs, freq_min, freq_max, order):
+    import scipy.signal as ss
+    band = np.array([freq_min, freq_max]) / (fs / 2.)
+    b, a = ss.butter(order, band, btype='bandpass')
+    if not np.all(np.abs(np.roots(a)) < 1):
+        raise ValueError('Filter is not stable')
+    return lambda chunk: ss.filtfilt(b, a, chunk, axis=1)
+
+
+def fft_bandpass(fs, freq_min, freq_max, freq_wid=1000):
+    from scipy import special
+
+    def do_filter(chunk):
+        N = chunk.shape[1]
+        k_inds = np.arange(0, N)
+        k_inds = np.where(k_inds <= (N + 1) / 2, k_inds, k_inds - N)
+        absf = np.abs(k_inds * fs / N)
+        val = np.ones(absf.shape)
+        if freq_min != 0:
+            val = val * (1 + special.erf(3.0 * (absf - freq_min) / freq_min)) / 2
+            val = np.where(np.abs(k_inds) < 0.1, 0, val)
+        if freq_max != 0:
+            val = val * (1 - special.erf((absf - freq_max) / freq_wid)) / 2
+        chunk_fft = np.fft.rfft(chunk)
+        kernel = np.sqrt(val)[0:chunk_fft.shape[1]]
+        return np.fft.irfft(chunk_fft * kernel[np.newaxis, :])
+    return do_filter
+
+
+def iir_notch(fs, freq, q):
+    '''
+    Notch filter at one or several frequencies, applied one after the other.
+    '''
+    import scipy.signal as ss
+    coefficients = []
+    for f in np.atleast_1d(freq):
+        b, a = ss.iirnotch(f / (fs / 2.), q)
+        if not np.all(np.abs(np.roots(a)) < 1):
+            raise ValueError('Filter is not stable')
+        coefficients.append((b, a))
+
+    def do_filter(chunk):
+        for b, a in coefficients:
+            chunk = ss.filtfilt(b, a, chunk, axis=1)
+        return chunk
+    return do_filter
+
+
+def estimate_psd(preprocessor, n_windows=20, window_s=2, freq_resolution=5, seed=0):
+    '''
+    Welch power spectral density of the high-pass filtered signal, averaged
+    over channels and over windows drawn at random across the recording.
+    Only one window is in memory at a time.
+
+    Returns
+    -------
+    freqs : np.array
+    psd : np.array
+    '''
+    import scipy.signal as ss
+    fs = preprocessor.fs
+    num_frames = preprocessor.num_frames
+    window = min(int(window_s * fs), num_frames)
+    nperseg = min(int(fs / freq_resolution), window)
+    random = np.random.RandomState(seed)
+    starts = np.sort(random.randint(0, num_frames - window + 1, size=n_windows))
+    psd = None
+    for start in starts:
+        traces = preprocessor.highpass_traces(start_frame=start, end_frame=start + window)
+        freqs, p = ss.welch(traces, fs, nperseg=nperseg)
+        p = p.mean(axis=0)
+        psd = p if psd is None else psd + p
+    return freqs, psd / len(starts)
+
+
+def find_noise_peaks(freqs, psd, freq_min=300, freq_max=4000, threshold=5, max_peaks=10, baseline_hz=200):
+    '''
+    Frequencies where the power is more than threshold times the median
+    power in the surrounding baseline_hz, e.g. line noise and its harmonics.
+    At most max_peaks frequencies are returned, sorted.
+    '''
+    import scipy.signal as ss
+    mask = (freqs > freq_min) & (freqs < freq_max)
+    f, p = freqs[mask], psd[mask]
+    if len(f) < 3:
+        return []
+    kernel = int(baseline_hz / (f[1] - f[0])) // 2 * 2 + 1
+    baseline = ss.medfilt(p, min(kernel, len(p) // 2 * 2 - 1))
+    peaks, properties = ss.find_peaks(p / baseline, height=threshold)
+    strongest = np.argsort(properties['peak_heights'])[::-1][:max_peaks]
+    return sorted(float(freq) for freq in f[peaks[strongest]])
+
+
+def _group_indices(channel_ids, groups):
+    channel_ids = list(channel_ids)
+    if groups is None:
+        return [list(range(len(channel_ids)))]
+    idxs = [[i for i, ch in enumerate(channel_ids) if ch in group] for group in groups]
+    return [i for i in idxs if len(i) > 0]
+
+
+def common_reference(traces, channel_ids, reference, groups=None):
+    '''
+    Common median/average reference of traces (channels x frames) in groups
+    of channel ids, channels outside all groups are dropped like in
+    spiketoolkit.
+    '''
+    channel_ids = list(channel_ids)
+    func = np.median if reference == 'median' else np.mean
+    out, out_ids = [], []
+    for idxs in _group_indices(channel_ids, groups):
+        out.append(traces[idxs] - func(traces[idxs], axis=0, keepdims=True))
+        out_ids.extend([channel_ids[i] for i in idxs])
+    return np.vstack(out), out_ids
+
+
+def artifact_mask(num_frames, start_frame, triggers, pad_before, pad_after):
+    '''
+    Boolean mask of the frames in [trigger - pad_before, trigger + pad_after)
+    for frames start_frame to start_frame + num_frames, triggers must be
+    sorted.
+    '''
+    i1 = np.searchsorted(triggers, start_frame - pad_after, side='right')
+    i2 = np.searchsorted(triggers, start_frame + num_frames + pad_before, side='left')
+    triggers = np.asarray(triggers[i1:i2], dtype='int64') - start_frame
+    edges = np.zeros(num_frames + 1, dtype='int64')
+    np.add.at(edges, np.clip(triggers - pad_before, 0, num_frames), 1)
+    np.add.at(edges, np.clip(triggers + pad_after, 0, num_frames), -1)
+    return np.cumsum(edges[:-1]) > 0
+
+
+def blank_artifacts(traces, start_frame, triggers, pad_before, pad_after, mode='zeros'):
+    '''
+    Remove artifacts around triggers (in frames) from traces starting at
+    start_frame. With mode 'zeros' the artifacts are set to zero, with
+    'linear' they are linearly interpolated from the surrounding frames.
+    '''
+    mask = artifact_mask(traces.shape[1], start_frame, triggers, pad_before, pad_after)
+    if not mask.any():
+        return traces
+    if mode == 'linear' and np.sum(~mask) >= 2:
+        frames = np.arange(traces.shape[1])
+        for ch in range(traces.shape[0]):
+            traces[ch, mask] = np.interp(frames[mask], frames[~mask], traces[ch, ~mask])
+    elif mode in ['zeros', 'linear']:
+        traces[:, mask] = 0
+    else:
+        raise ValueError("'mode' can be either 'zeros' or 'linear'")
+    return traces
+
+
+def create_exdir_timeseries(exdir_path, kind, recording, channel_ids, sampling_frequency, num_frames, dtype):
+    '''
+    Create the LFP or MUA groups in processing/electrophysiology with the
+    same layout as ExdirRecordingExtractor.write_recording, the data files
+    are allocated on disk and filled later.
+
+    Parameters
+    ----------
+    kind : str
+        'LFP' or 'MUA'
+    recording : RecordingExtractor
+        Recording with the channel groups.
+
+    Returns
+    -------
+    data_files : list
+        Path to the data file of each channel.
+    '''
+    channel_ids = list(channel_ids)
+    exdir_group = exdir.File(exdir_path, plugins=exdir.plugins.quantities)
+    ephys = exdir_group.require_group('processing').require_group('electrophysiology')
+    ephys.attrs['sample_rate'] = sampling_frequency * pq.Hz
+    if 'group' in recording.get_shared_channel_property_names():
+        channel_groups = list(recording.get_channel_groups(channel_ids=channel_ids))
+    else:
+        channel_groups = [0] * len(channel_ids)
+    if len(np.unique(channel_groups)) == 1:
+        channel_groups = [0] * len(channel_ids)
+    stop_time = num_frames / float(sampling_frequency) * pq.s
+    data_files = []
+    for chan in np.unique(channel_groups):
+        ch_group = ephys.require_group('channel_group_' + str(chan))
+        ch_group.attrs['electrode_group_id'] = chan
+        ch_group.attrs['electrode_identities'] = np.array(
+            [ch for ch, g in zip(channel_ids, channel_groups) if g == chan])
+        ch_group.attrs['electrode_idx'] = np.array(
+            [i_c for i_c, g in enumerate(channel_groups) if g == chan])
+        ch_group.attrs['start_time'] = 0 * pq.s
+        ch_group.attrs['stop_time'] = stop_time
+        ch_group.require_group(kind)
+    for i_c, (ch, chan) in enumerate(zip(channel_ids, channel_groups)):
+        ts_group = ephys['channel_group_' + str(chan)][kind].require_group(kind + '_timeseries_' + str(ch))
+        ts_group.attrs['electrode_group_id'] = chan
+        ts_group.attrs['electrode_identity'] = ch
+        ts_group.attrs['num_samples'] = num_frames
+        ts_group.attrs['electrode_idx'] = i_c
+        ts_group.attrs['start_time'] = 0 * pq.s
+        ts_group.attrs['stop_time'] = stop_time
+        ts_group.attrs['sample_rate'] = sampling_frequency * pq.Hz
+        if 'data' in ts_group:
+            data = ts_group['data']
+        else:
+            data = ts_group.create_dataset('data', data=np.zeros((1, 0), dtype=dtype))
+        data.attrs['sample_rate'] = sampling_frequency * pq.Hz
+        data.attrs['unit'] = pq.uV
+        # allocate the full dataset on disk without creating it in memory
+        memmap = np.lib.format.open_memmap(data.data_filename, mode='w+', dtype=dtype, shape=(1, num_frames))
+        memmap.flush()
+        del memmap
+        data_files.append(Path(data.data_filename))
+    return data_files
+
+
+class _ChannelFiles:
+    '''
+    One .npy file of shape (1, frames) per channel, written like a single
+    (frames, channels) memory map.
+    '''
+    def __init__(self, data_files):
+        self.data = [np.load(str(f), mmap_mode='r+') for f in data_files]
+
+    def __setitem__(self, key, value):
+        for i, data in enumerate(self.data):
+            data[0, key] = value[:, i]
+
+    def flush(self):
+        for data in self.data:
+            data.flush()
+
+
+class FusedPreprocessor:
+    '''
+    Single pass preprocessing of a raw recording. Each block of raw data is
+    read once and used to produce the high-pass filtered and referenced
+    signal used for spike sorting, the LFP and the MUA. The filters are the
+    same as in spiketoolkit.preprocessing and are applied on the same chunk
+    grid, the outputs are written to binary .dat files and returned as
+    spikeextractors recordings. The filtered signal is identical to the
+    spiketoolkit chain, LFP and MUA are resampled per block with padding and
+    only differ from resampling the whole signal close to the recording edges.
+
+    Parameters
+    ----------
+    recording : RecordingExtractor
+        Raw recording with probe loaded.
+    channel_ids : list
+        Channels to filter, all channels by default.
+    reference : str
+        'median', 'average' or None.
+    groups : list
+        Channel groups for the reference.
+    '''
+    def __init__(self, recording, channel_ids=None, reference=None, groups=None,
+                 freq_min_hp=300, freq_max_hp=3000, type_hp='butter', order_hp=5,
+                 freq_min_lfp=1, freq_max_lfp=300, freq_resample_lfp=1000,
+                 freq_resample_mua=1000, freq_notch=None, q_notch=30,
+                 triggers=None, ms_before_stim=0.5, ms_after_stim=3, artifact_mode='zeros'):
+        self.recording = recording
+        self.fs = recording.get_sampling_frequency()
+        self.num_frames = recording.get_num_frames()
+        if channel_ids is None:
+            channel_ids = recording.get_channel_ids()
+        self.channel_ids = list(channel_ids)
+        self.active_channels = list(channel_ids)
+        self.reference = reference
+        self.groups = groups
+        self.freq_min_hp = freq_min_hp
+        self.freq_max_hp = freq_max_hp
+        self.type_hp = type_hp
+        self.order_hp = order_hp
+        self.freq_min_lfp = freq_min_lfp
+        self.freq_max_lfp = freq_max_lfp
+        self.freq_resample_lfp = freq_resample_lfp
+        self.freq_resample_mua = freq_resample_mua
+        self.freq_notch = freq_notch
+        self.q_notch = q_notch
+        self.triggers = None if triggers is None else np.sort(np.asarray(triggers, dtype='int64'))
+        self.ms_before_stim = ms_before_stim
+        self.ms_after_stim = ms_after_stim
+        self.artifact_mode = artifact_mode
+        self._build()
+
+    def _build(self):
+        self._source = _BufferedSource(self.recording, self.channel_ids)
+        self.dtype = self._source.dtype
+        if self.type_hp == 'butter':
+            hp_filter = butter_bandpass(self.fs, self.freq_min_hp, self.freq_max_hp, self.order_hp)
+        else:
+            hp_filter = fft_bandpass(self.fs, self.freq_min_hp, self.freq_max_hp)
+        self._hp = _GridFilter(self._source, hp_filter, self.dtype)
+        self._notch = None
+        if self.freq_notch is not None:
+            self._notch = _GridFilter(self._hp, iir_notch(self.fs, self.freq_notch, self.q_notch), self.dtype)
+        self._lfp = _GridFilter(
+            self._source, fft_bandpass(self.fs, self.freq_min_lfp, self.freq_max_lfp), self.dtype)
+
+    @property
+    def _stages(self):
+        return [s for s in [self._hp, self._notch, self._lfp] if s is not None]
+
+    @property
+    def margin(self):
+        # frames needed around a block to filter it on the chunk grid
+        margin = FILTER_CHUNK_SIZE + FILTER_PADDING
+        if self._notch is not None:
+            margin += FILTER_CHUNK_SIZE + FILTER_PADDING
+        decimate = max(int(np.ceil(self.fs / self.freq_resample_lfp)),
+                       int(np.ceil(self.fs / self.freq_resample_mua)))
+        return margin + decimate * (RESAMPLE_PADDING + 1)
+
+    def set_notch(self, freq_notch, q_notch=None):
+        '''
+        Set the notch frequency, a list of frequencies are removed in the
+        same pass. None or an empty list removes the notch.
+        '''
+        if freq_notch is not None and len(np.atleast_1d(freq_notch)) == 0:
+            freq_notch = None
+        self.freq_notch = freq_notch
+        if q_notch is not None:
+            self.q_notch = q_notch
+        self._build()
+
+    def set_triggers(self, triggers, ms_before_stim=None, ms_after_stim=None, artifact_mode=None):
+        self.triggers = None if triggers is None else np.sort(np.asarray(triggers, dtype='int64'))
+        if ms_before_stim is not None:
+            self.ms_before_stim = ms_before_stim
+        if ms_after_stim is not None:
+            self.ms_after_stim = ms_after_stim
+        if artifact_mode is not None:
+            self.artifact_mode = artifact_mode
+
+    def highpass_traces(self, start_frame, end_frame):
+        '''
+        High-pass (and notch) filtered traces, before referencing.
+        '''
+        self._source.load(start_frame - self.margin, end_frame + self.margin)
+        stage = self._notch or self._hp
+        traces = stage.get(start_frame, end_frame).astype(self.dtype)
+        for stage in self._stages:
+            stage._chunks.clear()
+        return traces
+
+    def detect_bad_channels(self, bad_threshold=2, seconds=10):
+        '''
+        Find channels with a standard deviation above bad_threshold times the
+        median standard deviation of the referenced signal in the middle of
+        the recording, like spiketoolkit.preprocessing.remove_bad_channels.
+        The bad channels are removed from the active channels.
+        '''
+        start_frame = self.num_frames // 2
+        end_frame = min(int(start_frame + seconds * self.fs), self.num_frames)
+        if self.reference is None:
+            channel_ids = list(self.recording.get_channel_ids())
+            traces = self.recording.get_traces(start_frame=start_frame, end_frame=end_frame)
+        else:
+            traces = self.highpass_traces(start_frame, end_frame)
+            traces, channel_ids = self._reference(traces.astype(float))
+            traces = traces.astype(self.dtype)
+        stds = np.std(traces, axis=1)
+        bad_channel_ids = [ch for ch, std in zip(channel_ids, stds)
+                           if std > bad_threshold * np.median(stds)]
+        self.active_channels = [ch for ch in self.active_channels if ch not in bad_channel_ids]
+        return bad_channel_ids
+
+    def _reference(self, traces):
+        return common_reference(traces, self.channel_ids, self.reference, self.groups)
+
+    def _active_idxs(self, channel_ids):
+        return [i for i, ch in enumerate(channel_ids) if ch in self.active_channels]
+
+    def _filt_channel_ids(self):
+        if self.reference is None:
+            return list(self.recording.get_channel_ids())
+        channel_ids = [self.channel_ids[i] for idxs in _group_indices(self.channel_ids, self.groups)
+                       for i in idxs]
+        return [ch for ch in channel_ids if ch in self.active_channels]
+
+    def _filt_traces(self, start, stop):
+        pad_before = int(self.ms_before_stim * self.fs / 1000)
+        pad_after = int(self.ms_after_stim * self.fs / 1000)
+        # the block is padded by the artifact window, so artifacts crossing
+        # the block edges are interpolated from the frames around them
+        pad = 0 if self.triggers is None else pad_before + pad_after + 1
+        i1, i2 = max(start - pad, 0), min(stop + pad, self.num_frames)
+        if self.reference is None:
+            traces = self.recording.get_traces(start_frame=i1, end_frame=i2)
+            dtype = self.recording.get_dtype()
+        else:
+            stage = self._notch or self._hp
+            traces, channel_ids = self._reference(stage.get(i1, i2).astype(self.dtype).astype(float))
+            traces = traces[self._active_idxs(channel_ids)]
+            dtype = self.dtype
+        if self.triggers is not None:
+            traces = blank_artifacts(
+                np.array(traces), i1, self.triggers, pad_before, pad_after, mode=self.artifact_mode)
+        return traces[:, start - i1:stop - i1].astype(dtype)
+
+    def _resampled_frames(self, rate):
+        return int(self.num_frames / self.fs * rate)
+
+    def _resampled_traces(self, key, out_start, out_stop):
+        import scipy.signal as ss
+        if key == 'lfp':
+            rate, stage, dtype = self.freq_resample_lfp, self._lfp, self.dtype
+        else:
+            rate, stage, dtype = self.freq_resample_mua, self._source, self.recording.get_dtype()
+        # resample with padding to avoid edge effects between blocks
+        pad_start = max(out_start - RESAMPLE_PADDING, 0)
+        pad_stop = min(out_stop + RESAMPLE_PADDING, self._resampled_frames(rate))
+        i1 = int(pad_start / rate * self.fs)
+        i2 = int(pad_stop / rate * self.fs)
+        traces = stage.get(i1, i2)[self._active_idxs(stage.channel_ids)]
+        if key == 'mua':
+            # rectify the raw signal
+            traces = np.abs(traces - self._source._offset).astype(dtype)
+        else:
+            traces = traces.astype(dtype)
+        traces = ss.resample(traces, pad_stop - pad_start, axis=1)
+        return traces[:, out_start - pad_start:out_stop - pad_start].astype(dtype)
+
+    def _block_size(self, chunk_mb):
+        n_bytes = np.dtype(float).itemsize * len(self.channel_ids)
+        block_size = max(int(chunk_mb * 1e6 / n_bytes), FILTER_CHUNK_SIZE)
+        return block_size // FILTER_CHUNK_SIZE * FILTER_CHUNK_SIZE
+
+    def outputs(self, tmp_folder, spikesort=True, compute_lfp=True, compute_mua=False):
+        '''
+        File path, sampling frequency, channel ids, number of frames and
+        dtype of each output.
+        '''
+        tmp_folder = Path(tmp_folder)
+        outputs = {}
+        if spikesort:
+            dtype = self.recording.get_dtype() if self.reference is None else self.dtype
+            outputs['filt'] = (tmp_folder / 'filt.dat', self.fs, self._filt_channel_ids(),
+                               self.num_frames, np.dtype(dtype))
+        if compute_lfp:
+            outputs['lfp'] = (tmp_folder / 'lfp.dat', self.freq_resample_lfp, list(self.active_channels),
+                              self._resampled_frames(self.freq_resample_lfp), np.dtype(self.dtype))
+        if compute_mua:
+            outputs['mua'] = (tmp_folder / 'mua.dat', self.freq_resample_mua, list(self.active_channels),
+                              self._resampled_frames(self.freq_resample_mua),
+                              np.dtype(self.recording.get_dtype()))
+        return outputs
+
+    def _process_block(self, start, stop, outputs, memmaps):
+        self._source.load(start - self.margin, stop + self.margin)
+        if 'filt' in memmaps:
+            memmaps['filt'][start:stop] = self._filt_traces(start, stop).T
+        for key in ['lfp', 'mua']:
+            if key not in memmaps:
+                continue
+            rate, num_frames = outputs[key][1], outputs[key][3]
+            out_start = int(np.ceil(start / self.fs * rate))
+            if stop == self.num_frames:
+                out_stop = num_frames
+            else:
+                out_stop = int(np.ceil(stop / self.fs * rate))
+            if out_stop > out_start:
+                memmaps[key][out_start:out_stop] = self._resampled_traces(key, out_start, out_stop).T
+        for stage in self._stages:
+            stage.release(stop - self.margin)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for key in ['_source', '_hp', '_notch', '_lfp']:
+            state.pop(key, None)
+        state['recording'] = self.recording.dump_to_dict()
+        return state
+
+    def __setstate__(self, state):
+        import spikeextractors as se
+        state['recording'] = se.load_extractor_from_dict(state['recording'])
+        self.__dict__.update(state)
+        self._build()
+
+    def _can_pickle(self):
+        try:
+            return self.recording.check_if_dumpable()
+        except Exception:
+            return False
+
+    def run(self, tmp_folder, spikesort=True, compute_lfp=True, compute_mua=False,
+            chunk_mb=500, n_jobs=1, exdir_path=None, verbose=True):
+        '''
+        Read the raw recording once and write filt.dat, lfp.dat and mua.dat
+        to tmp_folder.
+
+        Parameters
+        ----------
+        exdir_path : str or Path
+            If given LFP and MUA are written directly to the exdir file
+            instead of lfp.dat and mua.dat.
+        chunk_mb : float
+            Memory used for each block of raw data, in each process.
+        n_jobs : int
+            Number of processes, each process reads a contiguous range of
+            blocks with an overlap margin and writes into the shared memory
+            mapped outputs.
+
+        Returns
+        -------
+        recordings : dict
+            BinDatRecordingExtractors with keys 'filt', 'lfp' and 'mua',
+            outputs written to exdir are not included.
+        '''
+        outputs = self.outputs(tmp_folder, spikesort, compute_lfp, compute_mua)
+        if len(outputs) == 0:
+            return {}
+        if n_jobs > 1 and not self._can_pickle():
+            print('Recording can not be passed to other processes, running with n_jobs=1')
+            n_jobs = 1
+        t_start = time.time()
+        Path(tmp_folder).mkdir(parents=True, exist_ok=True)
+        for key, (path, fs, channel_ids, num_frames, dtype) in outputs.items():
+            if exdir_path is not None and key in ['lfp', 'mua']:
+                data_files = create_exdir_timeseries(
+                    exdir_path, key.upper(), self.recording, channel_ids, fs, num_frames, dtype)
+                outputs[key] = (data_files, fs, channel_ids, num_frames, dtype)
+            else:
+                memmap = np.memmap(str(path), dtype=dtype, mode='w+', shape=(num_frames, len(channel_ids)))
+                memmap.flush()
+                del memmap
+        block_size = self._block_size(chunk_mb)
+        blocks = [(start, min(start + block_size, self.num_frames))
+                  for start in range(0, self.num_frames, block_size)]
+        if n_jobs > 1:
+            from concurrent.futures import ProcessPoolExecutor, as_completed
+            # one contiguous range of blocks per process, the preprocessor is
+            # sent and rebuilt once per process and reuses filtered chunks
+            # between its consecutive blocks
+            ranges = [list(r) for r in np.array_split(np.arange(len(blocks)), min(n_jobs, len(blocks)))]
+            with ProcessPoolExecutor(max_workers=len(ranges)) as executor:
+                futures = {executor.submit(_process_blocks, self, outputs, [blocks[i] for i in r]): len(r)
+                           for r in ranges}
+                done = 0
+                for future in as_completed(futures):
+                    future.result()
+                    done += futures[future]
+                    if verbose:
+                        print('Preprocessed block {}/{}'.format(done, len(blocks)))
+        else:
+            _process_blocks(self, outputs, blocks, verbose=verbose)
+        if verbose:
+            elapsed = time.time() - t_start
+            size_mb = self.num_frames * len(self.channel_ids) * np.dtype(self.recording.get_dtype()).itemsize / 1e6
+            print('Preprocessed {:.1f} MB in {:.1f} s ({:.1f} MB/s, n_jobs={})'.format(
+                size_mb, elapsed, size_mb / max(elapsed, 1e-9), n_jobs))
+        return self.load_outputs(outputs)
+
+    def load_outputs(self, outputs):
+        import spikeextractors as se
+        recordings = {}
+        for key, (path, fs, channel_ids, num_frames, dtype) in outputs.items():
+            if isinstance(path, list):
+                continue
+            rec = se.BinDatRecordingExtractor(
+                str(path), sampling_frequency=fs, numchan=len(channel_ids),
+                dtype=dtype, recording_channels=channel_ids)
+            rec.copy_channel_properties(self.recording, channel_ids=channel_ids)
+            rec.clear_channel_gains()
+            rec.clear_channel_offsets()
+            recordings[key] = rec
+        return recordings
+
+
+def _process_blocks(preprocessor, outputs, blocks, verbose=False):
+    memmaps = {}
+    for key, (path, fs, channel_ids, num_frames, dtype) in outputs.items():
+        if isinstance(path, list):
+            memmaps[key] = _ChannelFiles(path)
+        else:
+            memmaps[key] = np.memmap(str(path), dtype=dtype, mode='r+', shape=(num_frames, len(channel_ids)))
+    previous_stop = None
+    for start, stop in blocks:
+        if start != previous_stop:
+            # filtered chunks are only reused between consecutive blocks
+            for stage in preprocessor._stages:
+                stage._chunks.clear()
+        previous_stop = stop
+        preprocessor._process_block(start, stop, outputs, memmaps)
+        if verbose:
+            print('Preprocessed block {}/{}'.format(blocks.index((start, stop)) + 1, len(blocks)))
+    for memmap in memmaps.values():
+        memmap.flush()
@@ -0,0 +1,312 @@
+from expipe_plugin_cinpla.imports import *
+from . import utils
+import posixpath
+import shlex
+import subprocess
+import threading
+import time
+
+LOG_FILE = 'job.log'
+EXIT_FILE = 'job.exit'
+PID_FILE = 'job.pid'
+# a login shell loads the server profile, e.g. conda activation and PATH
+JOB_SHELL = 'bash -lc'
+COMMAND_NOT_FOUND = 127
+
+
+class LocalShell:
+    '''
+    Runs commands with the local shell, used in place of a server in tests.
+    '''
+    def execute(self, cmd):
+        result = subprocess.run(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        return result.returncode, result.stdout.decode(), result.stderr.decode()
+
+    def read(self, path, offset=0):
+        try:
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                return f.read()
+        except FileNotFoundError:
+            return b''
+
+    def reconnect(self):
+        pass
+
+
+class SSHShell:
+    '''
+    Runs commands on a server through a paramiko SSHClient.
+
+    Parameters
+    ----------
+    ssh : paramiko.SSHClient
+    connect : callable
+        Returns a new SSHClient, used to reconnect after the connection
+        was lost.
+    '''
+    def __init__(self, ssh, connect=None):
+        self.ssh = ssh
+        self.connect = connect
+        self._sftp = None
+
+    def execute(self, cmd):
+        stdin, stdout, stderr = self.ssh.exec_command(cmd)
+        output, error = stdout.read().decode(), stderr.read().decode()
+        return stdout.channel.recv_exit_status(), output, error
+
+    def read(self, path, offset=0):
+        if self._sftp is None:
+            self._sftp = self.ssh.open_sftp()
+        try:
+            with self._sftp.open(path, 'rb') as f:
+                f.seek(offset)
+                return f.read()
+        except FileNotFoundError:
+            return b''
+
+    def reconnect(self):
+        if self.connect is None:
+            raise IOError('Lost connection to the server')
+        try:
+            self.ssh.close()
+        except Exception:
+            pass
+        self._sftp = None
+        self.ssh = self.connect()
+
+
+def check_output(shell, cmd):
+    '''
+    Run cmd and return stdout, raises IOError if cmd fails.
+    '''
+    status, output, error = shell.execute(cmd)
+    if status != 0:
+        raise IOError('"{}" failed with exit status {}: {}'.format(cmd, status, error))
+    return output
+
+
+class RemoteJob:
+    '''
+    A command running detached on the server, it continues if the
+    connection is lost. The output is written to job.log and the exit
+    status to job.exit in the job folder, a new RemoteJob with the same
+    folder attaches to a job that is still running.
+
+    Parameters
+    ----------
+    shell : SSHShell or LocalShell
+    folder : str
+        Job folder on the server.
+    job_shell : str
+        Command prefix running the job, the job command is passed as one
+        argument. Defaults to a bash login shell.
+    '''
+    def __init__(self, shell, folder, job_shell=JOB_SHELL):
+        self.shell = shell
+        self.folder = str(folder)
+        self.job_shell = job_shell
+        self.offset = 0
+
+    def _path(self, name):
+        return posixpath.join(self.folder, name)
+
+    def _quoted(self, name):
+        return shlex.quote(self._path(name))
+
+    def is_running(self):
+        status, _, _ = self.shell.execute(
+            'test ! -e {} && kill -0 "$(cat {} 2> /dev/null)" 2> /dev/null'.format(
+                self._quoted(EXIT_FILE), self._quoted(PID_FILE)))
+        return status == 0
+
+    def start(self, command):
+        '''
+        Start command, or attach to it if a job is already running in the
+        folder.
+        '''
+        if self.is_running():
+            print('Attaching to running job in', self.folder)
+            return
+        script = '{} {} > {} 2>&1; echo $? > {}.tmp && mv {}.tmp {}'.format(
+            self.job_shell, shlex.quote(command), self._quoted(LOG_FILE), self._quoted(EXIT_FILE),
+            self._quoted(EXIT_FILE), self._quoted(EXIT_FILE))
+        cmd = 'mkdir -p {} && rm -f {} {} && {{ nohup sh -c {} > /dev/null 2>&1 & echo $! > {}; }}'.format(
+            shlex.quote(self.folder), self._quoted(EXIT_FILE), self._quoted(LOG_FILE), shlex.quote(script),
+            self._quoted(PID_FILE))
+        check_output(self.shell, cmd)
+        self.offset = 0
+
+    def exit_status(self):
+        '''
+        Exit status of the job, None if it is still running.
+        '''
+        content = self.shell.read(self._path(EXIT_FILE)).decode().strip()
+        if content:
+            return int(content)
+        if not self.is_running():
+            # the exit file may be written between the two checks
+            content = self.shell.read(self._path(EXIT_FILE)).decode().strip()
+            if not content:
+                raise RuntimeError('Job in {} stopped without exit status'.format(self.folder))
+            return int(content)
+        return None
+
+    def read_log(self):
+        '''
+        Log written since the last call.
+        '''
+        data = self.shell.read(self._path(LOG_FILE), self.offset)
+        self.offset += len(data)
+        return data.decode(errors='replace')
+
+    def wait(self, poll_interval=1, print_log=True, reconnect_timeout=600):
+        '''
+        Stream the log until the job finishes, reconnecting if the
+        connection is lost.
+
+        Returns
+        -------
+        exit_status : int
+        '''
+        lost_since = None
+        while True:
+            try:
+                log = self.read_log()
+                if print_log and log:
+                    print(log, end='')
+                status = self.exit_status()
+                if status is not None:
+                    log = self.read_log()
+                    if print_log and log:
+                        print(log, end='')
+                    if status == COMMAND_NOT_FOUND:
+                        print('Command not found on the server, see {} and the PATH set by "{}"'.format(
+                            self._path(LOG_FILE), self.job_shell))
+                    return status
+                lost_since = None
+            except (OSError, EOFError, paramiko.SSHException) as e:
+                lost_since = lost_since or time.time()
+                if time.time() - lost_since > reconnect_timeout:
+                    raise
+                print('Lost connection ({}), reconnecting'.format(e))
+                time.sleep(poll_interval)
+                try:
+                    self.shell.reconnect()
+                except (OSError, paramiko.SSHException):
+                    pass
+                continue
+            time.sleep(poll_interval)
+
+    def remove(self):
+        check_output(self.shell, 'rm -f {} {} {}'.format(
+            self._quoted(LOG_FILE), self._quoted(EXIT_FILE), self._quoted(PID_FILE)))
+
+
+def _connect(server, timeout=10):
+    '''
+    SSHClient for a server dict. Without a password in the config the SSH
+    keys and agent are tried first, then the user is asked for the login
+    as in utils.login and the password is kept in the server dict for
+    reconnecting.
+    '''
+    ssh = paramiko.SSHClient()
+    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    try:
+        ssh.connect(hostname=server['domain'], port=server.get('port', 22), username=server.get('user'),
+                    password=server.get('password'), timeout=timeout)
+        return ssh
+    except paramiko.SSHException:
+        # also raised when no key is found
+        ssh.close()
+        if server.get('password') is not None:
+            raise
+    hostname, username, password, port = utils.get_login(
+        hostname=server['domain'], username=server.get('user'), port=server.get('port', 22))
+    ssh, scp_client, sftp_client, pbar = utils.login(
+        hostname=hostname, username=username, password=password, port=port)
+    sftp_client.close()
+    server['password'] = password
+    return ssh
+
+
+class ConnectionPool:
+    '''
+    One SSH connection per server, kept alive and shared by the transfers
+    and jobs of all actions processed on that server. Each transfer or
+    job opens its own channel on the connection.
+
+    Parameters
+    ----------
+    servers : list
+        Server dicts as in the "servers" expipe config, with the keys
+        host (name), domain, user and password, and optionally job_shell
+        (see RemoteJob). Without password SSH keys are used, or the
+        password is asked for.
+    keepalive : int
+        Seconds between keepalive packets.
+    connect : callable
+        Returns a new SSHClient for a server dict.
+    '''
+    def __init__(self, servers, keepalive=30, connect=_connect):
+        self.servers = {server['host']: server for server in servers}
+        self.keepalive = keepalive
+        self.connect = connect
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def _healthy(self, ssh):
+        transport = ssh.get_transport()
+        if transport is None or not transport.is_active():
+            return False
+        try:
+            transport.send_ignore()
+        except (OSError, EOFError, paramiko.SSHException):
+            return False
+        return True
+
+    def get(self, name):
+        '''
+        Connection to the server, reconnecting if it was lost.
+        '''
+        if name not in self.servers:
+            raise ValueError('Unknown server "{}", use one of {}'.format(name, list(self.servers)))
+        with self._lock:
+            ssh = self._clients.get(name)
+            if ssh is None or not self._healthy(ssh):
+                if ssh is not None:
+                    print('Reconnecting to', name)
+                    ssh.close()
+                ssh = self.connect(self.servers[name])
+                transport = ssh.get_transport()
+                if transport is not None:
+                    transport.set_keepalive(self.keepalive)
+                self._clients[name] = ssh
+            return ssh
+
+    def shell(self, name):
+        return SSHShell(self.get(name), connect=lambda: self.get(name))
+
+    def close(self, name=None):
+        with self._lock:
+            for key in [name] if name is not None else list(self._clients):
+                ssh = self._clients.pop(key, None)
+                if ssh is not None:
+                    ssh.close()
+
+
+_pool = None
+
+
+def get_pool():
+    '''
+    Connection pool for the servers in the expipe config, shared within
+    the process.
+    '''
+    global _pool
+    if _pool is None:
+        import atexit
+        config = expipe.config._load_config_by_name(None)
+        _pool = ConnectionPool(config.get('servers') or [])
+        atexit.register(_pool.close)
+    return _pool
@@ -0,0 +1,98 @@
+from expipe_plugin_cinpla.imports import *
+from pathlib import Path
+
+DEFAULT_REGISTRY_FILE = Path.home() / '.cache' / 'expipe' / 'sorters.json'
+
+
+def _spikesorters_version():
+    try:
+        from importlib import metadata
+        return metadata.version('spikesorters')
+    except Exception:
+        return None
+
+
+def _json_safe(value):
+    '''
+    True if value is read back from json unchanged, tuples become lists
+    and e.g. numpy values are not serializable.
+    '''
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return True
+    if isinstance(value, list):
+        return all(_json_safe(v) for v in value)
+    if isinstance(value, dict):
+        return all(isinstance(k, str) and _json_safe(v) for k, v in value.items())
+    return False
+
+
+def _sorter_class(name):
+    import spikesorters as ss
+    for sorter_class in ss.sorter_full_list:
+        if sorter_class.sorter_name == name:
+            return sorter_class
+    raise ValueError('Unknown sorter "{}"'.format(name))
+
+
+def refresh_sorters(path=None):
+    '''
+    Import spikesorters and save the name, installed status and default
+    params of each sorter to the registry file. Params that json can not
+    store exactly are listed under "live_params" and queried from the
+    sorter by default_params.
+    '''
+    import spikesorters as ss
+    path = Path(path or DEFAULT_REGISTRY_FILE)
+    sorters = []
+    registered = []
+    for sorter_class in ss.sorter_full_list:
+        try:
+            installed = bool(sorter_class.is_installed())
+        except Exception:
+            installed = False
+        params = sorter_class.default_params()
+        sorters.append({
+            'name': sorter_class.sorter_name,
+            'installed': installed,
+            'default_params': params,
+        })
+        registered.append({
+            'name': sorter_class.sorter_name,
+            'installed': installed,
+            'default_params': {k: v for k, v in params.items() if _json_safe(v)},
+            'live_params': sorted(k for k, v in params.items() if not _json_safe(v)),
+        })
+    registry = {'version': _spikesorters_version(), 'sorters': registered}
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix('.tmp')
+    with tmp_path.open('w') as f:
+        json.dump(registry, f, indent=1)
+    os.replace(str(tmp_path), str(path))
+    return sorters
+
+
+def get_sorters(path=None):
+    '''
+    Sorters in the registry file, spikesorters is only imported when the
+    file is missing or was made by another version of spikesorters.
+    '''
+    path = Path(path or DEFAULT_REGISTRY_FILE)
+    if path.is_file():
+        with path.open('r') as f:
+            registry = json.load(f)
+        if registry.get('version') == _spikesorters_version():
+            return registry['sorters']
+    return refresh_sorters(path)
+
+
+def sorter_names(installed=False, path=None):
+    return [s['name'] for s in get_sorters(path) if s['installed'] or not installed]
+
+
+def default_params(sorter, path=None):
+    for s in get_sorters(path):
+        if s['name'] == sorter:
+            if s.get('live_params'):
+                return _sorter_class(sorter).default_params()
+            return copy.deepcopy(s['default_params'])
+    raise ValueError('Unknown sorter "{}"'.format(sorter))
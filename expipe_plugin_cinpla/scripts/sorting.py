@@ -0,0 +1,199 @@
+from expipe_plugin_cinpla.imports import *
+from pathlib import Path
+import time
+
+THREAD_ENV_VARS = ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS',
+                   'NUMEXPR_NUM_THREADS', 'NUMBA_NUM_THREADS']
+
+
+def sort_recording(recording, sorter, exdir_path, tmp_folder, spikesorter_params=None, parallel=False,
+                   sort_by=None, ms_before_wf=1, ms_after_wf=2, firing_rate_threshold=0,
+                   isi_viol_threshold=0, recompute_info=True, attrs=None):
+    '''
+    Run one spike sorter on a preprocessed recording and export the result
+    to phy in processing/electrophysiology/spikesorting/<sorter>.
+
+    Parameters
+    ----------
+    attrs : dict
+        Filter and reference attributes saved with the sorting.
+    '''
+    import spiketoolkit as st
+    import spikesorters as ss
+    spikesorter_params = spikesorter_params or {}
+    firing_rate_threshold = firing_rate_threshold or 0
+    isi_viol_threshold = isi_viol_threshold or 0
+    tmp_folder = Path(tmp_folder)
+
+    exdir_group = exdir.File(exdir_path, plugins=exdir.plugins.quantities)
+    ephys = exdir_group.require_group('processing').require_group('electrophysiology')
+    spikesorting = ephys.require_group('spikesorting')
+    sorting_group = spikesorting.require_group(sorter)
+    output_folder = sorting_group.require_raw('output').directory
+    if 'kilosort' in sorter:
+        sorting = ss.run_sorter(sorter, recording,
+                                parallel=parallel, verbose=True,
+                                delete_output_folder=True, **spikesorter_params)
+    else:
+        sorting = ss.run_sorter(
+            sorter, recording, parallel=parallel,
+            grouping_property=sort_by, verbose=True, output_folder=output_folder,
+            delete_output_folder=True, **spikesorter_params)
+    spike_sorting_attrs = {'name': sorter, 'params': spikesorter_params}
+    sorting_attrs = {'spike_sorting': spike_sorting_attrs}
+    sorting_attrs.update(attrs or {})
+    sorting_group.attrs.update(sorting_attrs)
+    print(sorter, 'found ', len(sorting.get_unit_ids()), ' units!')
+
+    print('Saving Phy output')
+    phy_folder = sorting_group.require_raw('phy').directory
+    if firing_rate_threshold > 0:
+        sorting_min = st.curation.threshold_firing_rates(sorting,
+                                                         threshold=firing_rate_threshold,
+                                                         threshold_sign='less',
+                                                         duration_in_frames=recording.get_num_frames())
+        print("Removed ", (len(sorting.get_unit_ids()) - len(sorting_min.get_unit_ids())),
+              'units with less than',
+              firing_rate_threshold, 'firing rate')
+    else:
+        sorting_min = sorting
+    if isi_viol_threshold > 0:
+        sorting_viol = st.curation.threshold_isi_violations(sorting_min,
+                                                            threshold=isi_viol_threshold,
+                                                            threshold_sign='greater',
+                                                            duration_in_frames=recording.get_num_frames())
+        print("Removed ", (len(sorting_min.get_unit_ids()) - len(sorting_viol.get_unit_ids())),
+              'units with ISI violation greater than', isi_viol_threshold)
+    else:
+        sorting_viol = sorting_min
+    t_start_save = time.time()
+    sorter_tmp_folder = tmp_folder / sorter
+    sorter_tmp_folder.mkdir(parents=True, exist_ok=True)
+    sorting_viol.set_tmp_folder(sorter_tmp_folder)
+    st.postprocessing.export_to_phy(recording, sorting_viol, output_folder=phy_folder,
+                                    ms_before=ms_before_wf, ms_after=ms_after_wf, verbose=True,
+                                    grouping_property=sort_by, recompute_info=recompute_info,
+                                    save_as_property_or_feature=True)
+    print('Save to phy time:', time.time() - t_start_save)
+    return len(sorting_viol.get_unit_ids())
+
+
+def _serialize_recording(recording):
+    properties = {
+        ch: {name: recording.get_channel_property(ch, name)
+             for name in recording.get_channel_property_names(channel_id=ch)}
+        for ch in recording.get_channel_ids()}
+    return recording.dump_to_dict(), properties
+
+
+def _load_recording(serialized):
+    import spikeextractors as se
+    recording_dict, properties = serialized
+    recording = se.load_extractor_from_dict(recording_dict)
+    for ch, channel_properties in properties.items():
+        for name, value in channel_properties.items():
+            recording.set_channel_property(ch, name, value)
+    return recording
+
+
+def _init_worker(n_threads):
+    # must run before numpy and the sorters are imported in the worker
+    if n_threads is not None:
+        for var in THREAD_ENV_VARS:
+            os.environ[var] = str(n_threads)
+
+
+def _sort_worker(serialized, n_threads, slot, kwargs):
+    if n_threads is not None and hasattr(os, 'sched_setaffinity'):
+        # pin the sorter to its own cpus
+        cpus = sorted(os.sched_getaffinity(0))
+        start = slot * n_threads % len(cpus)
+        os.sched_setaffinity(0, cpus[start:start + n_threads] or cpus)
+    return sort_recording(_load_recording(serialized), **kwargs)
+
+
+def threads_per_sorter_options(threads_per_sorter):
+    '''
+    "--threads-per-sorter" options of the process commands for
+    threads_per_sorter, an int or a dict by sorter name given as repeated
+    "<sorter>=<threads>" options.
+    '''
+    if threads_per_sorter is None:
+        return ''
+    if isinstance(threads_per_sorter, dict):
+        return ''.join(' --threads-per-sorter {}={}'.format(sorter, int(n_threads))
+                       for sorter, n_threads in threads_per_sorter.items())
+    return ' --threads-per-sorter ' + str(int(threads_per_sorter))
+
+
+def run_sorters(recording, sorters, exdir_path, tmp_folder, n_jobs=None, threads_per_sorter=None, **kwargs):
+    '''
+    Run several spike sorters on the same preprocessed recording, each in
+    its own process. The result of each sorter is saved in
+    spikesorting/<sorter>.
+
+    Parameters
+    ----------
+    sorters : str or list
+        Names of the spike sorters.
+    n_jobs : int
+        Number of sorters running at the same time, all by default.
+    threads_per_sorter : int or dict
+        Number of threads (and CPUs) used by each sorter, by default the
+        CPUs are shared equally between the sorters running at the same
+        time. A dict gives the number per sorter name.
+    kwargs : dict
+        Passed to sort_recording.
+
+    Returns
+    -------
+    results : dict
+        Number of units found by each sorter.
+    '''
+    if isinstance(sorters, str):
+        sorters = [sorters]
+    sorters = list(sorters)
+    if len(sorters) == 1:
+        return {sorters[0]: sort_recording(recording, sorters[0], exdir_path, tmp_folder, **kwargs)}
+
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+    n_jobs = min(n_jobs or len(sorters), len(sorters))
+    if threads_per_sorter is None:
+        threads_per_sorter = max(multiprocessing.cpu_count() // n_jobs, 1)
+    # avoid concurrent creation of the shared groups
+    exdir_group = exdir.File(exdir_path, plugins=exdir.plugins.quantities)
+    exdir_group.require_group('processing').require_group('electrophysiology').require_group('spikesorting')
+
+    serialized = _serialize_recording(recording)
+    # spawn new processes so the thread limits apply before numpy is imported
+    context = multiprocessing.get_context('spawn')
+    results, errors = {}, {}
+    pending = list(sorters)
+    running = {}
+    while pending or running:
+        while pending and len(running) < n_jobs:
+            sorter = pending.pop(0)
+            if isinstance(threads_per_sorter, dict):
+                n_threads = threads_per_sorter.get(sorter)
+            else:
+                n_threads = threads_per_sorter
+            slot = min(set(range(n_jobs)) - set(s for _, _, s in running.values()))
+            executor = ProcessPoolExecutor(max_workers=1, mp_context=context,
+                                           initializer=_init_worker, initargs=(n_threads,))
+            sorter_kwargs = dict(kwargs, sorter=sorter, exdir_path=exdir_path, tmp_folder=tmp_folder)
+            print('Running', sorter, 'with', n_threads or 'all', 'threads')
+            future = executor.submit(_sort_worker, serialized, n_threads, slot, sorter_kwargs)
+            running[future] = (sorter, executor, slot)
+        done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+        for future in done:
+            sorter, executor, slot = running.pop(future)
+            executor.shutdown()
+            try:
+                results[sorter] = future.result()
+            except Exception as e:
+                print('Spike sorting with', sorter, 'failed:', e)
+                errors[sorter] = e
+    if len(errors) > 0:
+        raise Exception("Spike sorting failed: " + ', '.join(errors))
+    return results
@@ -0,0 +1,195 @@
+from expipe_plugin_cinpla.imports import *
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import errno
+import threading
+
+STRATEGIES = ['reflink', 'hardlink', 'rename', 'copy']
+# ioctl request cloning a file on Linux filesystems with reflinks (btrfs, xfs)
+FICLONE = 0x40049409
+CHUNK_SIZE = 64 * 2 ** 20
+# errors telling that a strategy is not supported between two folders
+UNSUPPORTED = {errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.EPERM, errno.ENOSYS}
+
+
+def _reflink(source, target):
+    import fcntl
+    with open(str(source), 'rb') as src, open(str(target), 'wb') as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            dst.close()
+            os.remove(str(target))
+            raise
+
+
+def _copy_range(source, target, offset, size):
+    src = os.open(str(source), os.O_RDONLY)
+    dst = os.open(str(target), os.O_WRONLY)
+    in_kernel = hasattr(os, 'copy_file_range')
+    try:
+        end = offset + size
+        while offset < end:
+            n_bytes = None
+            if in_kernel:
+                try:
+                    n_bytes = os.copy_file_range(src, dst, min(CHUNK_SIZE, end - offset), offset, offset)
+                except OSError:
+                    # e.g. between filesystems on older kernels
+                    in_kernel = False
+            if n_bytes is None:
+                data = os.pread(src, min(CHUNK_SIZE, end - offset), offset)
+                n_bytes = os.pwrite(dst, data, offset)
+            if n_bytes == 0:
+                raise IOError('Unexpected end of {}'.format(source))
+            offset += n_bytes
+    finally:
+        os.close(src)
+        os.close(dst)
+
+
+class RawDataPlacer:
+    '''
+    Places raw data files in the exdir acquisition folder without copying
+    when possible. Each file is reflinked, hardlinked or renamed, in that
+    order among the given strategies, and copied in parallel chunks if
+    none of them work. A strategy
+    that is not supported between the two folders is not tried again.
+
+    Parameters
+    ----------
+    strategies : list
+        Strategies to try, "rename" moves the raw data and should only be
+        used when the raw data is deleted after registration. A hardlinked
+        file shares its data with the raw data, so later changes to the
+        raw data change the registered data.
+    n_threads : int
+        Number of threads copying chunks.
+    chunk_size : int
+        Size in bytes of the chunks copied in parallel.
+    '''
+    def __init__(self, strategies=('reflink', 'copy'), n_threads=4, chunk_size=CHUNK_SIZE * 4):
+        unknown = set(strategies) - set(STRATEGIES)
+        if unknown:
+            raise ValueError('Unknown strategies {}, use {}'.format(sorted(unknown), STRATEGIES))
+        self.strategies = [s for s in STRATEGIES if s in strategies and s != 'copy'] + ['copy']
+        self.n_threads = n_threads
+        self.chunk_size = chunk_size
+        self.unsupported = set()
+        self.placed = collections.defaultdict(lambda: [0, 0])
+        self._lock = threading.Lock()
+
+    def _copy(self, source, target):
+        size = os.path.getsize(str(source))
+        if not hasattr(os, 'pwrite') or size <= self.chunk_size:
+            shutil.copyfile(str(source), str(target))
+        else:
+            with open(str(target), 'wb') as f:
+                f.truncate(size)
+            with ThreadPoolExecutor(max_workers=self.n_threads) as executor:
+                futures = [executor.submit(_copy_range, source, target, offset, min(self.chunk_size, size - offset))
+                           for offset in range(0, size, self.chunk_size)]
+                for future in futures:
+                    future.result()
+        shutil.copystat(str(source), str(target))
+
+    def place_file(self, source, target):
+        '''
+        Place source at target, returns the strategy used.
+        '''
+        size = os.path.getsize(str(source))
+        for strategy in self.strategies:
+            if strategy in self.unsupported:
+                continue
+            try:
+                if strategy == 'reflink':
+                    _reflink(source, target)
+                elif strategy == 'hardlink':
+                    os.link(str(source), str(target))
+                elif strategy == 'rename':
+                    os.rename(str(source), str(target))
+                else:
+                    self._copy(source, target)
+            except (OSError, ImportError) as e:
+                if strategy == 'copy':
+                    raise
+                if isinstance(e, ImportError) or e.errno in UNSUPPORTED:
+                    self.unsupported.add(strategy)
+                continue
+            with self._lock:
+                self.placed[strategy][0] += 1
+                self.placed[strategy][1] += size
+            return strategy
+
+    def place_tree(self, source, target):
+        '''
+        Place all files in source under target, target must not exist.
+        '''
+        source, target = Path(source), Path(target)
+        target.mkdir(parents=True)
+        for dirpath, dirnames, filenames in os.walk(str(source)):
+            folder = target / Path(dirpath).relative_to(source)
+            for dirname in dirnames:
+                (folder / dirname).mkdir()
+            for filename in filenames:
+                self.place_file(Path(dirpath) / filename, folder / filename)
+        return target
+
+    def report(self):
+        if not self.placed:
+            return 'No raw data placed'
+        verbs = {'reflink': 'reflinked', 'hardlink': 'hardlinked', 'rename': 'moved', 'copy': 'copied'}
+        return 'Raw data ' + ', '.join(
+            '{} ({} files, {:.2f} GB)'.format(verbs[s], n, size / 1e9)
+            for s, (n, size) in self.placed.items())
+
+
+def register_acquisition(exdir_path, raw_path, session, placer, start_time, duration, acquisition_system):
+    '''
+    Write the acquisition metadata as the expipe_io_neuro converters do and
+    place the raw data in acquisition/<session> with placer, instead of the
+    converters copying it.
+
+    Parameters
+    ----------
+    raw_path : path
+        Raw data file or folder.
+    session : str
+        Name of the raw data folder in the acquisition group.
+    start_time : datetime
+        Start of the recording.
+    duration : quantity
+        Duration of the recording.
+    '''
+    raw_path = Path(raw_path)
+    exdir_file = exdir.File(str(exdir_path), plugins=exdir.plugins.quantities)
+    exdir_file.attrs['session_start_time'] = start_time.strftime('%Y-%m-%dT%H:%M:%S')
+    exdir_file.attrs['session_duration'] = duration
+    acquisition = exdir_file.require_group('acquisition')
+    exdir_file.require_group('processing')
+    exdir_file.require_group('general').require_group('subject')
+    acquisition.attrs['session'] = session
+    acquisition.attrs['acquisition_system'] = acquisition_system
+    target = Path(acquisition.directory) / session
+    print('Placing', raw_path, 'in', target)
+    if raw_path.is_dir():
+        placer.place_tree(raw_path, target)
+    else:
+        target.mkdir(parents=True)
+        placer.place_file(raw_path, target / raw_path.name)
+    return acquisition
+
+
+def get_placer(raw_transfer='auto', delete_raw_data=None):
+    '''
+    RawDataPlacer for the "raw_transfer" option, "auto" tries reflinks,
+    renaming when the raw data is deleted anyway, and copying. Hardlinks
+    are only used with "hardlink".
+    '''
+    if raw_transfer == 'auto':
+        strategies = ['reflink', 'copy']
+        if delete_raw_data is True:
+            strategies.append('rename')
+    else:
+        strategies = [raw_transfer]
+    return RawDataPlacer(strategies)
@@ -1,5 +1,6 @@
 from expipe_plugin_cinpla.imports import *
 from .utils import register_templates, query_yes_no
+from .action_update import ActionUpdate
 
 
 def register_surgery(
@@ -36,21 +37,22 @@ def register_surgery(
     entity.tags.extend(['surgery-' + procedure])
     entity.users.append(user)
 
-    register_templates(action, templates)
     if date == 'now':
         date = datetime.datetime.now()
     if isinstance(date, str):
         date = datetime.datetime.strftime(date, DTIME_FORMAT)
-    action.datetime = date
-    print('Registering location', location)
-    action.location = location
-    action.type = 'Surgery'
-    action.tags = [procedure] + list(tag)
-    action.entities = [entity_id]
-    print('Registering user', user)
-    action.users.append(user)
-    if message:
-        action.create_message(text=message, user=user, datetime=datetime.datetime.now())
+    with ActionUpdate(action) as update:
+        register_templates(update, templates)
+        update.datetime = date
+        print('Registering location', location)
+        update.location = location
+        update.type = 'Surgery'
+        update.tags = [procedure] + list(tag)
+        update.entities = [entity_id]
+        print('Registering user', user)
+        update.extend('users', [user])
+        if message:
+            update.create_message(text=message, user=user, datetime=datetime.datetime.now())
     for key, probe, x, y, z, unit in position:
         action.modules[key] = {}
         probe_key = 'probe_{}'.format(probe)
@@ -87,24 +89,25 @@ def register_perfusion(project, entity_id, date, user, weight, overwrite,
         else:
             print(str(e) + '. Use "overwrite"')
             return
-    register_templates(action, templates)
     if date == 'now':
         date = datetime.datetime.now()
     if isinstance(date, str):
         date = datetime.datetime.strftime(date, DTIME_FORMAT)
-    if message:
-        action.messages.create_message(
-            text=message, user=user, datetime= datetime.datetime.now())
-    action.datetime = date
-    print('Registering location', location)
-    action.location = location
-    action.type = 'Surgery'
-    action.tags = ['perfusion']
-    action.entities = [entity_id]
-    print('Registering user ' + user)
-    action.users = [user]
-    if weight != (None, None):
-        action.create_module(
-            'perfusion', contents={'weight': pq.Quantity(weight[0], weight[1])})
+    with ActionUpdate(action) as update:
+        register_templates(update, templates)
+        if message:
+            update.create_message(
+                text=message, user=user, datetime=datetime.datetime.now())
+        update.datetime = date
+        print('Registering location', location)
+        update.location = location
+        update.type = 'Surgery'
+        update.tags = ['perfusion']
+        update.entities = [entity_id]
+        print('Registering user ' + user)
+        update.users = [user]
+        if weight != (None, None):
+            update.create_module(
+                'perfusion', contents={'weight': pq.Quantity(weight[0], weight[1])})
     entity = project.entities[entity_id]
     entity.tags.extend(['perfused'])
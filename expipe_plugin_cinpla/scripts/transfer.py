@@ -0,0 +1,511 @@
+from expipe_plugin_cinpla.imports import *
+from pathlib import Path
+import fnmatch
+import hashlib
+import posixpath
+import re
+import shlex
+import threading
+import time
+
+CHUNK_SIZE = 2**20
+PART_SUFFIX = '.part'
+
+
+def compile_spec(spec):
+    '''
+    Match function for an include spec, a dict with lists of glob patterns
+    under 'include' and 'exclude'. A path relative to the transferred
+    folder matches if it matches an include pattern and no exclude
+    pattern, '*' also matches '/' as in find -path.
+    '''
+    def regex(patterns):
+        if not patterns:
+            return None
+        return re.compile('|'.join(fnmatch.translate(pattern) for pattern in patterns))
+    include, exclude = regex(spec.get('include')), regex(spec.get('exclude'))
+
+    def match(name):
+        return (include is not None and include.match(name) is not None and
+                (exclude is None or exclude.match(name) is None))
+    return match
+
+
+def find_command(folder, spec=None):
+    '''
+    Shell command finding the files in folder matching spec, paths are
+    relative to folder.
+    '''
+    cmd = 'cd {} && find . -type f'.format(shlex.quote(str(folder)))
+    if spec is not None:
+        def paths(patterns):
+            return ' -o '.join('-path ' + shlex.quote('./' + pattern) for pattern in patterns)
+        cmd += r' \( {} \)'.format(paths(spec.get('include')) or '-false')
+        if spec.get('exclude'):
+            cmd += r' ! \( {} \)'.format(paths(spec['exclude']))
+    return cmd
+
+
+def _checksum(f, size=None):
+    md5 = hashlib.md5()
+    remaining = size
+    while remaining is None or remaining > 0:
+        chunk = f.read(CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining))
+        if not chunk:
+            break
+        md5.update(chunk)
+        if remaining is not None:
+            remaining -= len(chunk)
+    return md5.hexdigest()
+
+
+class LocalBackend:
+    '''
+    Files in a local directory, used for the local side of a transfer and
+    as a stand-in for a server in tests.
+    '''
+    def files(self, folder, include=None):
+        folder = Path(folder)
+        if not folder.is_dir():
+            return {}
+        match = compile_spec(include) if include is not None else None
+        files = {}
+        for path in folder.rglob('*'):
+            name = path.relative_to(folder).as_posix()
+            if path.is_file() and (match is None or match(name)):
+                files[name] = path.stat().st_size
+        return files
+
+    def size(self, path):
+        try:
+            return Path(path).stat().st_size
+        except OSError:
+            return None
+
+    def stat(self, path):
+        try:
+            stat_result = Path(path).stat()
+        except OSError:
+            return None
+        return [stat_result.st_size, stat_result.st_mtime_ns]
+
+    def checksum(self, path, size=None):
+        with open(str(path), 'rb') as f:
+            return _checksum(f, size)
+
+    def open(self, path, mode='rb'):
+        return open(str(path), mode)
+
+    def makedirs(self, folder):
+        Path(folder).mkdir(parents=True, exist_ok=True)
+
+    def rename(self, source, dest):
+        os.replace(str(source), str(dest))
+
+    def remove(self, path):
+        os.remove(str(path))
+
+    def close(self):
+        pass
+
+
+class SFTPBackend:
+    '''
+    Files on a server reached through a paramiko SSHClient. Each thread
+    uses its own SFTP channel on the same connection, checksums are
+    computed on the server with md5sum.
+    '''
+    def __init__(self, ssh):
+        self.ssh = ssh
+        self._local = threading.local()
+        self._channels = []
+        self._lock = threading.Lock()
+
+    @property
+    def sftp(self):
+        sftp = getattr(self._local, 'sftp', None)
+        if sftp is None:
+            sftp = self._local.sftp = self.ssh.open_sftp()
+            with self._lock:
+                self._channels.append(sftp)
+        return sftp
+
+    def files(self, folder, include=None):
+        '''
+        Sizes of the files in folder by relative path, empty if folder does
+        not exist. The files are listed in one round trip with the -printf
+        option of GNU find, which the server must provide.
+        '''
+        cmd = r"if [ -d {} ]; then {} -printf '%P\t%s\n'; fi".format(
+            shlex.quote(str(folder)), find_command(folder, include))
+        stdin, stdout, stderr = self.ssh.exec_command(cmd)
+        output = stdout.read().decode()
+        if stdout.channel.recv_exit_status() != 0:
+            raise IOError('Could not list the files in {} on the server, GNU find is required: {}'.format(
+                folder, stderr.read().decode().strip()))
+        files = {}
+        for line in output.splitlines():
+            name, size = line.rsplit('\t', 1)
+            files[name] = int(size)
+        return files
+
+    def size(self, path):
+        try:
+            return self.sftp.stat(str(path)).st_size
+        except IOError:
+            return None
+
+    def stat(self, path):
+        try:
+            stat_result = self.sftp.stat(str(path))
+        except IOError:
+            return None
+        return [stat_result.st_size, stat_result.st_mtime]
+
+    def checksum(self, path, size=None):
+        path = shlex.quote(str(path))
+        if size is None:
+            cmd = 'md5sum ' + path
+        else:
+            cmd = 'head -c {} {} | md5sum'.format(int(size), path)
+        stdin, stdout, stderr = self.ssh.exec_command(cmd)
+        output = stdout.read().decode()
+        if stdout.channel.recv_exit_status() != 0:
+            raise IOError(stderr.read().decode())
+        return output.split()[0]
+
+    def open(self, path, mode='rb'):
+        f = self.sftp.open(str(path), mode)
+        if 'r' in mode:
+            f.prefetch()
+        else:
+            f.set_pipelined(True)
+        return f
+
+    def makedirs(self, folder):
+        parts = []
+        folder = str(folder)
+        while folder not in ['', '/'] and self.size(folder) is None:
+            folder, name = posixpath.split(folder)
+            parts.append(name)
+        for name in reversed(parts):
+            folder = posixpath.join(folder, name)
+            self.sftp.mkdir(folder)
+
+    def rename(self, source, dest):
+        self.sftp.posix_rename(str(source), str(dest))
+
+    def remove(self, path):
+        self.sftp.remove(str(path))
+
+    def close(self):
+        with self._lock:
+            for sftp in self._channels:
+                sftp.close()
+            self._channels = []
+        self._local = threading.local()
+
+
+def _copy(source, dest, source_path, dest_path, offset):
+    with source.open(source_path, 'rb') as src, dest.open(dest_path, 'ab' if offset else 'wb') as dst:
+        if offset:
+            src.seek(offset)
+        while True:
+            chunk = src.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            dst.write(chunk)
+
+
+def _verified(source, dest, source_path, dest_path):
+    return {'source': source.stat(source_path), 'dest': dest.stat(dest_path)}
+
+
+def _sync_file(source, dest, source_path, dest_path, size, checksum, previous=None):
+    '''
+    Returns the number of bytes sent, or None if the file was already
+    present, and the manifest entry of the file if it was verified.
+    '''
+    if previous is not None and previous == _verified(source, dest, source_path, dest_path):
+        # neither copy changed since they were compared
+        return None, previous
+    if dest.size(dest_path) == size:
+        if not checksum:
+            return None, None
+        if dest.checksum(dest_path) == source.checksum(source_path):
+            return None, _verified(source, dest, source_path, dest_path)
+    part_path = dest_path + PART_SUFFIX
+    offset = dest.size(part_path) or 0
+    if offset > size or (offset > 0 and dest.checksum(part_path) != source.checksum(source_path, offset)):
+        offset = 0
+    _copy(source, dest, source_path, part_path, offset)
+    if checksum and dest.checksum(part_path) != source.checksum(source_path):
+        dest.remove(part_path)
+        raise IOError('Checksum mismatch after transferring ' + source_path)
+    dest.rename(part_path, dest_path)
+    return size - offset, _verified(source, dest, source_path, dest_path) if checksum else None
+
+
+def sync(source, dest, source_folder, dest_folder, n_channels=4, checksum=True, include=None,
+         manifest=None):
+    '''
+    Copy the files in source_folder to dest_folder, several files at a
+    time. Files already present in dest_folder with the same size (and
+    checksum) are skipped. Files are written to <name>.part and renamed
+    when complete, an interrupted transfer continues from the partial file.
+
+    Parameters
+    ----------
+    source, dest : LocalBackend or SFTPBackend
+        Where the files are read from and written to.
+    n_channels : int
+        Number of files transferred at the same time.
+    checksum : bool
+        Compare checksums in addition to sizes.
+    include : dict
+        Only transfer the files matching this spec, see compile_spec.
+    manifest : dict
+        Size and modification time of both copies of each file when their
+        checksums last matched, updated in place. A file is skipped without
+        comparing checksums if neither copy changed since.
+
+    Returns
+    -------
+    transferred : list
+        Relative paths of the files transferred.
+    '''
+    from concurrent.futures import ThreadPoolExecutor
+    source_folder, dest_folder = str(source_folder), str(dest_folder)
+    manifest = {} if manifest is None else manifest
+    files = source.files(source_folder, include)
+    for folder in sorted(set(posixpath.dirname(name) for name in files)):
+        dest.makedirs(posixpath.join(dest_folder, folder) if folder else dest_folder)
+
+    t_start = time.time()
+    # start with the largest files to balance the channels
+    names = sorted(files, key=files.get, reverse=True)
+    with ThreadPoolExecutor(max_workers=max(n_channels, 1)) as executor:
+        results = list(executor.map(
+            lambda name: _sync_file(source, dest, posixpath.join(source_folder, name),
+                                    posixpath.join(dest_folder, name), files[name], checksum,
+                                    manifest.get(name)),
+            names))
+    sent = [n for n, _ in results]
+    for name, (_, entry) in zip(names, results):
+        if entry is None:
+            manifest.pop(name, None)
+        else:
+            manifest[name] = entry
+    transferred = [name for name, n in zip(names, sent) if n is not None]
+    n_bytes = sum(n for n in sent if n is not None)
+    elapsed = time.time() - t_start
+    print('Transferred {} files ({:.1f} MB) in {:.1f} s ({:.1f} MB/s), {} files already present'.format(
+        len(transferred), n_bytes / 1e6, elapsed, n_bytes / 1e6 / max(elapsed, 1e-6),
+        len(names) - len(transferred)))
+    return transferred
+
+
+CODECS = {
+    'zstd': ('zstandard', 'zstd -d -c', 'zstd -c -{}'),
+    'lz4': ('lz4.frame', 'lz4 -d -c', 'lz4 -c -{}'),
+    'gzip': ('gzip', 'gzip -d -c', 'gzip -c -{}'),
+}
+
+
+class _CountingWriter:
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.n_bytes = 0
+
+    def write(self, data):
+        self.fileobj.write(data)
+        self.n_bytes += len(data)
+        return len(data)
+
+    def flush(self):
+        self.fileobj.flush()
+
+    def close(self):
+        # the underlying stream is closed by the caller
+        self.flush()
+
+
+class _CountingReader:
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.n_bytes = 0
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.n_bytes += len(data)
+        return data
+
+
+class _Drain(threading.Thread):
+    '''
+    Read a stream in a thread, so the server never blocks writing more
+    than the channel window to a stream that is read at the end.
+    '''
+    def __init__(self, stream):
+        super().__init__(daemon=True)
+        self.stream = stream
+        self.data = b''
+        self.start()
+
+    def run(self):
+        self.data = self.stream.read()
+
+    def text(self):
+        self.join()
+        return self.data.decode(errors='replace')
+
+
+def _available_codec(codec):
+    import importlib
+    try:
+        importlib.import_module(CODECS[codec][0])
+        return codec
+    except ImportError:
+        print('Could not import', CODECS[codec][0], 'for', codec, 'compression, using gzip')
+        return 'gzip'
+
+
+def _compressor(fileobj, codec, level):
+    if codec == 'zstd':
+        import zstandard
+        return zstandard.ZstdCompressor(level=level).stream_writer(fileobj)
+    elif codec == 'lz4':
+        import lz4.frame
+        return lz4.frame.LZ4FrameFile(fileobj, mode='wb', compression_level=level)
+    elif codec == 'gzip':
+        import gzip
+        return gzip.GzipFile(fileobj=fileobj, mode='wb', compresslevel=level)
+    raise ValueError("'codec' can be one of " + ', '.join(CODECS))
+
+
+def _decompressor(fileobj, codec):
+    if codec == 'zstd':
+        import zstandard
+        return zstandard.ZstdDecompressor().stream_reader(fileobj)
+    elif codec == 'lz4':
+        import lz4.frame
+        return lz4.frame.LZ4FrameFile(fileobj, mode='rb')
+    elif codec == 'gzip':
+        import gzip
+        return gzip.GzipFile(fileobj=fileobj, mode='rb')
+    raise ValueError("'codec' can be one of " + ', '.join(CODECS))
+
+
+def _server_codec(ssh, codec):
+    codec = _available_codec(codec)
+    if codec != 'gzip':
+        stdin, stdout, stderr = ssh.exec_command('command -v ' + codec)
+        if stdout.channel.recv_exit_status() != 0:
+            print('No', codec, 'on the server, using gzip')
+            codec = 'gzip'
+    return codec
+
+
+def extract_tar(fileobj, folder, include=None):
+    '''
+    Extract the files matching the include spec from a tar stream in one
+    pass. Raises IOError for members outside folder, e.g. absolute paths
+    or paths starting with "..".
+
+    Returns
+    -------
+    extracted : list
+        Relative paths of the extracted files.
+    '''
+    match = compile_spec(include) if include is not None else None
+    # the "data" filter also rejects links out of folder and special files
+    extract_kwargs = {'filter': 'data'} if hasattr(tarfile, 'data_filter') else {}
+    extracted = []
+    with tarfile.open(fileobj=fileobj, mode='r|') as tar:
+        for member in tar:
+            name = posixpath.normpath(member.name)
+            if posixpath.isabs(name) or name == '..' or name.startswith('../'):
+                raise IOError('Refusing to extract {} outside {}'.format(member.name, folder))
+            if member.isfile() and (match is None or match(name)):
+                tar.extract(member, str(folder), **extract_kwargs)
+                extracted.append(name)
+    return extracted
+
+
+def compress_folder(folder, fileobj, codec='zstd', level=3):
+    '''
+    Write the folder as a compressed tar stream to fileobj, nothing is
+    written to disk.
+
+    Returns
+    -------
+    raw_bytes, compressed_bytes : int
+    '''
+    compressed = _CountingWriter(fileobj)
+    compressor = _compressor(compressed, codec, level)
+    raw = _CountingWriter(compressor)
+    with tarfile.open(fileobj=raw, mode='w|') as tar:
+        for path in sorted(Path(folder).iterdir()):
+            tar.add(str(path), arcname=path.name)
+    compressor.close()
+    compressed.flush()
+    return raw.n_bytes, compressed.n_bytes
+
+
+def extract_command(folder, codec='zstd'):
+    '''
+    Shell command extracting a compressed tar stream from stdin to folder.
+    '''
+    folder = shlex.quote(str(folder))
+    return 'mkdir -p {0} && {1} | tar -x -C {0}'.format(folder, CODECS[codec][1])
+
+
+def send_compressed(ssh, folder, remote_folder, codec='zstd', level=3):
+    '''
+    Stream the folder to the server through a compressor, the server
+    decompresses and extracts it while it is received.
+
+    Parameters
+    ----------
+    ssh : paramiko.SSHClient
+    codec : str
+        'zstd', 'lz4' or 'gzip', falls back to gzip when the codec is not
+        available locally or on the server.
+    level : int
+        Compression level.
+    '''
+    codec = _server_codec(ssh, codec)
+    t_start = time.time()
+    stdin, stdout, stderr = ssh.exec_command(extract_command(remote_folder, codec))
+    errors = _Drain(stderr)
+    raw_bytes, compressed_bytes = compress_folder(folder, stdin, codec=codec, level=level)
+    stdin.channel.shutdown_write()
+    if stdout.channel.recv_exit_status() != 0:
+        raise IOError('Extraction on the server failed: ' + errors.text())
+    elapsed = time.time() - t_start
+    print('Sent {:.1f} MB as {:.1f} MB with {} (ratio {:.2f}) in {:.1f} s ({:.1f} MB/s effective)'.format(
+        raw_bytes / 1e6, compressed_bytes / 1e6, codec, raw_bytes / max(compressed_bytes, 1), elapsed,
+        raw_bytes / 1e6 / max(elapsed, 1e-6)))
+    return raw_bytes, compressed_bytes
+
+
+def receive_compressed(ssh, remote_folder, folder, include=None, codec='zstd', level=3):
+    '''
+    Receive the files in remote_folder matching the include spec as a
+    compressed tar stream, only the selected files are read and sent by
+    the server.
+    '''
+    codec = _server_codec(ssh, codec)
+    cmd = '{} -print0 | tar -c --null -T - | {}'.format(
+        find_command(remote_folder, include), CODECS[codec][2].format(level))
+    t_start = time.time()
+    stdin, stdout, stderr = ssh.exec_command(cmd)
+    errors = _Drain(stderr)
+    compressed = _CountingReader(stdout)
+    extracted = extract_tar(_decompressor(compressed, codec), folder, include)
+    if stdout.channel.recv_exit_status() != 0:
+        raise IOError('Packing on the server failed: ' + errors.text())
+    elapsed = time.time() - t_start
+    print('Received {} files as {:.1f} MB with {} in {:.1f} s'.format(
+        len(extracted), compressed.n_bytes / 1e6, codec, elapsed))
+    return extracted
@@ -1,6 +1,7 @@
 from expipe_plugin_cinpla.imports import *
 import re
 import sys
+import bisect
 from pathlib import Path
 
 nwb_main_groups = ['acquisition', 'analysis', 'processing', 'epochs',
@@ -101,24 +102,147 @@ def get_depth_from_surgery(project, entity_id):
     return position
 
 
-def get_depth_from_adjustment(project, action, entity_id):
-    DTIME_FORMAT = expipe.core.datetime_format
+class AdjustmentTimeline:
+    '''
+    Depths of the adjustments of an entity sorted by date.
+    '''
+    def __init__(self, adjusts):
+        self.dates = sorted(adjusts)
+        self.depths = [adjusts[date] for date in self.dates]
+        # adjustment used when all are after the recording, as the first module
+        self.fallback = next(iter(adjusts)) if adjusts else None
+
+    @classmethod
+    def from_action(cls, adjustments):
+        DTIME_FORMAT = expipe.core.datetime_format
+        adjusts = {}
+        for adjust in adjustments.modules.values():
+            values = adjust.contents
+            adjusts[datetime.datetime.strptime(values['date'], DTIME_FORMAT)] = values['depth']
+        return cls(adjusts)
+
+    def lookup(self, regdate):
+        '''
+        Depth and date of the last adjustment before regdate.
+        '''
+        index = bisect.bisect_left(self.dates, regdate) - 1
+        if index < 0:
+            adjustdate = self.fallback
+            depth = self.depths[self.dates.index(adjustdate)]
+        else:
+            adjustdate = self.dates[index]
+            depth = self.depths[index]
+        return copy.deepcopy(depth), adjustdate
+
+
+def project_path(project):
+    '''
+    Folder of a project stored on the filesystem, raises ValueError for
+    other backends.
+    '''
+    path = getattr(getattr(project, '_backend', None), 'path', None)
+    if path is None:
+        raise ValueError(
+            'Project "{}" is not stored on the filesystem, the action index, the '
+            'adjustment cache and the job queue need a local project'.format(getattr(project, 'name', project)))
+    return Path(path)
+
+
+_adjustment_timelines = {}
+
+
+def _adjustment_key(project, entity_id):
+    return str(project_path(project)), entity_id
+
+
+def invalidate_adjustment_timeline(project, entity_id):
+    _adjustment_timelines.pop(_adjustment_key(project, entity_id), None)
+
+
+def _modules_signature(modules_path):
+    # module files with their modification time and size, modules are
+    # <name>.yaml or <name>/attributes.yaml
+    signature = []
+    for dirpath, dirnames, filenames in os.walk(str(modules_path)):
+        for filename in filenames:
+            stat = os.stat(os.path.join(dirpath, filename))
+            signature.append((os.path.relpath(os.path.join(dirpath, filename), str(modules_path)),
+                              stat.st_mtime_ns, stat.st_size))
+    return tuple(sorted(signature))
+
+
+def get_adjustment_timeline(project, entity_id):
+    '''
+    Adjustment timeline of the entity, None if it has no adjustments. The
+    timeline is cached until a module file of the adjustments changes.
+    '''
+    key = _adjustment_key(project, entity_id)
+    modules_path = project_path(project) / 'actions' / (entity_id + '-adjustment') / 'modules'
+    signature = _modules_signature(modules_path)
+    cached = _adjustment_timelines.get(key)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
     try:
         adjustments = project.actions[entity_id + '-adjustment']
+        timeline = AdjustmentTimeline.from_action(adjustments)
     except KeyError as e:
-        return None, None
-    adjusts = {}
-    for adjust in adjustments.modules.values():
-        values = adjust.contents
-        adjusts[datetime.datetime.strptime(values['date'], DTIME_FORMAT)] = adjust
+        timeline = None
+    if timeline is not None and not timeline.dates:
+        timeline = None
+    _adjustment_timelines[key] = (signature, timeline)
+    return timeline
 
-    regdate = action.datetime
-    adjustdates = adjusts.keys()
-    adjustdate = min(adjustdates, key=lambda x: deltadate(x, regdate))
-    return adjusts[adjustdate]['depth'].contents, adjustdate
 
+def get_depths_from_adjustment(project, action_ids, index=None, planned=None):
+    '''
+    Depth and adjustment date of many actions, read from the action index
+    and the cached adjustment timelines.
+
+    Parameters
+    ----------
+    planned : dict
+        (entity_id, datetime) by action id of actions that are not
+        registered yet, or whose attributes are known, these are not read
+        from the index.
+
+    Returns
+    -------
+    depths : dict
+        (depth, adjustdate) by action id, (None, None) if the depth is
+        not found.
+    '''
+    planned = planned or {}
+    depths = {}
+    for action_id in action_ids:
+        if action_id in planned:
+            entities, action_datetime = [planned[action_id][0]], planned[action_id][1]
+        else:
+            if index is None:
+                from .action_index import get_index
+                index = get_index(project)
+            attributes = index.get(action_id)
+            entities, action_datetime = attributes['entities'], attributes['datetime']
+        timeline = None
+        if len(entities) == 1 and action_datetime is not None:
+            timeline = get_adjustment_timeline(project, entities[0])
+        if timeline is None:
+            depths[action_id] = (None, None)
+        else:
+            depths[action_id] = timeline.lookup(action_datetime)
+    return depths
+
+
+def register_depth(project, action, depth=None, answer=None, overwrite=False, adjustment=None):
+    '''
+    Register the depth module of the action, from depth or from the
+    adjustments of its entity.
 
-def register_depth(project, action, depth=None, answer=None, overwrite=False):
+    Parameters
+    ----------
+    adjustment : tuple
+        (depth, adjustdate) from get_depths_from_adjustment, looked up
+        when not given.
+    '''
     if len(action.entities) != 1:
         print('Exactly 1 entity is required to register depth.')
         return False
@@ -128,8 +252,10 @@ def register_depth(project, action, depth=None, answer=None, overwrite=False):
         curr_depth = position_to_dict(depth)
         adjustdate = None
     else:
-        curr_depth, adjustdate = get_depth_from_adjustment(
-            project, action, action.entities[0])
+        if adjustment is None:
+            adjustment = get_depths_from_adjustment(
+                project, [action.id], planned={action.id: (action.entities[0], action.datetime)})[action.id]
+        curr_depth, adjustdate = adjustment
         print('Adjust date time: {}\n'.format(adjustdate))
     if curr_depth is None:
         print('Cannot find current depth from adjustments.')
@@ -208,73 +334,24 @@ def register_templates(action, templates, overwrite=False):
             raise e
 
 
-### PARAMIKO UTILS ###
+def processing_include(sorters, spikesort=True, compute_lfp=True, compute_mua=True):
+    '''
+    Include spec (see transfer.compile_spec) for the parts of the
+    processing group returned from remote processing.
+    '''
+    include = ['*exdir.yaml']
+    if spikesort:
+        include += ['electrophysiology/spikesorting/{}/*'.format(sorter) for sorter in sorters]
+    if compute_lfp:
+        include += ['*LFP*']
+    if compute_mua:
+        include += ['*MUA*']
+    if compute_lfp or compute_mua:
+        include += ['*group*attributes*']
+    return {'include': include, 'exclude': ['*tracking*']}
 
-class ShellHandler:
-    def __init__(self, ssh):
-        self.ssh = ssh
-        channel = self.ssh.invoke_shell()
-        self.stdin = channel.makefile('wb')
-        self.stdout = channel.makefile('r')
-
-    def __del__(self):
-        self.ssh.close()
-
-    def execute(self, cmd, print_lines=False):
-        """
-
-        :param cmd: the command to be executed on the remote computer
-        :examples:  execute('ls')
-                    execute('finger')
-                    execute('cd folder_name')
-        """
-        print(cmd)
-        cmd = cmd.strip('\n')
-        self.stdin.write(cmd + '\n')
-        finish_proc = 'Finished processing'
-        finish = 'end of stdout buffer. finished with exit status'
-        echo_cmd = 'echo {}'.format(finish)
-        self.stdin.write(echo_cmd + '\n')
-        shin = self.stdin
-        self.stdin.flush()
-
-        shout = []
-        sherr = []
-        for line in self.stdout:
-            if cmd in str(line) or echo_cmd in str(line):
-                # up for now filled with shell junk from stdin
-                shout = []
-            elif finish in str(line) or finish_proc in str(line):
-                # our finish command ends with the exit status
-                if finish in str(line):
-                    print(finish)
-                    break
-                if finish_proc in str(line):
-                    print(finish_proc)
-                    break
-            else:
-                if finish in str(line):
-                    print(finish)
-                    break
-                if finish_proc in str(line):
-                    print(finish_proc)
-                    break
-                if print_lines:
-                    print(str(line))
-                shout.append(str(line))
-
-        # first and last lines of shout/sherr contain a prompt
-        if shout and echo_cmd in shout[-1]:
-            shout.pop()
-        if shout and cmd in shout[0]:
-            shout.pop(0)
-        if sherr and echo_cmd in sherr[-1]:
-            sherr.pop()
-        if sherr and cmd in sherr[0]:
-            sherr.pop(0)
-
-        return shin, shout, sherr
 
+### PARAMIKO UTILS ###
 
 def ssh_execute(ssh, command, **kw):
     stdin, stdout, stderr = ssh.exec_command(command, **kw)
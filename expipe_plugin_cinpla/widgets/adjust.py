@@ -2,7 +2,7 @@ from expipe_plugin_cinpla.scripts import adjust
 from expipe_plugin_cinpla.imports import *
 from .utils import (
     DateTimePicker, MultiInput, required_values_filled, none_if_empty,
-    SearchSelect, SearchSelectMultiple, split_tags)
+    SearchSelect, SearchSelectMultiple, split_tags, session_cache)
 
 
 def adjustment_view(project):
@@ -49,13 +49,16 @@ def adjustment_view(project):
             user=user.value,
             depth=depth.value,
             yes=True)
+        session_cache(project).refresh_actions()
 
     register.on_click(on_register)
     return main_box
 
 
 def annotate_view(project):
-    action_id = SearchSelectMultiple(options=project.actions, description='*Actions')
+    action_id = SearchSelectMultiple(
+        options=session_cache(project).actions(), facets=session_cache(project).index(),
+        description='*Actions')
     user = ipywidgets.Text(placeholder='*User', value=project.config.get('username'))
     date = DateTimePicker()
     depth = MultiInput(['Key', 'Probe', 'Depth', 'Unit'], 'Add depth')
@@ -64,7 +67,7 @@ def annotate_view(project):
     action_type = ipywidgets.Text(placeholder='Type (e.g. recording)')
     message = ipywidgets.Text(placeholder='Message')
     tag = ipywidgets.Text(placeholder='Tags (; to separate)')
-    templates = SearchSelectMultiple(project.templates, description='Templates')
+    templates = SearchSelectMultiple(session_cache(project).templates(), description='Templates')
     register = ipywidgets.Button(description='Register')
 
     fields = ipywidgets.VBox([
@@ -100,6 +103,7 @@ def annotate_view(project):
                 entity_id=entity_id.value,
                 templates=templates.value,
                 correct_depth_answer=True)
+        session_cache(project).refresh_actions()
 
     register.on_click(on_register)
     return main_box
@@ -1,6 +1,6 @@
 from expipe_plugin_cinpla.imports import *
 from expipe_plugin_cinpla.scripts import axona
-from .utils import SelectFilesButton, MultiInput, SearchSelectMultiple, required_values_filled, none_if_empty, split_tags
+from .utils import SelectFilesButton, MultiInput, SearchSelectMultiple, required_values_filled, none_if_empty, split_tags, session_cache
 
 
 def axona_view(project):
@@ -11,7 +11,7 @@ def axona_view(project):
     entity_id = ipywidgets.Text(placeholder='Entity id')
     message = ipywidgets.Text(placeholder='Message')
     tag = ipywidgets.Text(placeholder='Tags (; to separate)')
-    templates = SearchSelectMultiple(project.templates, description='Templates')
+    templates = SearchSelectMultiple(session_cache(project).templates(), description='Templates')
     depth = MultiInput(['Key', 'Probe', 'Depth', 'Unit'], 'Add depth')
     register_depth = ipywidgets.Checkbox(description='Register depth', value=False)
     register_depth_from_adjustment = ipywidgets.Checkbox(
@@ -90,6 +90,7 @@ def axona_view(project):
                 set_zero_cluster_to_noise=set_zero_cluster_to_noise.value,
                 register_depth=register_depth.value,
                 correct_depth_answer=True)
+        session_cache(project).refresh_actions()
 
     register.on_click(on_register)
     return main_box
@@ -1,14 +1,7 @@
 from expipe_plugin_cinpla.imports import *
 import IPython.display as ipd
-from .psychopy import process_psychopy_view
-from .openephys import register_openephys_view, process_openephys_view
-from .intan import register_intan_view, process_intan_view
-from .tracking import process_tracking_view
-from .entity import entity_view
-from .adjust import adjustment_view, annotate_view
-from .surgery import perfuse_view, surgery_view
-from .axona import axona_view
-from .curation import process_curation_view
+from .utils import session_cache
+import importlib
 import expipe
 
 # TODO: how to make templates
@@ -18,51 +11,87 @@ import expipe
 # TODO: fix old data
 
 
+VIEWS = {
+    'Register': [
+        ('OpenEphys', 'openephys', 'register_openephys_view'),
+        ('Intan', 'intan', 'register_intan_view'),
+        ('Axona', 'axona', 'axona_view'),
+        ('Adjustment', 'adjust', 'adjustment_view'),
+        ('Entity', 'entity', 'entity_view'),
+        ('Surgery', 'surgery', 'surgery_view'),
+        ('Perfusion', 'surgery', 'perfuse_view'),
+        ('Annotate', 'adjust', 'annotate_view'),
+    ],
+    'Process': [
+        ('OpenEphys', 'openephys', 'process_openephys_view'),
+        ('Intan', 'intan', 'process_intan_view'),
+        ('Tracking', 'tracking', 'process_tracking_view'),
+        ('Psychopy', 'psychopy', 'process_psychopy_view'),
+        ('Curation', 'curation', 'process_curation_view'),
+    ],
+}
+
+
+class LazyTab(ipywidgets.Tab):
+    '''
+    Tab that builds the content of a tab the first time it is selected.
+
+    Parameters
+    ----------
+    views : list
+        (title, build) pairs, build takes no arguments and returns a widget.
+    '''
+    def __init__(self, views, *args, **kwargs):
+        super(LazyTab, self).__init__(*args, **kwargs)
+        self.views = views
+        self.children = [ipywidgets.VBox() for _ in views]
+        for i, (title, _) in enumerate(views):
+            self.set_title(i, title)
+        self.observe(self._on_select, names='selected_index')
+        self.reset()
+
+    def _on_select(self, change):
+        if change['new'] is not None:
+            self.build(change['new'])
+
+    def build(self, index):
+        box = self.children[index]
+        if not box.children:
+            box.children = [self.views[index][1]()]
+
+    def reset(self):
+        '''
+        Remove the built tabs and build the selected tab again.
+        '''
+        for box in self.children:
+            box.children = []
+        self.build(self.selected_index or 0)
+
+
+def _view_builder(project, module, name):
+    def build():
+        # the view module and its dependencies are imported when the tab is opened
+        view_module = importlib.import_module('.' + module, __package__)
+        return getattr(view_module, name)(project)
+    return build
+
+
 def display(project_path):
     project = expipe.get_project(project_path)
-    # register tab
-    register_tab_tab_titles = [
-        'OpenEphys',
-        'Intan',
-        'Axona',
-        'Adjustment',
-        'Entity',
-        'Surgery',
-        'Perfusion',
-        'Annotate']
-    register_tab = ipywidgets.Tab()
-    register_tab.children = [
-        register_openephys_view(project),
-        register_intan_view(project),
-        axona_view(project),
-        adjustment_view(project),
-        entity_view(project),
-        surgery_view(project),
-        perfuse_view(project),
-        annotate_view(project)
-    ]
-    for i, title in enumerate(register_tab_tab_titles):
-        register_tab.set_title(i, title)
-
-    process_tab_tab_titles = [
-        'OpenEphys', 'Intan', 'Tracking', 'Psychopy', 'Curation']
-    process_tab = ipywidgets.Tab()
-    process_tab.children = [
-        process_openephys_view(project),
-        process_intan_view(project),
-        process_tracking_view(project),
-        process_psychopy_view(project),
-        process_curation_view(project)
-    ]
-    for i, title in enumerate(process_tab_tab_titles):
-        process_tab.set_title(i, title)
-
-    tab_titles = ['Register', 'Process']
-    tab = ipywidgets.Tab()
-    tab.children = [
-        register_tab,
-        process_tab
-    ]
-    for i, title in enumerate(tab_titles):
-        tab.set_title(i, title)
-    ipd.display(tab)
+    cache = session_cache(project)
+
+    def tab_builder(views):
+        return lambda: LazyTab([
+            (title, _view_builder(project, module, name)) for title, module, name in views])
+
+    tab = LazyTab([(title, tab_builder(views)) for title, views in VIEWS.items()])
+    refresh = ipywidgets.Button(
+        description='Refresh', tooltip='Reload actions, templates and sorters',
+        layout={'width': 'initial'})
+
+    def on_refresh(change):
+        cache.refresh()
+        tab.reset()
+
+    refresh.on_click(on_refresh)
+    ipd.display(ipywidgets.VBox([refresh, tab]))
@@ -3,13 +3,14 @@ from expipe_plugin_cinpla.scripts import curation
 from .utils import (
     SelectDirectoryButton, MultiInput, SearchSelectMultiple, SelectFileButton,
     required_values_filled, none_if_empty, split_tags, SearchSelect,
-    ParameterSelectList)
+    ParameterSelectList, session_cache)
 from ..scripts.utils import _get_data_path
 
 
 def process_curation_view(project):
     action_id = SearchSelectMultiple(
-        project.actions, description='*Actions', layout={'width': 'initial'})
+        session_cache(project).actions(), facets=session_cache(project).index(),
+        description='*Actions', layout={'width': 'initial'})
 
     sorter_label = ipywidgets.Label(value='Spike sorters')
 
@@ -1,9 +1,9 @@
 from expipe_plugin_cinpla.imports import *
-from expipe_plugin_cinpla.scripts import openephys
+from expipe_plugin_cinpla.scripts import openephys, sorters
 from .utils import (
     SelectDirectoryButton, MultiInput, SearchSelectMultiple, SelectFileButton,
     required_values_filled, none_if_empty, split_tags, SearchSelect,
-    ParameterSelectList)
+    ParameterSelectList, session_cache)
 import ast
 
 
@@ -16,7 +16,7 @@ def register_openephys_view(project):
     entity_id = ipywidgets.Text(placeholder='Entity id')
     message = ipywidgets.Text(placeholder='Message')
     tag = ipywidgets.Text(placeholder='Tags (; to separate)')
-    templates = SearchSelectMultiple(project.templates, description='Templates')
+    templates = SearchSelectMultiple(session_cache(project).templates(), description='Templates')
     depth = MultiInput(['Key', 'Probe', 'Depth', 'Unit'], 'Add depth')
     register_depth = ipywidgets.Checkbox(description='Register depth', value=False)
     register_depth_from_adjustment = ipywidgets.Checkbox(
@@ -89,26 +89,25 @@ def register_openephys_view(project):
                 tag=tags,
                 delete_raw_data=delete_raw_data.value,
                 correct_depth_answer=True)
+        session_cache(project).refresh_actions()
 
     register.on_click(on_register)
     return main_box
 
 
 def process_openephys_view(project):
-    import spiketoolkit as st
-    import spikesorters as ss
-
     probe_path = SelectFileButton(
         '.prb', initialdir=str(project._backend.path),
         description='*Select probe file',
         style={'description_width': 'initial'},
         layout={'width': 'initial'})
     action_id = SearchSelectMultiple(
-        project.actions, description='*Actions', layout={'width': 'initial'})
+        session_cache(project).actions(), facets=session_cache(project).index(),
+        description='*Actions', layout={'width': 'initial'})
 
     sorter = ipywidgets.Dropdown(
         description='Sorter',
-        options=[s.sorter_name for s in ss.sorter_full_list],
+        options=session_cache(project).sorters(),
         style={'description_width': 'initial'}, layout={'width': 'initial'}
     )
 
@@ -260,9 +259,7 @@ def process_openephys_view(project):
 
     def on_change(change):
         if change['type'] == 'change' and change['name'] == 'value':
-            for s in ss.sorter_full_list:
-                if s.sorter_name == sorter.value:
-                    params = s.default_params()
+            params = sorters.default_params(sorter.value)
             sorter_param.update_params(params)
 
     def on_run(change):
@@ -321,9 +318,7 @@ def process_openephys_view(project):
 
     def on_show(change):
         if change['type'] == 'change' and change['name'] == 'value':
-            for s in ss.sorter_full_list:
-                if s.sorter_name == sorter.value:
-                    params = s.default_params()
+            params = sorters.default_params(sorter.value)
             sorter_param.update_params(params)
             if show_params.value:
                 sorter_param.layout.visibility = 'visible'
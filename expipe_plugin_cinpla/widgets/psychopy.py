@@ -1,7 +1,7 @@
 from expipe_plugin_cinpla.imports import *
 from expipe_plugin_cinpla.scripts import tracking
 from .utils import SelectDirectoryButton, MultiInput, SearchSelectMultiple, SelectFileButton, \
-    required_values_filled, none_if_empty, split_tags, SearchSelect, ParameterSelectList
+    required_values_filled, none_if_empty, split_tags, SearchSelect, ParameterSelectList, session_cache
 import ast
 
 from expipe_plugin_cinpla.scripts.psychopy import process_psychopy
@@ -9,7 +9,9 @@ from expipe_plugin_cinpla.scripts.psychopy import process_psychopy
 
 def process_psychopy_view(project):
     json_path = SelectFileButton(description='*Select JSON path')
-    action_id = SearchSelect(project.actions, description='*Actions', layout={'width': 'initial'})
+    action_id = SearchSelect(
+        session_cache(project).actions(), facets=session_cache(project).index(),
+        description='*Actions', layout={'width': 'initial'})
     run = ipywidgets.Button(description='Process', layout={'width': '100%', 'height': '100px'})
     run.style.button_color = 'pink'
 
@@ -1,6 +1,6 @@
 from expipe_plugin_cinpla.imports import *
 from expipe_plugin_cinpla.scripts import surgery
-from .utils import DatePicker, MultiInput, SearchSelectMultiple, required_values_filled, none_if_empty, split_tags, SearchSelect
+from .utils import DatePicker, MultiInput, SearchSelectMultiple, required_values_filled, none_if_empty, split_tags, SearchSelect, session_cache
 
 
 def surgery_view(project):
@@ -17,7 +17,7 @@ def surgery_view(project):
     tag = ipywidgets.Text(placeholder='Tags (; to separate)')
     position = MultiInput(['*Key', '*Probe', '*x', '*y', '*z', '*Unit'], 'Add position')
     angle = MultiInput(['*Key', '*Probe', '*Angle', '*Unit'], 'Add angle')
-    templates = SearchSelectMultiple(project.templates, description='Templates')
+    templates = SearchSelectMultiple(session_cache(project).templates(), description='Templates')
     overwrite = ipywidgets.Checkbox(description='Overwrite', value=False)
     register = ipywidgets.Button(description='Register')
 
@@ -60,6 +60,7 @@ def surgery_view(project):
             angle=angle.value,
             message=none_if_empty(message.value),
             tag=tags)
+        session_cache(project).refresh_actions()
 
     register.on_click(on_register)
     return main_box
@@ -74,7 +75,7 @@ def perfuse_view(project):
     weight = ipywidgets.HBox([
         ipywidgets.Text(placeholder='*Weight', layout={'width': '60px'}),
         ipywidgets.Text(placeholder='*Unit', layout={'width': '60px'})])
-    templates = SearchSelectMultiple(project.templates, description='Templates')
+    templates = SearchSelectMultiple(session_cache(project).templates(), description='Templates')
     overwrite = ipywidgets.Checkbox(description='Overwrite', value=False)
 
     register = ipywidgets.Button(description='Register')
@@ -105,6 +106,7 @@ def perfuse_view(project):
             date=date.datetime,
             weight=weight_val,
             message=none_if_empty(message.value))
+        session_cache(project).refresh_actions()
 
     register.on_click(on_register)
     return main_box
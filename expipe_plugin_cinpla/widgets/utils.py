@@ -1,4 +1,7 @@
 from expipe_plugin_cinpla.imports import *
+from expipe_plugin_cinpla.scripts import action_index, sorters
+from expipe_plugin_cinpla.scripts.utils import project_path
+import asyncio
 
 
 def required_values_filled(*widgets):
@@ -16,6 +19,55 @@ def required_values_filled(*widgets):
     return all(filled)
 
 
+class SessionCache:
+    '''
+    Option lists that are expensive to build (actions, templates and
+    sorters), shared by the views of a project until refresh is called.
+    '''
+    def __init__(self, project):
+        self.project = project
+        self._cache = {}
+
+    def _get(self, key, build):
+        if key not in self._cache:
+            self._cache[key] = build()
+        return self._cache[key]
+
+    def index(self):
+        return self._get('index', lambda: action_index.get_index(self.project))
+
+    def actions(self):
+        return self._get('actions', lambda: self.index().ids())
+
+    def templates(self):
+        return self._get('templates', lambda: sorted(self.project.templates))
+
+    def sorters(self):
+        return self._get('sorters', sorters.sorter_names)
+
+    def refresh_actions(self):
+        '''
+        Index the actions registered since the index was read, the action
+        list is rebuilt when it is used next.
+        '''
+        if 'index' in self._cache:
+            self._cache['index'].refresh()
+        self._cache.pop('actions', None)
+
+    def refresh(self):
+        self._cache = {}
+
+
+_session_caches = {}
+
+
+def session_cache(project):
+    key = str(project_path(project))
+    if key not in _session_caches:
+        _session_caches[key] = SessionCache(project)
+    return _session_caches[key]
+
+
 def none_if_empty(txt):
     return txt if txt != '' else None
 
@@ -27,67 +79,159 @@ def split_tags(tag):
         return tag.value.split(';')
 
 
-class SearchSelectMultiple(ipywidgets.VBox):
+class SearchIndex:
+    '''
+    Substring search over a sorted list of options. Every option is
+    indexed by its n-grams up to length n, a query is answered from the
+    postings of its n-grams instead of testing every option.
+    '''
+    def __init__(self, options, n=3):
+        self.options = sorted(set(str(o) for o in options))
+        self.n = n
+        postings = collections.defaultdict(list)
+        for position, option in enumerate(self.options):
+            grams = set(option[i:i + k] for k in range(1, n + 1) for i in range(len(option) - k + 1))
+            for gram in grams:
+                postings[gram].append(position)
+        self.postings = dict(postings)
+
+    def search(self, query, limit=None, allowed=None):
+        '''
+        Options containing query, in sorted order.
+
+        Parameters
+        ----------
+        query : str
+        limit : int
+            Maximum number of options returned.
+        allowed : set
+            Only options in allowed are returned.
+
+        Returns
+        -------
+        matches : list
+        count : int
+            Number of matches before the limit.
+        '''
+        if query == '':
+            positions = range(len(self.options))
+        elif len(query) <= self.n:
+            positions = self.postings.get(query, [])
+        else:
+            grams = [query[i:i + self.n] for i in range(len(query) - self.n + 1)]
+            postings = sorted((self.postings.get(g, []) for g in grams), key=len)
+            candidates = set(postings[0]).intersection(*postings[1:])
+            positions = sorted(p for p in candidates if query in self.options[p])
+        matches = [self.options[p] for p in positions]
+        if allowed is not None:
+            matches = [o for o in matches if o in allowed]
+        return matches[:limit], len(matches)
+
+
+class Debouncer:
+    '''
+    Calls function with the latest arguments once no new call has been
+    made for wait seconds. The call is scheduled on the event loop of the
+    kernel, so it runs in the same thread as the widget callbacks.
+    Outside an event loop function is called right away.
+    '''
+    def __init__(self, function, wait=0.3):
+        self.function = function
+        self.wait = wait
+        self._handle = None
+
+    def __call__(self, *args, **kwargs):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.function(*args, **kwargs)
+            return
+        self._handle = loop.call_later(self.wait, lambda: self.function(*args, **kwargs))
+
+
+class _SearchSelectBase(ipywidgets.VBox):
+    '''
+    Search field and selection list showing at most max_options matches
+    and the number of matches. Filtering happens after typing pauses for
+    debounce seconds. With an ActionIndex as facets, the options can be
+    filtered by tag, entity and date.
+    '''
+    def __init__(self, options, select, facets=None, max_options=200, debounce=0.3, *args, **kwargs):
+        super(_SearchSelectBase, self).__init__(*args, **kwargs)
+        self.index = SearchIndex(options)
+        self.facets = facets
+        self.max_options = max_options
+        self.description = kwargs.get('description') or '' # TODO move into placeholder
+        self._select = select
+        self.search_widget = ipywidgets.Text(
+            placeholder=self.description,
+            layout={'width': select.layout.width})
+        self.count = ipywidgets.Label()
+        self.search_widget.observe(Debouncer(lambda change: self.update(), debounce), names='value')
+        children = [self.search_widget]
+        if facets is not None:
+            self.tag = ipywidgets.Dropdown(
+                description='Tag', options=[''] + facets.values('tag'), layout={'width': select.layout.width})
+            self.entity = ipywidgets.Dropdown(
+                description='Entity', options=[''] + facets.values('entity'), layout={'width': select.layout.width})
+            self.start = ipywidgets.DatePicker(description='From')
+            self.stop = ipywidgets.DatePicker(description='To')
+            for widget in [self.tag, self.entity, self.start, self.stop]:
+                widget.observe(lambda change: self.update(), names='value')
+            children += [self.tag, self.entity, self.start, self.stop]
+        self.children = children + [select, self.count]
+        self.update()
+
+    def _allowed(self):
+        if self.facets is None:
+            return None
+        tag, entity, start, stop = self.tag.value, self.entity.value, self.start.value, self.stop.value
+        if not (tag or entity or start or stop):
+            return None
+        if stop is not None:
+            stop = stop + dt.timedelta(days=1)
+        return set(self.facets.ids(
+            tag=tag or None, entity=entity or None,
+            start=dt.datetime.combine(start, dt.time()) if start else None,
+            stop=dt.datetime.combine(stop, dt.time()) if stop else None))
+
+    def update(self):
+        matches, count = self.index.search(
+            self.search_widget.value, limit=self.max_options, allowed=self._allowed())
+        self._select.options = matches
+        if count > len(matches):
+            self.count.value = 'Showing {} of {} matches'.format(len(matches), count)
+        else:
+            self.count.value = 'Matches: {}'.format(count)
+
+
+class SearchSelectMultiple(_SearchSelectBase):
     def __init__(self, options, *args, **kwargs):
-        super(SearchSelectMultiple, self).__init__(*args, **kwargs)
         self.select_multiple = ipywidgets.SelectMultiple(
-            options=sorted(options),
+            options=[],
             value=(),
             disabled=False,
             layout={'height': '200px', 'width': '300px'}
         )
-        update = ipywidgets.Button(
-            description='Update', style={'description_width': 'initial'}, layout={'width': 'initial'})
-        self.description = kwargs.get('description') or '' # TODO move into placeholder
-        self.search_widget = ipywidgets.Text(
-            placeholder=self.description,
-            layout={'width': self.select_multiple.layout.width})
-
-        # Wire the search field to the checkboxes
-        def on_text_change(change):
-            search_input = change['new']
-            if search_input == '':
-                # Reset search field
-                new_options = sorted(options)
-            else:
-                # Filter by search field.
-                new_options = [a for a in options if search_input in a]
-            self.select_multiple.options = sorted(new_options)
-
-        self.search_widget.observe(on_text_change, names='value')
-        self.children = [self.search_widget, self.select_multiple]
+        super(SearchSelectMultiple, self).__init__(options, self.select_multiple, *args, **kwargs)
 
     @property
     def value(self):
         return self.select_multiple.value
 
 
-class SearchSelect(ipywidgets.VBox):
+class SearchSelect(_SearchSelectBase):
     def __init__(self, options, *args, **kwargs):
-        super(SearchSelect, self).__init__(*args, **kwargs)
         self.select = ipywidgets.Select(
-            options=sorted(options),
+            options=[],
             value=None,
             disabled=False,
             layout={'height': '200px', 'width': '300px'}
         )
-        self.description = kwargs.get('description') or ''
-        search_widget = ipywidgets.Text(
-            placeholder=self.description,
-            layout={'width': self.select.layout.width})
-        # Wire the search field to the checkboxes
-        def on_text_change(change):
-            search_input = change['new']
-            if search_input == '':
-                # Reset search field
-                new_options = sorted(options)
-            else:
-                # Filter by search field.
-                new_options = [a for a in options if search_input in a]
-            self.select.options = sorted(new_options)
-
-        search_widget.observe(on_text_change, names='value')
-        self.children = [search_widget, self.select]
+        super(SearchSelect, self).__init__(options, self.select, *args, **kwargs)
 
     @property
     def value(self):
@@ -0,0 +1,43 @@
+import os
+from expipe_plugin_cinpla.scripts.action_index import ActionIndex
+
+
+def _write_action(actions_path, action_id, contents):
+    (actions_path / action_id).mkdir(parents=True, exist_ok=True)
+    (actions_path / action_id / 'attributes.yaml').write_text(contents)
+
+
+def test_action_index(tmp_path):
+    import datetime
+    actions_path = tmp_path / 'actions'
+    _write_action(actions_path, '1849-010119-1', (
+        'type: Recording\ndatetime: "2019-01-01T10:00:00"\nentities: ["1849"]\n'
+        'tags: [open-field]\ndata: {main: actions/1849-010119-1/data/main.exdir}\n'))
+    _write_action(actions_path, '1849-adjustment', 'type: Adjustment\nentities: ["1849"]\n')
+    index = ActionIndex(actions_path, tmp_path / 'index.sqlite')
+    assert sorted(index.refresh()[0]) == ['1849-010119-1', '1849-adjustment']
+    assert index.refresh() == ([], [])
+    assert index.ids(entity='1849') == ['1849-010119-1', '1849-adjustment']
+    assert index.ids(tag='open-field') == index.ids(type='Recording') == ['1849-010119-1']
+    assert index.ids(start=datetime.datetime(2019, 1, 2)) == []
+    action = index.get('1849-010119-1')
+    assert action['datetime'] == datetime.datetime(2019, 1, 1, 10)
+    assert index.datetimes() == {'1849-010119-1': datetime.datetime(2019, 1, 1, 10), '1849-adjustment': None}
+    assert action['data'] == {'main': 'actions/1849-010119-1/data/main.exdir'}
+
+    _write_action(actions_path, '1849-adjustment', 'type: Adjustment\nentities: ["1850"]\n')
+    path = actions_path / '1849-adjustment' / 'attributes.yaml'
+    os.utime(str(path), ns=(0, 1))
+    (actions_path / '1849-010119-1' / 'attributes.yaml').unlink()
+    index = ActionIndex(actions_path, tmp_path / 'index.sqlite')
+    assert index.refresh() == (['1849-adjustment'], ['1849-010119-1'])
+    assert index.ids(entity='1850') == ['1849-adjustment']
+    assert index.values('type') == ['Adjustment']
+
+
+def test_index_needs_filesystem_project():
+    import types
+    import pytest
+    from expipe_plugin_cinpla.scripts.action_index import get_index
+    with pytest.raises(ValueError, match='not stored on the filesystem'):
+        get_index(types.SimpleNamespace(name='remote', config={}, _backend=object()))
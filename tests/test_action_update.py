@@ -0,0 +1,44 @@
+import datetime
+import pytest
+import expipe
+from expipe_plugin_cinpla.scripts.action_update import ActionUpdate
+
+
+def test_action_update(tmp_path):
+    project = expipe.create_project(str(tmp_path / 'project'))
+    action = project.create_action('action')
+    action.tags = ['old']
+    start = datetime.datetime(2019, 1, 1, 12)
+    with ActionUpdate(action) as update:
+        update.datetime = start
+        update.type = 'Recording'
+        update.extend('tags', ['new', 'old'])
+        update.entities = ['1234']
+        update.users = ['user']
+        update.location = 'lab'
+        update.create_module(name='depth', contents={'a': 1})
+        for i in range(3):
+            update.create_message(text=str(i), user='user', datetime=start + datetime.timedelta(seconds=i))
+        with pytest.raises(KeyError):
+            update.create_message(text='same', user='user', datetime=start)
+        assert update.tags == ['old', 'new']
+        assert 'depth' not in action.modules
+    assert action.datetime == start
+    assert action.type == 'Recording'
+    assert sorted(action.tags) == ['new', 'old']
+    assert action.entities == ['1234']
+    assert action.location == 'lab'
+    assert action.modules['depth'].contents == {'a': 1}
+    assert sorted(m.text for m in action.messages.values()) == ['0', '1', '2']
+
+
+def test_action_update_discards_on_error(tmp_path):
+    project = expipe.create_project(str(tmp_path / 'project'))
+    action = project.create_action('action')
+    with pytest.raises(ValueError):
+        with ActionUpdate(action) as update:
+            update.type = 'Recording'
+            update.create_module(name='depth', contents={'a': 1})
+            raise ValueError
+    assert action.type is None
+    assert 'depth' not in action.modules
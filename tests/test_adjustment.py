@@ -0,0 +1,40 @@
+import datetime
+import random
+from expipe_plugin_cinpla.scripts.utils import AdjustmentTimeline, deltadate
+
+
+def test_adjustment_timeline():
+    random.seed(1)
+    start = datetime.datetime(2019, 1, 1)
+    adjusts = {}
+    for i in range(50):
+        date = start + datetime.timedelta(hours=random.randint(24, 2000))
+        adjusts[date] = {'mecl': {'probe_0': i}}
+    timeline = AdjustmentTimeline(adjusts)
+    for hours in [0, 24, 25, 500, 1000, 3000] + sorted(random.sample(range(2000), 100)):
+        regdate = start + datetime.timedelta(hours=hours)
+        adjustdate = min(adjusts, key=lambda x: deltadate(x, regdate))
+        assert timeline.lookup(regdate) == (adjusts[adjustdate], adjustdate)
+    depth, _ = timeline.lookup(start)
+    depth['mecl']['probe_0'] = -1
+    assert timeline.lookup(start)[0] != depth
+
+
+def test_get_depths_from_adjustment(tmp_path):
+    import os
+    import expipe
+    from expipe_plugin_cinpla.scripts.utils import get_depths_from_adjustment
+    project = expipe.create_project(str(tmp_path / 'project'))
+    adjustments = project.create_action('1849-adjustment')
+    adjustments.create_module(name='adjustment_000', contents={
+        'date': '2019-01-01T10:00:00', 'depth': {'mecl': {'probe_0': 1}}})
+    planned = {'1849-020119-1': ('1849', datetime.datetime(2019, 1, 2))}
+    assert get_depths_from_adjustment(project, list(planned), planned=planned) == {
+        '1849-020119-1': ({'mecl': {'probe_0': 1}}, datetime.datetime(2019, 1, 1, 10))}
+
+    # changing a module file does not change the modification time of the folder
+    path = tmp_path / 'project' / 'actions' / '1849-adjustment' / 'modules' / 'adjustment_000.yaml'
+    path.write_text(path.read_text().replace('probe_0: 1', 'probe_0: 2'))
+    os.utime(str(path), ns=(0, 1))
+    depth, _ = get_depths_from_adjustment(project, list(planned), planned=planned)['1849-020119-1']
+    assert depth == {'mecl': {'probe_0': 2}}
@@ -0,0 +1,83 @@
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pytest
+import exdir
+import yaml
+from expipe_plugin_cinpla.scripts import axona as axona_scripts
+
+AXONA_SET = os.path.join(os.path.dirname(__file__), 'test_data', 'axona', 'DVH_2013103103.set')
+
+
+def write_chain(exdir_path, prefix, n):
+    # runs in a separate process
+    exdir_file = exdir.File(exdir_path)
+    for i in range(n):
+        exdir_file['group'].attrs[prefix + str(i)] = i
+    exdir_file.attrs[prefix] = 'done'
+    exdir_file['group'].create_group(prefix).create_dataset('data', data=np.arange(n))
+
+
+def test_merge_copies(tmp_path):
+    exdir_path = tmp_path / 'test.exdir'
+    exdir_file = exdir.File(str(exdir_path))
+    exdir_file.create_group('group').attrs['shared'] = 1
+    exdir_file.create_dataset('dataset', data=np.arange(3))
+    copy_paths = [tmp_path / 'copy_a.exdir', tmp_path / 'copy_b.exdir']
+    for copy_path in copy_paths:
+        attributes = axona_scripts._copy_skeleton(exdir_path, copy_path)
+    assert not (copy_paths[0] / 'dataset').exists()
+    with ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context('spawn')) as executor:
+        futures = [executor.submit(write_chain, str(copy_path), prefix, 100)
+                   for copy_path, prefix in zip(copy_paths, ['a', 'b'])]
+        for future in futures:
+            future.result()
+    for copy_path in copy_paths:
+        axona_scripts._merge_copy(copy_path, exdir_path, attributes)
+    exdir_file = exdir.File(str(exdir_path))
+    expected = {prefix + str(i): i for prefix in ['a', 'b'] for i in range(100)}
+    assert exdir_file['group'].attrs.to_dict() == dict(expected, shared=1)
+    assert exdir_file.attrs.to_dict() == {'a': 'done', 'b': 'done'}
+    assert np.array_equal(exdir_file['group/b/data'].data, np.arange(100))
+    assert np.array_equal(exdir_file['dataset'].data, np.arange(3))
+
+
+def _read_tree(path):
+    tree = {}
+    for dirpath, dirnames, filenames in os.walk(path):
+        for filename in filenames:
+            full_path = os.path.join(dirpath, filename)
+            key = os.path.relpath(full_path, path)
+            if filename.endswith('.yaml'):
+                with open(full_path) as f:
+                    tree[key] = yaml.safe_load(f)
+            elif filename.endswith('.npy'):
+                tree[key] = np.load(full_path, allow_pickle=True)
+            else:
+                with open(full_path, 'rb') as f:
+                    tree[key] = f.read()
+    return tree
+
+
+def test_run_chains_parallel(tmp_path):
+    import pyxona
+    from expipe_io_neuro import axona
+    trees = []
+    for n_jobs in [1, 4]:
+        exdir_path = str(tmp_path / 'n_jobs_{}.exdir'.format(n_jobs))
+        axona_file = pyxona.File(AXONA_SET)
+        axona.convert(axona_file, exdir_path)
+        chains = axona_scripts.conversion_chains(get_inp=True)
+        if n_jobs > 1:
+            axona_scripts.run_chains_parallel(exdir_path, AXONA_SET, axona_file, chains, n_jobs)
+        else:
+            for chain in chains:
+                axona_scripts._run_chain(exdir_path, axona_file, chain)
+        trees.append(_read_tree(exdir_path))
+    assert sorted(trees[0]) == sorted(trees[1])
+    for key, value in trees[0].items():
+        if isinstance(value, np.ndarray):
+            assert np.array_equal(value, trees[1][key]), key
+        else:
+            assert value == trees[1][key], key
@@ -0,0 +1,93 @@
+import datetime
+import json
+import time
+import expipe
+from expipe_plugin_cinpla.scripts import bulk
+from expipe_plugin_cinpla.scripts.bulk import find_sessions, plan_sessions, register_sessions
+
+
+def test_plan_sessions(tmp_path):
+    for name in ['1849_190101_120000.rhd', '1849_190101_090000.rhd', '1849_190102_090000.rhs',
+                 '1833_190101_100000.rhd', 'notes.txt']:
+        (tmp_path / 'intan' / name).parent.mkdir(exist_ok=True)
+        (tmp_path / 'intan' / name).write_bytes(b'')
+    (tmp_path / 'openephys' / '1849_2019-01-01_1').mkdir(parents=True)
+    (tmp_path / 'openephys' / '1849_2019-01-01_1' / 'settings.xml').write_bytes(b'')
+    (tmp_path / 'openephys' / '1849_2019-01-01_1' / 'nested.rhd').write_bytes(b'')
+
+    sessions = find_sessions(tmp_path)
+    assert [(s['system'], s['path'].name) for s in sessions] == [
+        ('intan', '1833_190101_100000.rhd'), ('intan', '1849_190101_090000.rhd'),
+        ('intan', '1849_190101_120000.rhd'), ('intan', '1849_190102_090000.rhs'),
+        ('openephys', '1849_2019-01-01_1')]
+
+    registered = {'1849-010119-1': datetime.datetime(2019, 1, 1, 12)}
+    planned = plan_sessions(find_sessions(tmp_path, systems=['intan']), registered=registered)
+    assert [(s['action_id'], s['status']) for s in planned] == [
+        ('1833-010119-1', 'planned'), ('1849-010119-2', 'planned'),
+        ('1849-010119-1', 'skipped'), ('1849-020119-1', 'planned')]
+
+
+def fake_register(project, action_id, intan_path, **kwargs):
+    # runs in a registration process
+    started = time.time()
+    time.sleep(1)
+    project.create_action(action_id)
+    with open(intan_path + '.json', 'w') as f:
+        json.dump({'start': started, 'stop': time.time(), 'kwargs': kwargs}, f, default=str)
+
+
+def _overlaps(times):
+    times = sorted(times)
+    return any(b[0] < a[1] for a, b in zip(times, times[1:]))
+
+
+def test_register_sessions(tmp_path, monkeypatch):
+    monkeypatch.setitem(bulk.REGISTER_FUNCTIONS, 'intan', (__name__, 'fake_register'))
+    project = expipe.create_project(str(tmp_path / 'project'))
+    for name in ['1849_190101_090000.rhd', '1849_190101_100000.rhd', '1849_190101_110000.rhd']:
+        (tmp_path / 'data' / name).parent.mkdir(exist_ok=True)
+        (tmp_path / 'data' / name).write_bytes(b'')
+    sessions = plan_sessions(find_sessions(tmp_path / 'data'), registered={'1849-010119-1': None})
+    sessions = register_sessions(project, sessions, user='user', location='lab', max_workers=3, io_limit=1)
+    assert [(s['action_id'], s['status']) for s in sessions] == [
+        ('1849-010119-2', 'registered'), ('1849-010119-3', 'registered'), ('1849-010119-4', 'registered')]
+    assert all(a in project.actions for a in ['1849-010119-2', '1849-010119-3', '1849-010119-4'])
+    times = []
+    for session in sessions:
+        with open(str(session['path']) + '.json') as f:
+            result = json.load(f)
+        assert result['kwargs']['session'] == session['session']
+        assert result['kwargs']['user'] == 'user'
+        times.append((result['start'], result['stop']))
+    # all files are on the same disk
+    assert not _overlaps(times)
+
+    for session in sessions:
+        project.delete_action(session['action_id'])
+        session['status'] = 'planned'
+    sessions = register_sessions(project, sessions, user='user', location='lab', max_workers=3, io_limit=3)
+    assert all(s['status'] == 'registered' for s in sessions)
+    times = []
+    for session in sessions:
+        with open(str(session['path']) + '.json') as f:
+            result = json.load(f)
+        times.append((result['start'], result['stop']))
+    assert _overlaps(times)
+
+
+def test_register_sessions_depth(tmp_path, monkeypatch):
+    monkeypatch.setitem(bulk.REGISTER_FUNCTIONS, 'intan', (__name__, 'fake_register'))
+    project = expipe.create_project(str(tmp_path / 'project'))
+    project.create_action('1849-adjustment').create_module(name='adjustment_000', contents={
+        'date': '2019-01-01T08:00:00', 'depth': {'mecl': {'probe_0': 1}}})
+    for name in ['1849_190101_090000.rhd', '1850_190101_090000.rhd']:
+        (tmp_path / 'data' / name).parent.mkdir(exist_ok=True)
+        (tmp_path / 'data' / name).write_bytes(b'')
+    sessions = plan_sessions(find_sessions(tmp_path / 'data'))
+    sessions = register_sessions(project, sessions, user='user', location='lab', register_depth=True)
+    assert [(s['action_id'], s['status']) for s in sessions] == [
+        ('1849-010119-1', 'registered'), ('1850-010119-1', 'failed')]
+    assert '1850-010119-1' not in project.actions
+    with open(str(sessions[0]['path']) + '.json') as f:
+        assert json.load(f)['kwargs']['adjustment'][0] == {'mecl': {'probe_0': 1}}
@@ -0,0 +1,73 @@
+import pytest
+from expipe_plugin_cinpla.scripts.cache import PreprocessingCache, make_key
+
+
+def _make_file(path, size):
+    path.write_bytes(b'0' * size)
+    return path
+
+
+def test_cache_key(tmp_path):
+    raw = _make_file(tmp_path / 'raw.dat', 10)
+    probe = _make_file(tmp_path / 'probe.prb', 10)
+    key = make_key(raw, probe, ref='cmr', freq_min_hp=300)
+    assert key == make_key(raw, probe, ref='cmr', freq_min_hp=300)
+    assert key != make_key(raw, probe, ref='car', freq_min_hp=300)
+    assert key != make_key(raw, probe, version=0, ref='cmr', freq_min_hp=300)
+    _make_file(raw, 20)
+    assert key != make_key(raw, probe, ref='cmr', freq_min_hp=300)
+
+
+def test_cache_lru(tmp_path):
+    cache = PreprocessingCache(tmp_path / 'cache', max_size_gb=250e-9)
+    for key in ['a', 'b']:
+        cache.put(key, [_make_file(tmp_path / 'filt.dat', 100)], description=key)
+    folder, entry = cache.get('a')
+    assert (folder / 'filt.dat').is_file()
+    assert entry['description'] == 'a'
+    cache.put('c', [_make_file(tmp_path / 'filt.dat', 100)])
+    assert [e['key'] for e in cache.entries()] == ['c', 'a']
+    assert cache.get('b') == (None, None)
+    cache.prune(max_size_gb=0)
+    assert cache.entries() == []
+
+
+def test_cache_replace(tmp_path):
+    cache = PreprocessingCache(tmp_path / 'cache')
+    cache.put('a', [_make_file(tmp_path / 'filt.dat', 100)], description='old')
+    cache.put('a', [_make_file(tmp_path / 'filt.dat', 50)], description='new')
+    folder, entry = cache.get('a')
+    assert entry['description'] == 'new'
+    assert (folder / 'filt.dat').stat().st_size == 50
+    # no temporary folders are left behind
+    assert [p.name for p in (tmp_path / 'cache').iterdir()] == ['a']
+
+
+def test_cache_filtered_notch(tmp_path):
+    import numpy as np
+    import spikeextractors as se
+    from expipe_plugin_cinpla.scripts import cache
+    from expipe_plugin_cinpla.scripts.preprocessing import FusedPreprocessor
+    traces = np.random.RandomState(0).randint(-1000, 1000, size=(2, 30000)).astype('int16')
+    recording = se.NumpyRecordingExtractor(traces, sampling_frequency=30000.)
+    preprocessing_cache = PreprocessingCache(tmp_path / 'cache')
+    preprocessor = FusedPreprocessor(recording)
+    preprocessor.set_notch([50., 150.], q_notch=100)
+    preprocessor.run(tmp_path / 'tmp', compute_lfp=False, verbose=False)
+    filt = cache.store_filtered(preprocessing_cache, 'key', preprocessor, tmp_path / 'tmp')
+    # the notch frequencies are restored without estimating them again
+    preprocessor = FusedPreprocessor(recording)
+    cached = cache.load_filtered(preprocessing_cache, 'key', preprocessor)
+    assert np.array_equal(cached.get_traces(), filt.get_traces())
+    assert list(preprocessor.freq_notch) == [50., 150.]
+    assert preprocessor.q_notch == 100
+
+
+def test_cache_opt_in(tmp_path):
+    from types import SimpleNamespace
+    from expipe_plugin_cinpla.scripts.cache import get_cache
+    assert get_cache(SimpleNamespace(config={})) is None
+    preprocessing_cache = get_cache(SimpleNamespace(config={'cache_folder': str(tmp_path / 'cache'),
+                                                            'cache_size_gb': 1}))
+    assert preprocessing_cache.folder == tmp_path / 'cache'
+    assert preprocessing_cache.max_size_gb == 1
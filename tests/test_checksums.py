@@ -0,0 +1,45 @@
+import os
+import pytest
+from expipe_plugin_cinpla.scripts.checksums import (
+    compute_manifest, compare_manifests, verify_copy)
+
+
+def _make_files(folder):
+    (folder / 'sub').mkdir(parents=True)
+    (folder / 'a.dat').write_bytes(os.urandom(5000))
+    (folder / 'sub' / 'b.dat').write_bytes(b'b' * 100)
+    (folder / 'empty.dat').write_bytes(b'')
+
+
+def test_manifest(tmp_path):
+    _make_files(tmp_path)
+    manifest = compute_manifest(tmp_path, block_size=1024, n_threads=3)
+    assert sorted(manifest['files']) == ['a.dat', 'empty.dat', 'sub/b.dat']
+    assert compute_manifest(tmp_path, block_size=1024) == manifest
+    assert compute_manifest(tmp_path, block_size=2048)['files']['a.dat']['hash'] != manifest['files']['a.dat']['hash']
+    data = bytearray((tmp_path / 'a.dat').read_bytes())
+    data[4000] ^= 1
+    (tmp_path / 'a.dat').write_bytes(bytes(data))
+    changed = compute_manifest(tmp_path, block_size=1024)
+    assert compare_manifests(changed, manifest) == ['a.dat']
+
+
+def test_manifest_reuses_unchanged_files(tmp_path):
+    _make_files(tmp_path)
+    manifest = compute_manifest(tmp_path, algorithm='crc32')
+    manifest['files']['sub/b.dat']['hash'] = 'cached'
+    assert compute_manifest(tmp_path, previous=manifest, algorithm='crc32')['files']['sub/b.dat']['hash'] == 'cached'
+    with pytest.raises(ValueError):
+        compare_manifests(manifest, dict(manifest, block_size=1))
+
+
+def test_verify_copy(tmp_path):
+    source, dest = tmp_path / 'source', tmp_path / 'dest'
+    _make_files(source)
+    _make_files(dest)
+    (dest / 'a.dat').write_bytes((source / 'a.dat').read_bytes())
+    manifest = compute_manifest(dest)
+    assert verify_copy(source, manifest)
+    assert verify_copy(source / 'sub' / 'b.dat', compute_manifest(dest / 'sub'))
+    (dest / 'sub' / 'b.dat').write_bytes(b'c' * 100)
+    assert not verify_copy(source, compute_manifest(dest))
@@ -0,0 +1,88 @@
+import struct
+import numpy as np
+import pytest
+from expipe_plugin_cinpla.scripts.intan_reader import IntanFile
+
+BLOCK_SIZE = 128
+
+
+def _qstring(text):
+    data = text.encode('utf-16-le')
+    return struct.pack('<I', len(data)) + data
+
+
+def _channel(name, signal_type):
+    return (_qstring(name) + _qstring(name) + struct.pack('<10h', 0, 0, signal_type, 1, 0, 0, 0, 0, 0, 0) +
+            struct.pack('<2f', 0, 0))
+
+
+def _write_rhd(path, amplifier, digital_in, first_timestamp=10):
+    header = struct.pack('<Ihh', 0xC6912702, 2, 0)
+    header += struct.pack('<fh6fh2f', 20000, 0, *([0] * 6), 0, 0, 0)
+    header += _qstring('') * 3 + struct.pack('<hh', 0, 0) + _qstring('') + struct.pack('<h', 1)
+    header += _qstring('Port A') + _qstring('A') + struct.pack('<3h', 1, 3, 3)
+    header += _channel('A-000', 0) + _channel('A-001', 0) + _channel('DIGITAL-IN-00', 4)
+    n_samples = amplifier.shape[0]
+    timestamps = np.arange(first_timestamp, first_timestamp + n_samples, dtype='int32')
+    with open(str(path), 'wb') as f:
+        f.write(header)
+        for start in range(0, n_samples, BLOCK_SIZE):
+            block = slice(start, start + BLOCK_SIZE)
+            f.write(timestamps[block].tobytes())
+            f.write(amplifier[block, 0].tobytes() + amplifier[block, 1].tobytes())
+            f.write(digital_in[block].tobytes())
+
+
+def test_rising_edges_first_timestamp(tmp_path):
+    # the edges index the recording, the event times include the first timestamp
+    n_samples = 2 * BLOCK_SIZE
+    amplifier = np.zeros((n_samples, 2), dtype='uint16')
+    digital_in = np.zeros(n_samples, dtype='uint16')
+    digital_in[[5, 200]] = 1
+    path = tmp_path / 'rat_190101_120000.rhd'
+    _write_rhd(path, amplifier, digital_in, first_timestamp=1000)
+    intan_file = IntanFile(path, cache_folder=tmp_path / 'cache')
+    assert intan_file.first_timestamp == 1000
+    assert list(intan_file.rising_edges(0)) == [5, 200]
+    rising = intan_file.digital_in_events[0].channel_states == 1
+    times = intan_file.digital_in_events[0].times[rising]
+    assert np.allclose(np.array(times * 20000), [1005, 1200])
+
+
+def test_intan_file(tmp_path):
+    n_samples = 5 * BLOCK_SIZE
+    amplifier = np.random.RandomState(0).randint(0, 2 ** 16, (n_samples, 2)).astype('uint16')
+    digital_in = np.zeros(n_samples, dtype='uint16')
+    digital_in[100:140] = 1
+    digital_in[250:260] = 4
+    digital_in[383:384] = 1
+    digital_in[500:510] = 5
+    path = tmp_path / 'rat_190101_120000.rhd'
+    _write_rhd(path, amplifier, digital_in)
+    cache_folder = tmp_path / 'cache'
+    intan_file = IntanFile(path, cache_folder=cache_folder, chunk_bytes=1000)
+    assert not intan_file.from_cache
+    assert intan_file.n_samples == n_samples
+    assert intan_file.datetime.year == 2019
+    assert intan_file.first_timestamp == 10
+    assert intan_file.channel_names == ['A-000', 'A-001']
+    assert list(intan_file.rising_edges(0)) == [100, 383]
+    assert list(intan_file.rising_edges(2)) == [250]
+    assert intan_file.rising_edges(1) is None
+    events = intan_file.digital_in_events
+    assert list(events[0].channel_states) == [1, 1, -1, -1]
+    assert list(np.array(events[0].times * 20000)) == [110, 393, 149, 393]
+    # not read through pyintan, which would load the whole file
+    with pytest.raises(AttributeError):
+        intan_file.analog_signals
+
+    chunks = list(intan_file.iter_chunks(scaled=False))
+    assert len(chunks) > 1
+    assert np.array_equal(np.concatenate([c for _, c in chunks]), amplifier)
+    first, signals = next(intan_file.iter_chunks())
+    assert np.allclose(signals, amplifier[:len(signals)] * 0.195 - 32768 * 0.195, atol=1e-2)
+
+    cached = IntanFile(path, cache_folder=cache_folder)
+    assert cached.from_cache
+    assert list(cached.rising_edges(0)) == [100, 383]
+    assert cached.n_samples == n_samples
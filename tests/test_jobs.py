@@ -0,0 +1,36 @@
+from expipe_plugin_cinpla.scripts.jobs import JobQueue
+
+
+def test_job_queue(tmp_path):
+    queue = JobQueue(tmp_path / 'jobs.sqlite')
+    job_id = queue.add('openephys', 'rat-010120-1', params={'sorter': ['klusta'], 'spikesort': True})
+    assert queue.add('openephys', 'rat-010120-1', params={'spikesort': True, 'sorter': ['klusta']}) == job_id
+    other_id = queue.add('intan', 'rat-010120-2', params={'spikesort': False})
+    assert other_id != job_id
+    assert queue.get(other_id)['spikesort'] == 0
+
+    queue.set_status(job_id, 'running')
+    queue.set_status(other_id, 'running')
+    queue.set_status(other_id, 'failed', error='error')
+    # restarting resumes running jobs
+    queue.reset('running')
+    assert [j['id'] for j in JobQueue(tmp_path / 'jobs.sqlite').jobs(status='pending')] == [job_id]
+    assert queue.get(job_id)['attempts'] == 1
+
+    # failed jobs are pending again when added again
+    queue.add('intan', 'rat-010120-2', params={'spikesort': False})
+    assert queue.get(other_id)['status'] == 'pending'
+    queue.set_status(job_id, 'done')
+    queue.remove('done')
+    assert [j['id'] for j in queue.jobs()] == [other_id]
+
+
+def test_job_queue_in_project(tmp_path):
+    import types
+    import pytest
+    import expipe
+    from expipe_plugin_cinpla.scripts.jobs import get_queue, JOB_FILE
+    project = expipe.create_project(str(tmp_path / 'project'))
+    assert get_queue(project).path == tmp_path / 'project' / JOB_FILE
+    with pytest.raises(ValueError, match='not stored on the filesystem'):
+        get_queue(types.SimpleNamespace(name='remote', config={}, _backend=object()))
@@ -0,0 +1,17 @@
+import numpy as np
+import spikeextractors as se
+from expipe_plugin_cinpla.scripts.preprocessing import FusedPreprocessor, blank_artifacts, FILTER_CHUNK_SIZE
+
+
+def test_linear_artifacts_across_blocks(tmp_path):
+    fs = 30000.
+    num_frames = 3 * FILTER_CHUNK_SIZE
+    traces = np.random.RandomState(0).randint(-1000, 1000, size=(2, num_frames)).astype('int16')
+    recording = se.NumpyRecordingExtractor(traces, sampling_frequency=fs)
+    # the artifact windows cross the block edges
+    triggers = [FILTER_CHUNK_SIZE - 10, 2 * FILTER_CHUNK_SIZE + 50]
+    preprocessor = FusedPreprocessor(recording, triggers=triggers, artifact_mode='linear')
+    chunk_mb = FILTER_CHUNK_SIZE * 2 * 8 / 1e6
+    filt = preprocessor.run(tmp_path, compute_lfp=False, chunk_mb=chunk_mb, verbose=False)['filt']
+    expected = blank_artifacts(traces.astype(float), 0, np.array(triggers), 15, 90, mode='linear')
+    assert np.array_equal(filt.get_traces(), expected.astype('int16'))
@@ -0,0 +1,119 @@
+import pytest
+from expipe_plugin_cinpla.scripts.remote import LocalShell, RemoteJob, ConnectionPool
+
+
+def test_remote_job(tmp_path):
+    job = RemoteJob(LocalShell(), tmp_path / 'job', job_shell='sh -c')
+    job.start('echo started; sleep 0.5; echo done; exit 3')
+    assert job.is_running()
+    assert RemoteJob(LocalShell(), tmp_path / 'job').exit_status() is None
+    assert job.wait(poll_interval=0.1, print_log=False) == 3
+    assert (tmp_path / 'job' / 'job.log').read_text() == 'started\ndone\n'
+    assert not job.is_running()
+
+
+def test_remote_job_shell(tmp_path):
+    job = RemoteJob(LocalShell(), tmp_path / 'job', job_shell='env JOB_VALUE=1 sh -c')
+    job.start('echo $JOB_VALUE')
+    assert job.wait(poll_interval=0.1, print_log=False) == 0
+    assert (tmp_path / 'job' / 'job.log').read_text() == '1\n'
+    job = RemoteJob(LocalShell(), tmp_path / 'missing')
+    job.start('no-such-executable-here')
+    assert job.wait(poll_interval=0.1, print_log=False) == 127
+    assert 'not found' in (tmp_path / 'missing' / 'job.log').read_text()
+
+
+def test_remote_job_reconnect(tmp_path):
+    class DroppingShell(LocalShell):
+        drops = 2
+
+        def read(self, path, offset=0):
+            if self.drops > 0:
+                self.drops -= 1
+                raise EOFError('dropped')
+            return super().read(path, offset)
+
+    job = RemoteJob(DroppingShell(), tmp_path / 'job', job_shell='sh -c')
+    job.start('echo done')
+    assert job.wait(poll_interval=0.1, print_log=False) == 0
+    assert (tmp_path / 'job' / 'job.log').read_text() == 'done\n'
+
+
+class _Transport:
+    active = True
+    keepalive = None
+
+    def is_active(self):
+        return self.active
+
+    def send_ignore(self):
+        pass
+
+    def set_keepalive(self, interval):
+        self.keepalive = interval
+
+
+class _Client:
+    closed = False
+
+    def __init__(self):
+        self.transport = _Transport()
+
+    def get_transport(self):
+        return self.transport
+
+    def close(self):
+        self.closed = True
+
+
+def test_connection_pool():
+    clients = []
+
+    def connect(server):
+        clients.append(_Client())
+        return clients[-1]
+
+    pool = ConnectionPool([{'host': 'server', 'domain': 'server.org'}], keepalive=5, connect=connect)
+    assert pool.get('server') is pool.get('server')
+    assert len(clients) == 1 and clients[0].transport.keepalive == 5
+    clients[0].transport.active = False
+    assert pool.get('server') is clients[1]
+    assert clients[0].closed
+    with pytest.raises(ValueError):
+        pool.get('other')
+    pool.close()
+    assert clients[1].closed
+
+
+def test_connect_asks_for_password(monkeypatch):
+    import paramiko
+    from expipe_plugin_cinpla.scripts import remote, utils
+
+    class SSHClient(_Client):
+        def set_missing_host_key_policy(self, policy):
+            pass
+
+        def connect(self, password=None, **kwargs):
+            if password is None:
+                raise paramiko.SSHException('No authentication methods available')
+
+    class SFTP:
+        closed = False
+
+        def close(self):
+            self.closed = True
+
+    logins = []
+
+    def login(hostname, username, password, port):
+        logins.append((hostname, username, password, port))
+        return SSHClient(), None, SFTP(), None
+    monkeypatch.setattr(paramiko, 'SSHClient', SSHClient)
+    monkeypatch.setattr(utils, 'get_login', lambda hostname, username, port: (hostname, username, 'secret', port))
+    monkeypatch.setattr(utils, 'login', login)
+    server = {'host': 'server', 'domain': 'server.org', 'user': 'user'}
+    assert isinstance(remote._connect(server), SSHClient)
+    assert logins == [('server.org', 'user', 'secret', 22)]
+    assert server['password'] == 'secret'
+    remote._connect(server)
+    assert len(logins) == 1
@@ -0,0 +1,36 @@
+import random
+from expipe_plugin_cinpla.widgets.utils import SearchIndex
+
+
+def test_search_index():
+    random.seed(0)
+    options = ['{}-{:02d}{:02d}19-{}'.format(random.choice(['1849', '1833', '1950']), day, month, session)
+               for day in range(1, 29) for month in range(1, 13) for session in range(1, 4)]
+    index = SearchIndex(options)
+    for query in ['', '1', '18', '-1', '0219', '1849-0102', 'x', '-3', '9-01']:
+        expected = sorted(set(o for o in options if query in o))
+        assert index.search(query) == (expected, len(expected))
+    matches, count = index.search('1849', limit=10)
+    assert matches == sorted(set(o for o in options if '1849' in o))[:10]
+    assert count > 10
+    allowed = set(options[:20])
+    expected = sorted(o for o in allowed if '1849' in o)
+    assert index.search('1849', allowed=allowed) == (expected, len(expected))
+
+
+def test_debouncer():
+    import asyncio
+    from expipe_plugin_cinpla.widgets.utils import Debouncer
+    calls = []
+    debounced = Debouncer(calls.append, wait=0.05)
+
+    async def type_text():
+        for value in 'abc':
+            debounced(value)
+            await asyncio.sleep(0.01)
+        assert calls == []
+        await asyncio.sleep(0.1)
+    asyncio.run(type_text())
+    assert calls == ['c']
+    debounced('d')
+    assert calls == ['c', 'd']
@@ -0,0 +1,60 @@
+import json
+import sys
+import types
+from expipe_plugin_cinpla.scripts import sorters
+
+
+def test_sorter_registry(tmp_path):
+    path = tmp_path / 'sorters.json'
+    path.write_text(json.dumps({
+        'version': sorters._spikesorters_version(),
+        'sorters': [
+            {'name': 'klusta', 'installed': True, 'default_params': {'adjacency_radius': None}},
+            {'name': 'kilosort', 'installed': False, 'default_params': {'detect_threshold': 6}},
+        ]}))
+    assert sorters.sorter_names(path=path) == ['klusta', 'kilosort']
+    assert sorters.sorter_names(installed=True, path=path) == ['klusta']
+    params = sorters.default_params('kilosort', path=path)
+    params['detect_threshold'] = 4
+    assert sorters.default_params('kilosort', path=path) == {'detect_threshold': 6}
+
+
+def test_sorter_registry_live_params(tmp_path, monkeypatch):
+    class Sorter:
+        sorter_name = 'tuples'
+
+        @staticmethod
+        def is_installed():
+            return True
+
+        @staticmethod
+        def default_params():
+            return {'detect_sign': -1, 'filter': (300, 6000)}
+
+    monkeypatch.setitem(sys.modules, 'spikesorters', types.SimpleNamespace(sorter_full_list=[Sorter]))
+    path = tmp_path / 'sorters.json'
+    sorters.refresh_sorters(path)
+    registry = json.loads(path.read_text())
+    assert registry['sorters'][0]['default_params'] == {'detect_sign': -1}
+    assert registry['sorters'][0]['live_params'] == ['filter']
+    assert sorters.default_params('tuples', path=path) == {'detect_sign': -1, 'filter': (300, 6000)}
+
+
+def test_threads_per_sorter_options():
+    import shlex
+    import click
+    from click.testing import CliRunner
+    from expipe_plugin_cinpla.cli import utils
+    from expipe_plugin_cinpla.scripts.sorting import threads_per_sorter_options
+    parsed = []
+
+    @click.command()
+    @click.option('--threads-per-sorter', multiple=True, callback=utils.validate_threads_per_sorter)
+    def process(threads_per_sorter):
+        parsed.append(threads_per_sorter)
+
+    for threads_per_sorter in [None, 4, {'klusta': 4, 'mountainsort4': 2}]:
+        args = shlex.split(threads_per_sorter_options(threads_per_sorter))
+        assert CliRunner().invoke(process, args).exit_code == 0
+        assert parsed[-1] == threads_per_sorter
+    assert CliRunner().invoke(process, ['--threads-per-sorter', 'klusta']).exit_code != 0
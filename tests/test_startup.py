@@ -0,0 +1,43 @@
+import json
+import subprocess
+import sys
+
+# modules that must not be imported to show the help
+HEAVY_MODULES = ['spikesorters', 'spiketoolkit', 'spikeextractors', 'expipe_io_neuro', 'neo',
+                 'expipe.backends.filesystem']
+
+HELP_SCRIPT = '''
+import json, sys
+import click
+from click.testing import CliRunner
+from expipe.cliutils.misc import _LazyImport
+from expipe_plugin_cinpla.cli import CinplaPlugin
+from expipe_plugin_cinpla import imports
+
+@click.group()
+def cli():
+    pass
+
+CinplaPlugin().attach_to_cli(cli)
+result = CliRunner().invoke(cli, sys.argv[1:])
+print(json.dumps({
+    'exit_code': result.exit_code,
+    'heavy': [name for name in %r if name in sys.modules],
+    # the lazy project is replaced by the project when it is loaded
+    'project_loaded': not isinstance(vars(imports)['project'], _LazyImport),
+}))
+''' % HEAVY_MODULES
+
+
+def _run_cli(tmp_path, *args):
+    # outside a project, as for `expipe --help`
+    output = subprocess.check_output([sys.executable, '-c', HELP_SCRIPT] + list(args), cwd=str(tmp_path))
+    return json.loads(output.decode().splitlines()[-1])
+
+
+def test_startup_help(tmp_path):
+    for args in [['--help'], ['process', 'openephys', '--help'], ['register', 'intan', '--help']]:
+        result = _run_cli(tmp_path, *args)
+        assert result['exit_code'] == 0
+        assert result['heavy'] == [], args
+        assert not result['project_loaded'], args
@@ -0,0 +1,55 @@
+import datetime
+import os
+from pathlib import Path
+import exdir
+import quantities as pq
+from expipe_plugin_cinpla.scripts.storage import RawDataPlacer, get_placer, register_acquisition
+
+
+def _make_files(folder):
+    (folder / 'sub').mkdir(parents=True)
+    (folder / 'a.dat').write_bytes(os.urandom(3000))
+    (folder / 'sub' / 'b.dat').write_bytes(b'b' * 100)
+
+
+def test_place_tree_hardlink(tmp_path):
+    source, target = tmp_path / 'source', tmp_path / 'target' / 'acquisition'
+    _make_files(source)
+    placer = RawDataPlacer(['hardlink'])
+    placer.place_tree(source, target)
+    assert (target / 'a.dat').read_bytes() == (source / 'a.dat').read_bytes()
+    assert os.path.samefile(str(target / 'sub' / 'b.dat'), str(source / 'sub' / 'b.dat'))
+    assert placer.placed['hardlink'][0] == 2
+    assert placer.report().startswith('Raw data hardlinked (2 files')
+
+
+def test_chunked_copy(tmp_path):
+    source, target = tmp_path / 'a.dat', tmp_path / 'b.dat'
+    source.write_bytes(os.urandom(10000))
+    placer = RawDataPlacer(['copy'], n_threads=3, chunk_size=1024)
+    assert placer.place_file(source, target) == 'copy'
+    assert target.read_bytes() == source.read_bytes()
+
+
+def test_rename_only_when_deleting():
+    assert 'rename' not in get_placer('auto').strategies
+    assert get_placer('auto', delete_raw_data=True).strategies == ['reflink', 'rename', 'copy']
+    # hardlinks only on request
+    assert 'hardlink' not in get_placer('auto').strategies
+    assert get_placer('hardlink').strategies == ['hardlink', 'copy']
+    assert get_placer('rename').strategies == ['rename', 'copy']
+
+
+def test_register_acquisition(tmp_path):
+    source = tmp_path / 'source'
+    _make_files(source)
+    placer = RawDataPlacer(['hardlink'])
+    start_time = datetime.datetime(2019, 1, 1, 12)
+    acquisition = register_acquisition(
+        tmp_path / 'main.exdir', source, session='rat_1', placer=placer, start_time=start_time,
+        duration=10 * pq.s, acquisition_system='Rhythm FPGA')
+    assert acquisition.attrs['session'] == 'rat_1'
+    assert acquisition.attrs['acquisition_system'] == 'Rhythm FPGA'
+    assert exdir.File(str(tmp_path / 'main.exdir')).attrs['session_start_time'] == '2019-01-01T12:00:00'
+    assert (Path(acquisition.directory) / 'rat_1' / 'sub' / 'b.dat').is_file()
+    assert placer.placed['hardlink'][0] == 2
@@ -0,0 +1,171 @@
+import os
+import pytest
+import subprocess
+from expipe_plugin_cinpla.scripts.transfer import (
+    LocalBackend, sync, compress_folder, extract_command, compile_spec, find_command, extract_tar,
+    send_compressed)
+
+
+def _make_files(folder):
+    (folder / 'sub').mkdir(parents=True)
+    (folder / 'a.dat').write_bytes(b'a' * 3000)
+    (folder / 'sub' / 'b.dat').write_bytes(b'b' * 100)
+    (folder / 'sub' / 'c.yaml').write_bytes(b'c')
+
+
+def test_sync(tmp_path):
+    source, dest = tmp_path / 'source', tmp_path / 'dest'
+    _make_files(source)
+    local = LocalBackend()
+    assert sorted(sync(local, local, source, dest, n_channels=2)) == ['a.dat', 'sub/b.dat', 'sub/c.yaml']
+    assert (dest / 'sub' / 'b.dat').read_bytes() == b'b' * 100
+    assert sync(local, local, source, dest) == []
+    (dest / 'sub' / 'b.dat').write_bytes(b'x' * 100)
+    assert sync(local, local, source, dest) == ['sub/b.dat']
+    assert sync(local, local, source, dest, checksum=False) == []
+    manifest = {}
+    assert sync(local, local, source, dest, manifest=manifest) == []
+    assert sorted(manifest) == ['a.dat', 'sub/b.dat', 'sub/c.yaml']
+    # corrupt server copy of the same size
+    (dest / 'sub' / 'b.dat').write_bytes(b'y' * 100)
+    os.utime(str(dest / 'sub' / 'b.dat'), ns=(0, 0))
+    assert sync(local, local, source, dest, manifest=manifest) == ['sub/b.dat']
+    manifest['a.dat']['dest'] = None
+    assert sync(local, local, source, dest, manifest=manifest) == []
+
+
+def test_sync_resume_and_include(tmp_path):
+    source, dest = tmp_path / 'source', tmp_path / 'dest'
+    _make_files(source)
+    dest.mkdir()
+    (dest / 'a.dat.part').write_bytes(b'a' * 1000)
+    local = LocalBackend()
+    assert sync(local, local, source, dest, include={'include': ['*.dat']}) == ['a.dat', 'sub/b.dat']
+    assert (dest / 'a.dat').read_bytes() == b'a' * 3000
+    assert not (dest / 'a.dat.part').exists()
+    assert not (dest / 'sub' / 'c.yaml').exists()
+
+
+def test_compressed_stream(tmp_path):
+    source, dest = tmp_path / 'source', tmp_path / 'dest' / 'acquisition'
+    _make_files(source)
+    proc = subprocess.Popen(extract_command(dest, codec='gzip'), shell=True, stdin=subprocess.PIPE)
+    raw_bytes, compressed_bytes = compress_folder(source, proc.stdin, codec='gzip', level=1)
+    proc.stdin.close()
+    assert proc.wait() == 0
+    assert compressed_bytes < raw_bytes
+    assert (dest / 'a.dat').read_bytes() == b'a' * 3000
+    assert (dest / 'sub' / 'c.yaml').read_bytes() == b'c'
+
+
+def test_include_spec(tmp_path):
+    source = tmp_path / 'source'
+    _make_files(source)
+    spec = {'include': ['*.dat', 'sub/*'], 'exclude': ['*b.dat']}
+    match = compile_spec(spec)
+    assert [match(name) for name in ['a.dat', 'sub/b.dat', 'sub/c.yaml']] == [True, False, True]
+    output = subprocess.check_output(find_command(source, spec) + r" -printf '%P\n'", shell=True)
+    assert sorted(output.decode().split()) == ['a.dat', 'sub/c.yaml']
+    assert sorted(LocalBackend().files(source, spec)) == ['a.dat', 'sub/c.yaml']
+
+
+def test_extract_tar(tmp_path):
+    import io
+    import tarfile
+    source = tmp_path / 'source'
+    _make_files(source)
+    stream = io.BytesIO()
+    with tarfile.open(fileobj=stream, mode='w') as tar:
+        tar.add(str(source), arcname='.')
+    stream.seek(0)
+    assert extract_tar(stream, tmp_path / 'dest', {'include': ['sub/*']}) == ['sub/b.dat', 'sub/c.yaml']
+    assert not (tmp_path / 'dest' / 'a.dat').exists()
+
+    for name in ['../outside.dat', '/tmp/outside.dat', 'sub/../../outside.dat']:
+        stream = io.BytesIO()
+        with tarfile.open(fileobj=stream, mode='w') as tar:
+            member = tarfile.TarInfo(name)
+            member.size = 1
+            tar.addfile(member, io.BytesIO(b'x'))
+        stream.seek(0)
+        with pytest.raises(IOError, match='outside'):
+            extract_tar(stream, tmp_path / 'dest')
+    assert not (tmp_path / 'outside.dat').exists()
+
+
+class _LocalSSH:
+    # runs the commands of SFTPBackend locally
+    def __init__(self, prefix=''):
+        self.prefix = prefix
+
+    class _Output:
+        def __init__(self, data, exit_status):
+            self.data = data
+            self.channel = self
+            self.exit_status = exit_status
+
+        def read(self):
+            return self.data
+
+        def recv_exit_status(self):
+            return self.exit_status
+
+    def exec_command(self, cmd):
+        result = subprocess.run(self.prefix + cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        return None, self._Output(result.stdout, result.returncode), self._Output(result.stderr, result.returncode)
+
+
+def test_sftp_files(tmp_path):
+    from expipe_plugin_cinpla.scripts.transfer import SFTPBackend
+    source = tmp_path / 'source'
+    _make_files(source)
+    backend = SFTPBackend(_LocalSSH())
+    assert backend.files(source) == LocalBackend().files(source)
+    assert backend.files(tmp_path / 'missing') == {}
+    # e.g. BSD find without -printf
+    backend = SFTPBackend(_LocalSSH("find() { echo 'find: -printf: unknown primary' >&2; return 1; }; "))
+    with pytest.raises(IOError, match='unknown primary'):
+        backend.files(source)
+
+
+class _PipeSSH:
+    # runs the commands of send_compressed locally through pipes
+    def __init__(self, prefix=''):
+        self.prefix = prefix
+
+    class _Stream:
+        def __init__(self, fileobj, proc):
+            self.fileobj = fileobj
+            self.proc = proc
+            self.channel = self
+
+        def write(self, data):
+            return self.fileobj.write(data)
+
+        def flush(self):
+            self.fileobj.flush()
+
+        def read(self, size=-1):
+            return self.fileobj.read(size)
+
+        def shutdown_write(self):
+            self.proc.stdin.close()
+
+        def recv_exit_status(self):
+            return self.proc.wait()
+
+    def exec_command(self, cmd):
+        proc = subprocess.Popen(self.prefix + cmd, shell=True, stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        return tuple(self._Stream(f, proc) for f in [proc.stdin, proc.stdout, proc.stderr])
+
+
+def test_send_compressed_stderr(tmp_path):
+    source, dest = tmp_path / 'source', tmp_path / 'dest'
+    _make_files(source)
+    # more warnings than a pipe holds before the server reads the stream
+    ssh = _PipeSSH('head -c 1000000 /dev/zero >&2; ')
+    send_compressed(ssh, source, dest, codec='gzip', level=1)
+    assert (dest / 'sub' / 'c.yaml').read_bytes() == b'c'
+    with pytest.raises(IOError, match='unexpected'):
+        send_compressed(_PipeSSH('cat > /dev/null; echo unexpected >&2; false && '), source, dest, codec='gzip')